@@ -1,14 +1,125 @@
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from clickhouse_driver import Client
 from datetime import datetime
 import uvicorn
+import asyncio
+import importlib
+import json
 import os
+import time
+
+from ch_pool import ClickHousePool, PoolTimeout, QueryTimeout
+from compression import CompressionMiddleware
+from metrics import Histogram, Registry, RequestMetrics, family, render
+from export import ExportResponse, ExportSlots, encode_rows, export_query, truncated_line
+from search import InvalidCursor, encode_cursor, format_results, plan_search
+from service_metrics import (
+    dependencies_query, format_dependencies, format_metrics, format_services, metrics_query, point_count,
+    RESOLUTIONS, resolution_for, services_query,
+)
+from trace_analysis import analyze_trace
+from trace_cache import TraceCache
+from trace_window import TraceSkeleton, attributes_query, skeleton_query
+
+# Version of clickhouse/init.sql this backend reads
+SCHEMA_VERSION = 7
+
+CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "clickhouse")
+CLICKHOUSE_DB = os.getenv("CLICKHOUSE_DB", "traces")
+CLICKHOUSE_POOL_SIZE = int(os.getenv("CLICKHOUSE_POOL_SIZE", "8"))
+CLICKHOUSE_ACQUIRE_TIMEOUT = float(os.getenv("CLICKHOUSE_ACQUIRE_TIMEOUT", "5"))
+CLICKHOUSE_QUERY_TIMEOUT = float(os.getenv("CLICKHOUSE_QUERY_TIMEOUT", "30"))
+# "module:callable" returning a client to use instead of clickhouse_driver's,
+# e.g. the fake client the benchmarks run against
+CLICKHOUSE_CLIENT_FACTORY = os.getenv("CLICKHOUSE_CLIENT_FACTORY")
+TRACE_CACHE_MAX_MB = int(os.getenv("TRACE_CACHE_MAX_MB", "256"))
+TRACE_CACHE_INCOMPLETE_TTL = float(os.getenv("TRACE_CACHE_INCOMPLETE_TTL", "10"))
+TRACE_SETTLE_SECONDS = float(os.getenv("TRACE_SETTLE_SECONDS", "60"))
+# Windowed /traces/{id}: spans per response, and windows' worth of spans read
+# for a trace's skeleton (about 750 bytes each while cached)
+TRACE_WINDOW_MAX_SPANS = int(os.getenv("TRACE_WINDOW_MAX_SPANS", "2000"))
+TRACE_SKELETON_MAX_WINDOWS = int(os.getenv("TRACE_SKELETON_MAX_WINDOWS", "50"))
+TRACE_SKELETON_MAX_SPANS = TRACE_WINDOW_MAX_SPANS * TRACE_SKELETON_MAX_WINDOWS
+# Responses from this size are gzip or brotli compressed; streamed ones always are
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "5"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+SEARCH_DEFAULT_WINDOW_MINUTES = int(os.getenv("SEARCH_DEFAULT_WINDOW_MINUTES", "60"))
+SEARCH_MAX_RANGE_HOURS = int(os.getenv("SEARCH_MAX_RANGE_HOURS", "168"))
+SERVICES_DEFAULT_WINDOW_MINUTES = int(os.getenv("SERVICES_DEFAULT_WINDOW_MINUTES", "60"))
+METRICS_MAX_POINTS = int(os.getenv("METRICS_MAX_POINTS", "1440"))
+# Attribute keys the collector indexes (indexed_attributes in its rules.yaml)
+INDEXED_ATTRIBUTES = frozenset(
+    k.strip() for k in os.getenv(
+        "INDEXED_ATTRIBUTES", "user.id,order.id,error.type,http.status_code,deployment.environment"
+    ).split(",") if k.strip()
+)
+# Prefix of /search and /export query parameters that filter on attributes
+ATTRIBUTE_PARAM_PREFIX = "attr."
+EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", "1000000"))
+EXPORT_MAX_RANGE_HOURS = int(os.getenv("EXPORT_MAX_RANGE_HOURS", "24"))
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_QUERY_TIMEOUT = float(os.getenv("EXPORT_QUERY_TIMEOUT", "600"))
+# Each running export holds a pooled connection until it finishes
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+
+# Retention tiers of clickhouse/init.sql: raw spans and 10s rollups, then
+# trace summaries and 60s rollups
+SPAN_RETENTION_DAYS = int(os.getenv("SPAN_RETENTION_DAYS", "7"))
+SUMMARY_RETENTION_DAYS = int(os.getenv("SUMMARY_RETENTION_DAYS", "90"))
 
 app = FastAPI(title="Tracing Backend")
-ch_client = None
+
+def create_clickhouse_client():
+    if CLICKHOUSE_CLIENT_FACTORY:
+        module, _, name = CLICKHOUSE_CLIENT_FACTORY.partition(":")
+        return getattr(importlib.import_module(module), name)()
+    return Client(host=CLICKHOUSE_HOST, database=CLICKHOUSE_DB)
+
+ch_pool = ClickHousePool(
+    create_clickhouse_client,
+    size=CLICKHOUSE_POOL_SIZE,
+    acquire_timeout=CLICKHOUSE_ACQUIRE_TIMEOUT,
+    query_timeout=CLICKHOUSE_QUERY_TIMEOUT,
+)
+
+trace_cache = TraceCache(
+    max_bytes=TRACE_CACHE_MAX_MB * 1024 * 1024,
+    incomplete_ttl=TRACE_CACHE_INCOMPLETE_TTL,
+)
+
+# Prometheus metrics
+metrics = Registry()
+http_requests = Histogram(
+    "backend_http_request_seconds", "HTTP request latency by route", labelnames=("route", "method", "status"),
+)
+metrics.register(http_requests, ch_pool.query_seconds, ch_pool.rows_read, ch_pool.bytes_read)
+
+
+def pool_metrics():
+    for name, kind, documentation, value in (
+        ("backend_clickhouse_connections_in_use", "gauge", "Pooled ClickHouse connections running a query",
+         ch_pool.stats()["in_use"]),
+        ("backend_clickhouse_acquire_timeouts_total", "counter", "Queries that found no free connection",
+         ch_pool.acquire_timeouts),
+        ("backend_clickhouse_query_timeouts_total", "counter", "Queries cancelled for running too long",
+         ch_pool.query_timeouts),
+        ("backend_trace_cache_hits_total", "counter", "/traces/{id} responses and skeletons served from the cache",
+         trace_cache.hits + trace_cache.coalesced),
+        ("backend_trace_cache_misses_total", "counter", "/traces/{id} responses and skeletons loaded from ClickHouse",
+         trace_cache.misses),
+        ("backend_trace_cache_bytes", "gauge", "Size of the cached /traces/{id} responses and skeletons", trace_cache.bytes),
+    ):
+        yield family(name, kind, documentation, [(name, {}, value)])
+
+
+metrics.register_callback(pool_metrics)
+
+export_slots = ExportSlots(EXPORT_MAX_CONCURRENT)
 
 class TraceSummary(BaseModel):
     traceId: str
@@ -19,14 +130,27 @@ class TraceSummary(BaseModel):
 
 @app.on_event("startup")
 async def startup():
-    global ch_client
     try:
-        clickhouse_host = os.getenv("CLICKHOUSE_HOST", "clickhouse")
-        ch_client = Client(host=clickhouse_host)
-        print(f"✅ Backend connected to ClickHouse at {clickhouse_host}")
+        version = (await ch_pool.execute("SELECT max(version) FROM schema_version", name="schema_version"))[0][0]
+        print(f"✅ Backend connected to ClickHouse at {CLICKHOUSE_HOST} (pool size {CLICKHOUSE_POOL_SIZE})")
+        if version != SCHEMA_VERSION:
+            print(f"⚠️ ClickHouse schema is version {version}, backend expects {SCHEMA_VERSION}")
     except Exception as e:
+        # The pool reconnects on the next query, so keep serving
         print(f"❌ Failed to connect to ClickHouse: {e}")
-        raise
+
+@app.on_event("shutdown")
+async def shutdown():
+    await ch_pool.close()
+
+app.add_middleware(RequestMetrics, histogram=http_requests)
+
+app.add_middleware(
+    CompressionMiddleware,
+    min_size=COMPRESSION_MIN_BYTES,
+    gzip_level=COMPRESSION_GZIP_LEVEL,
+    brotli_quality=COMPRESSION_BROTLI_QUALITY,
+)
 
 # Add CORS middleware
 app.add_middleware(
@@ -35,144 +159,504 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Query-Plan", "X-Export-Max-Rows"],
 )
 
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(QueryTimeout)
+async def query_timeout_handler(request, exc):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
 @app.get("/health")
 async def health():
     return {"status": "ok", "service": "backend"}
 
+@app.get("/stats")
+async def stats():
+    return {
+        "clickhouse_pool": ch_pool.stats(),
+        "trace_cache": trace_cache.stats(),
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(render(metrics.collect()), media_type="text/plain; version=0.0.4")
+
+async def load_trace(trace_id: str):
+    """Assemble the /traces/{id} response; returns (payload, complete)"""
+    spans = await ch_pool.execute("""
+        SELECT 
+            traceId,
+            spanId,
+            parentSpanId,
+            spanName as name,
+            serviceName,
+            startTimeUnixNano as startTime,
+            duration,
+            statusCode,
+            attributes,
+            resourceAttributes
+        FROM spans 
+        WHERE traceId = %(trace_id)s 
+        ORDER BY startTimeUnixNano
+        -- Copies from exporter retries until ClickHouse merges them away
+        LIMIT 1 BY spanId
+    """, {"trace_id": trace_id}, name="trace")
+    
+    if not spans:
+        return await load_trace_summary(trace_id), True
+    
+    # Convert to dict format
+    span_dicts = []
+    for span in spans:
+        span_dicts.append({
+            "traceId": span[0],
+            "spanId": span[1],
+            "parentSpanId": span[2],
+            "name": span[3],
+            "serviceName": span[4],
+            "startTime": span[5],
+            "duration": span[6],
+            "statusCode": span[7],
+            "attributes": span[8],
+            "resourceAttributes": span[9]
+        })
+    
+    # Build the span tree, critical path and self-times once, cached with the trace
+    analysis = analyze_trace(span_dicts)
+    roots = analysis["roots"] or analysis["order"][:1]
+    root_service = next(s['serviceName'] for s in span_dicts if s['spanId'] == roots[0])
+
+    # Spans stop arriving once the collector's sampling and flush delays
+    # have passed since the last span ended
+    complete = time.time_ns() - analysis["traceEnd"] > TRACE_SETTLE_SECONDS * 1_000_000_000
+    
+    return {
+        "traceId": trace_id,
+        "rootService": root_service,
+        "totalDuration": analysis["duration"],
+        "spans": span_dicts,
+        "total_spans": len(span_dicts),
+        "analysis": analysis
+    }, complete
+
+async def load_trace_summary(trace_id: str):
+    """The /traces/{id} response for a trace whose spans have expired"""
+    rows = await ch_pool.execute("""
+        SELECT
+            min(start),
+            max(end),
+            max(rootService),
+            max(rootName),
+            max(rootDuration),
+            max(hasError),
+            -- Copies from exporter retries count once; rows from before
+            -- schema version 7 only have spanCount
+            if(uniqMerge(uniqueSpans) > 0, uniqMerge(uniqueSpans), sum(spanCount)),
+            sumMap(serviceSpans)
+        FROM trace_summary
+        WHERE traceId = %(trace_id)s
+        GROUP BY traceId
+    """, {"trace_id": trace_id}, name="trace_summary")
+
+    if not rows:
+        raise HTTPException(404, "Trace not found")
+
+    start, end, root_service, root_name, root_duration, has_error, span_count, (services, counts) = rows[0]
+    return {
+        "traceId": trace_id,
+        "spansExpired": True,
+        "message": f"Spans expired after {SPAN_RETENTION_DAYS} days, summary only",
+        "rootService": root_service,
+        "rootName": root_name,
+        "startTime": start,
+        "totalDuration": end - start,
+        "rootDuration": root_duration,
+        "hasError": bool(has_error),
+        "services": dict(zip(services, counts)),
+        "spans": [],
+        "total_spans": span_count,
+    }
+
+async def build_skeleton(trace_id: str):
+    """Load a trace's skeleton for the cache; returns (skeleton, complete)"""
+    query, params = skeleton_query(trace_id, TRACE_SKELETON_MAX_SPANS)
+    rows = await ch_pool.execute(query, params, name="trace_skeleton")
+    if not rows:
+        return None, False
+    truncated = len(rows) > TRACE_SKELETON_MAX_SPANS
+    del rows[TRACE_SKELETON_MAX_SPANS:]
+    skeleton = TraceSkeleton(rows, truncated=truncated)
+    del rows
+    complete = time.time_ns() - skeleton.analysis["traceEnd"] > TRACE_SETTLE_SECONDS * 1_000_000_000
+    return skeleton, complete
+
+async def load_skeleton(trace_id: str) -> Optional[TraceSkeleton]:
+    """The trace's span tree without attributes; None when it has no spans"""
+    entry = await trace_cache.get_or_load_skeleton(trace_id, lambda: build_skeleton(trace_id))
+    return entry.skeleton
+
 @app.get("/traces/{trace_id}")
-async def get_trace(trace_id: str):
+async def get_trace(
+    trace_id: str,
+    request: Request,
+    depth: Optional[int] = Query(None, ge=1, description="Windowed: only the top levels of the span tree"),
+    start_ns: Optional[int] = Query(None, description="Windowed: only spans ending after this, Unix nanoseconds"),
+    end_ns: Optional[int] = Query(None, description="Windowed: only spans starting before this, Unix nanoseconds"),
+    limit: int = Query(TRACE_WINDOW_MAX_SPANS, ge=1, le=TRACE_WINDOW_MAX_SPANS, description="Windowed: most spans returned"),
+):
+    """The whole trace, or with any of depth/start_ns/end_ns a window of it.
+
+    A window lists spans in tree pre-order without their attributes (see
+    /traces/{id}/spans/{span_id}/attributes), each with ``hiddenChildren``
+    to expand through /traces/{id}/spans/{span_id}/children.
+    """
+    if depth is not None or start_ns is not None or end_ns is not None:
+        return await get_trace_window(trace_id, depth, start_ns, end_ns, limit)
+
     try:
-        spans = ch_client.execute("""
-            SELECT 
-                traceId,
-                spanId,
-                parentSpanId,
-                name,
-                serviceName,
-                startTimeUnixNano as startTime,
-                duration,
-                statusCode,
-                attributes
-            FROM spans 
-            WHERE traceId = %(trace_id)s 
-            ORDER BY startTimeUnixNano
-        """, {"trace_id": trace_id})
-        
-        if not spans:
-            raise HTTPException(404, "Trace not found")
-        
-        # Convert to dict format
-        span_dicts = []
-        for span in spans:
-            span_dicts.append({
-                "traceId": span[0],
-                "spanId": span[1],
-                "parentSpanId": span[2],
-                "name": span[3],
-                "serviceName": span[4],
-                "startTime": span[5],
-                "duration": span[6],
-                "statusCode": span[7],
-                "attributes": span[8]
-            })
-        
-        # Calculate trace summary
-        root_service = span_dicts[0]['serviceName'] if span_dicts else "unknown"
-        total_duration = max([s['duration'] for s in span_dicts]) if span_dicts else 0
-        
-        return {
-            "traceId": trace_id,
-            "rootService": root_service,
-            "totalDuration": total_duration,
-            "spans": span_dicts,
-            "total_spans": len(span_dicts)
-        }
-    except HTTPException:
+        entry = await trace_cache.get_or_load(trace_id, lambda: load_trace(trace_id))
+    except (HTTPException, PoolTimeout, QueryTimeout):
         raise
     except Exception as e:
         print(f"❌ Error fetching trace: {e}")
         raise HTTPException(500, f"Error fetching trace: {str(e)}")
 
+    headers = {
+        "ETag": entry.etag,
+        # Complete traces never change; others must be revalidated
+        "Cache-Control": "public, max-age=86400, immutable" if entry.complete else "no-cache",
+    }
+    # Weak comparison: compressed responses carry the ETag as W/"..."
+    if entry.etag in (tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")):
+        trace_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+async def get_trace_window(trace_id: str, depth: Optional[int], start_ns: Optional[int],
+                           end_ns: Optional[int], limit: int):
+    if start_ns is not None and end_ns is not None and start_ns > end_ns:
+        raise HTTPException(400, "start_ns must not be after end_ns")
+    try:
+        skeleton = await load_skeleton(trace_id)
+        if skeleton is None:
+            return await load_trace_summary(trace_id)
+    except (HTTPException, PoolTimeout, QueryTimeout):
+        raise
+    except Exception as e:
+        print(f"❌ Error fetching trace window: {e}")
+        raise HTTPException(500, f"Error fetching trace window: {str(e)}")
+
+    selection = skeleton.window(depth, start_ns, end_ns)
+    header = skeleton.header(trace_id)
+    header["window"] = {
+        "depth": depth,
+        "start": start_ns,
+        "end": end_ns,
+        "spans": len(selection),
+        # Pre-order keeps every returned span's ancestors in a truncated window
+        "truncated": len(selection) > limit,
+    }
+    return StreamingResponse(skeleton.encode(header, selection[:limit]), media_type="application/json")
+
+@app.get("/traces/{trace_id}/spans/{span_id}/children")
+async def get_span_children(
+    trace_id: str,
+    span_id: str,
+    depth: int = Query(1, ge=1, description="Levels below the span"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(TRACE_WINDOW_MAX_SPANS, ge=1, le=TRACE_WINDOW_MAX_SPANS),
+):
+    """The spans below one span of a windowed trace, in pre-order, a page at a time"""
+    try:
+        skeleton = await load_skeleton(trace_id)
+    except (PoolTimeout, QueryTimeout):
+        raise
+    except Exception as e:
+        print(f"❌ Error fetching span children: {e}")
+        raise HTTPException(500, f"Error fetching span children: {str(e)}")
+
+    subtree = skeleton.subtree(span_id, depth) if skeleton is not None else None
+    if subtree is None:
+        raise HTTPException(404, "Span not found")
+    header = {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "depth": depth,
+        "offset": offset,
+        "total": len(subtree),
+        "nextOffset": offset + limit if offset + limit < len(subtree) else None,
+    }
+    return StreamingResponse(skeleton.encode(header, subtree[offset:offset + limit]), media_type="application/json")
+
+@app.get("/traces/{trace_id}/spans/{span_id}/attributes")
+async def get_span_attributes(trace_id: str, span_id: str):
+    """Attributes of one span, which windowed traces leave out"""
+    try:
+        query, params = attributes_query(trace_id, span_id)
+        rows = await ch_pool.execute(query, params, name="span_attributes")
+    except (PoolTimeout, QueryTimeout):
+        raise
+    except Exception as e:
+        print(f"❌ Error fetching span attributes: {e}")
+        raise HTTPException(500, f"Error fetching span attributes: {str(e)}")
+
+    if not rows:
+        raise HTTPException(404, "Span not found")
+    attributes, resource_attributes, status_message = rows[0]
+    return {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "attributes": attributes,
+        "resourceAttributes": resource_attributes,
+        "statusMessage": status_message,
+    }
+
+def attribute_filters(request: Request):
+    """attr.<key>=<value> query parameters, e.g. attr.user.id=42"""
+    return {
+        name[len(ATTRIBUTE_PARAM_PREFIX):]: value
+        for name, value in request.query_params.multi_items()
+        if name.startswith(ATTRIBUTE_PARAM_PREFIX) and len(name) > len(ATTRIBUTE_PARAM_PREFIX)
+    }
+
 @app.get("/search")
 async def search_traces(
-    limit: int = Query(20, le=100),
+    request: Request,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    start: Optional[int] = Query(None, description="Range start, Unix milliseconds (default: end - SEARCH_DEFAULT_WINDOW_MINUTES)"),
+    end: Optional[int] = Query(None, description="Range end, Unix milliseconds (default: now)"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
     service: Optional[str] = None,
+    operation: Optional[str] = None,
     status: Optional[str] = None,
-    min_duration: Optional[int] = None
+    min_duration: Optional[int] = Query(None, description="Trace duration, first span start to last span end, ns"),
+    max_duration: Optional[int] = Query(None, description="Trace duration, first span start to last span end, ns"),
 ):
+    """Traces in a time range, newest first.
+
+    Duration filters apply to whole traces and run after their hourly
+    summaries are merged, so unlike ``status=ERROR`` they don't narrow
+    what is read.
+    """
+    end = end if end is not None else int(time.time() * 1000)
+    start = start if start is not None else end - SEARCH_DEFAULT_WINDOW_MINUTES * 60_000
+    if start > end:
+        raise HTTPException(400, "start must not be after end")
+    if end - start > SEARCH_MAX_RANGE_HOURS * 3_600_000:
+        raise HTTPException(400, f"Time range exceeds {SEARCH_MAX_RANGE_HOURS} hours")
+
+    error = None
+    if status:
+        error = status.upper() == "ERROR"
+
     try:
-        query = """
-            SELECT 
-                traceId,
-                argMax(serviceName, startTimeUnixNano) as rootService,
-                max(duration) as totalDuration,
-                max(statusCode != 'OK') as hasError,
-                groupArray(DISTINCT serviceName) as services
-            FROM spans
-        """
-        
-        conditions = []
-        params = {"limit": limit}
-        
-        if service:
-            conditions.append("serviceName = %(service)s")
-            params["service"] = service
-        
-        if status:
-            if status.upper() == "ERROR":
-                conditions.append("statusCode = 'ERROR'")
-            else:
-                conditions.append("statusCode = %(status)s")
-                params["status"] = status.upper()
-        
-        if min_duration:
-            conditions.append("duration >= %(min_duration)s")
-            params["min_duration"] = min_duration
-        
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
-        
-        query += """
-            GROUP BY traceId
-            ORDER BY max(startTimeUnixNano) DESC
-            LIMIT %(limit)s
-        """
-        
-        traces = ch_client.execute(query, params)
-        
-        # Convert to proper format
-        result = []
-        for trace in traces:
-            result.append({
-                "traceId": trace[0],
-                "rootService": trace[1],
-                "totalDuration": trace[2],
-                "hasError": bool(trace[3]),
-                "services": trace[4]
-            })
-        
-        return result
+        query, params, plan = plan_search(
+            start, end, limit,
+            service=service,
+            operation=operation,
+            error=error,
+            min_duration=min_duration,
+            max_duration=max_duration,
+            cursor=cursor,
+            attributes=attribute_filters(request),
+            indexed_keys=INDEXED_ATTRIBUTES,
+        )
+        traces = format_results(await ch_pool.execute(query, params, name=f"search_{plan}"))
+    except InvalidCursor as e:
+        raise HTTPException(400, str(e))
+    except (PoolTimeout, QueryTimeout):
+        raise
     except Exception as e:
         print(f"❌ Error searching traces: {e}")
         raise HTTPException(500, f"Error searching traces: {str(e)}")
 
+    response.headers["X-Query-Plan"] = plan
+    if len(traces) == limit:
+        last = traces[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["startTime"], last["traceId"])
+    return traces
+
+@app.get("/export")
+async def export_spans(
+    request: Request,
+    start: int = Query(..., description="Range start, Unix milliseconds"),
+    end: int = Query(..., description="Range end, Unix milliseconds"),
+    max_rows: int = Query(EXPORT_MAX_ROWS, ge=1, le=EXPORT_MAX_ROWS),
+    service: Optional[str] = None,
+    operation: Optional[str] = None,
+    status: Optional[str] = None,
+    min_duration: Optional[int] = None,
+    max_duration: Optional[int] = None
+):
+    """Stream the spans in a time range as NDJSON, one span per line.
+
+    Filters apply to each span. An export that hits ``max_rows`` ends with
+    a {"truncated": true} line, and one that fails part way with an
+    {"error": ...} line. Disconnecting cancels the query.
+    """
+    if start > end:
+        raise HTTPException(400, "start must not be after end")
+    if end - start > EXPORT_MAX_RANGE_HOURS * 3_600_000:
+        raise HTTPException(400, f"Time range exceeds {EXPORT_MAX_RANGE_HOURS} hours")
+
+    query, params = export_query(
+        start, end, max_rows,
+        service=service,
+        operation=operation,
+        error=status.upper() == "ERROR" if status else None,
+        min_duration=min_duration,
+        max_duration=max_duration,
+        attributes=attribute_filters(request),
+        indexed_keys=INDEXED_ATTRIBUTES,
+    )
+    if not export_slots.try_acquire():
+        return JSONResponse(
+            status_code=503,
+            content={"detail": f"{EXPORT_MAX_CONCURRENT} exports already running"},
+            headers={"Retry-After": "10"},
+        )
+
+    chunks = ch_pool.execute_iter(
+        query, params, chunk_rows=EXPORT_CHUNK_ROWS, timeout=EXPORT_QUERY_TIMEOUT, name="export",
+    )
+    released = False
+
+    async def cleanup():
+        nonlocal released
+        if released:
+            return
+        released = True
+        try:
+            # Cancels the query if the stream ended early
+            await chunks.aclose()
+        finally:
+            export_slots.release()
+
+    # Fetch the first chunk up front so a failing query still gets an error status
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = []
+    except (PoolTimeout, QueryTimeout):
+        await cleanup()
+        raise
+    except Exception as e:
+        await cleanup()
+        print(f"❌ Error exporting spans: {e}")
+        raise HTTPException(500, f"Error exporting spans: {str(e)}")
+    except BaseException:
+        await asyncio.shield(cleanup())
+        raise
+
+    async def body():
+        sent = 0
+        truncated = False
+        try:
+            chunk = first
+            while True:
+                # The query asks for one row past the cap to detect truncation
+                if len(chunk) > max_rows - sent:
+                    chunk = chunk[:max_rows - sent]
+                    truncated = True
+                if chunk:
+                    sent += len(chunk)
+                    yield encode_rows(chunk)
+                chunk = await anext(chunks, None)
+                if chunk is None:
+                    break
+            if truncated:
+                yield truncated_line(max_rows)
+        except Exception as e:
+            print(f"❌ Export failed after {sent} spans: {e}")
+            yield json.dumps({"error": str(e)}).encode() + b"\n"
+
+    # The slot and the query are released when the response ends, even if
+    # the client goes away before the body is read
+    return ExportResponse(body(), cleanup, headers={"X-Export-Max-Rows": str(max_rows)})
+
+def time_range(start: Optional[int], end: Optional[int], default_minutes: int):
+    """Resolve optional Unix-ms bounds to (start, end) in Unix seconds"""
+    end = end if end is not None else int(time.time() * 1000)
+    start = start if start is not None else end - default_minutes * 60_000
+    if start > end:
+        raise HTTPException(400, "start must not be after end")
+    return start // 1000, end // 1000
+
+def min_rollup_resolution(start_s: int) -> int:
+    """10s rollups expire with raw spans; ranges older than that read the 60s ones"""
+    if start_s < time.time() - SPAN_RETENTION_DAYS * 86400:
+        return RESOLUTIONS[-1]
+    return RESOLUTIONS[0]
+
 @app.get("/services")
-async def list_services():
+async def list_services(
+    start: Optional[int] = Query(None, description="Range start, Unix milliseconds (default: end - SERVICES_DEFAULT_WINDOW_MINUTES)"),
+    end: Optional[int] = Query(None, description="Range end, Unix milliseconds (default: now)"),
+):
+    start_s, end_s = time_range(start, end, SERVICES_DEFAULT_WINDOW_MINUTES)
     try:
-        services = ch_client.execute("""
-            SELECT DISTINCT serviceName, count() as spanCount
-            FROM spans
-            GROUP BY serviceName
-            ORDER BY spanCount DESC
-        """)
-        
-        return [{"name": s[0], "spanCount": s[1]} for s in services]
+        query, params = services_query(start_s, end_s, min_rollup_resolution(start_s))
+        return format_services(await ch_pool.execute(query, params, name="services"))
+    except (PoolTimeout, QueryTimeout):
+        raise
     except Exception as e:
         print(f"❌ Error listing services: {e}")
         raise HTTPException(500, f"Error listing services: {str(e)}")
 
+@app.get("/services/{name}/metrics")
+async def service_metrics(
+    name: str,
+    start: Optional[int] = Query(None, description="Range start, Unix milliseconds (default: end - SERVICES_DEFAULT_WINDOW_MINUTES)"),
+    end: Optional[int] = Query(None, description="Range end, Unix milliseconds (default: now)"),
+    step: int = Query(60, ge=10, description="Seconds per point, a multiple of 10"),
+    operation: Optional[str] = None,
+):
+    start_s, end_s = time_range(start, end, SERVICES_DEFAULT_WINDOW_MINUTES)
+    min_resolution = min_rollup_resolution(start_s)
+    if resolution_for(step, min_resolution) is None:
+        raise HTTPException(400, f"step must be a multiple of {min_resolution} seconds for this range")
+    if point_count(start_s, end_s, step) > METRICS_MAX_POINTS:
+        raise HTTPException(400, f"Range and step give more than {METRICS_MAX_POINTS} points")
+
+    try:
+        query, params = metrics_query(name, start_s, end_s, step, operation, min_resolution)
+        rows = await ch_pool.execute(query, params, name="service_metrics")
+    except (PoolTimeout, QueryTimeout):
+        raise
+    except Exception as e:
+        print(f"❌ Error fetching service metrics: {e}")
+        raise HTTPException(500, f"Error fetching service metrics: {str(e)}")
+
+    return {
+        "service": name,
+        "operation": operation,
+        "step": step,
+        "resolution": params["resolution"],
+        "points": format_metrics(rows, start_s, end_s, step),
+    }
+
+@app.get("/dependencies")
+async def service_dependencies(
+    start: Optional[int] = Query(None, description="Range start, Unix milliseconds (default: end - SERVICES_DEFAULT_WINDOW_MINUTES)"),
+    end: Optional[int] = Query(None, description="Range end, Unix milliseconds (default: now)"),
+    service: Optional[str] = Query(None, description="Only calls to or from this service"),
+):
+    start_s, end_s = time_range(start, end, SERVICES_DEFAULT_WINDOW_MINUTES)
+    try:
+        query, params = dependencies_query(start_s, end_s, service)
+        graph = format_dependencies(await ch_pool.execute(query, params, name="dependencies"))
+    except (PoolTimeout, QueryTimeout):
+        raise
+    except Exception as e:
+        print(f"❌ Error fetching dependencies: {e}")
+        raise HTTPException(500, f"Error fetching dependencies: {str(e)}")
+    return {"start": start_s * 1000, "end": end_s * 1000, **graph}
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8002)
 
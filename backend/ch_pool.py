@@ -0,0 +1,283 @@
+import asyncio
+import functools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from metrics import Counter, Histogram
+
+
+class PoolTimeout(Exception):
+    """No connection became free within the acquire timeout"""
+
+
+class QueryTimeout(Exception):
+    """A query ran longer than its timeout and was cancelled"""
+
+
+class ClickHousePool:
+    """Bounded pool of ClickHouse clients used from async routes.
+
+    Each query borrows a client, runs the blocking ``execute`` on a worker
+    thread and hands the client back, so concurrent requests run in parallel
+    instead of queueing on one socket. Queries that time out or whose request
+    is cancelled get a Cancel packet sent to the server; clients that don't
+    recover within ``cancel_grace`` seconds are disconnected and replaced.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Any],
+        size: int = 8,
+        acquire_timeout: float = 5.0,
+        query_timeout: float = 30.0,
+        cancel_grace: float = 5.0,
+    ):
+        self.client_factory = client_factory
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.query_timeout = query_timeout
+        self.cancel_grace = cancel_grace
+
+        self._idle: deque = deque()
+        # Idle clients plus clients not yet created; every release or
+        # discard frees a slot, so waiters wake up either way
+        self._free: Optional[asyncio.Semaphore] = None
+        self._created = 0
+        # Extra threads so a query being cancelled never starves the pool
+        self._executor = ThreadPoolExecutor(max_workers=size * 2, thread_name_prefix="ch-pool")
+
+        self.queries = 0
+        self.query_errors = 0
+        self.query_timeouts = 0
+        self.acquire_timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.query_seconds = Histogram(
+            "backend_clickhouse_query_seconds", "ClickHouse query time by query", labelnames=("query",),
+        )
+        self.rows_read = Counter(
+            "backend_clickhouse_rows_read_total", "Rows ClickHouse read to answer each query", labelnames=("query",),
+        )
+        self.bytes_read = Counter(
+            "backend_clickhouse_bytes_read_total", "Bytes ClickHouse read to answer each query", labelnames=("query",),
+        )
+        self.query_seconds_total = 0.0
+        self.query_seconds_max = 0.0
+
+    async def execute(self, query: str, params: Optional[Dict[str, Any]] = None,
+                      timeout: Optional[float] = None, name: str = "other", **kwargs):
+        """Run ``client.execute`` on a pooled connection.
+
+        ``name`` labels the query's metrics, so it must come from a small set.
+        """
+        timeout = self.query_timeout if timeout is None else timeout
+        client = await self._acquire()
+        settings = dict(kwargs.pop("settings", None) or {})
+        # Let the server give up too, in case the Cancel packet is lost
+        settings.setdefault("max_execution_time", int(timeout) + 1)
+        call = functools.partial(_execute, client, query, params, settings, kwargs)
+
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        future = loop.run_in_executor(self._executor, call)
+        try:
+            result, (rows_read, bytes_read) = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.query_timeouts += 1
+            self._cancel(client, future)
+            raise QueryTimeout(f"Query exceeded {timeout}s")
+        except asyncio.CancelledError:
+            self._cancel(client, future)
+            raise
+        except Exception:
+            self.query_errors += 1
+            self._release(client)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.query_seconds_total += elapsed
+            self.query_seconds_max = max(self.query_seconds_max, elapsed)
+            self.query_seconds.labels(name).observe(elapsed)
+
+        self._release(client)
+        self.rows_read.labels(name).inc(rows_read)
+        self.bytes_read.labels(name).inc(bytes_read)
+        return result
+
+    async def execute_iter(self, query: str, params: Optional[Dict[str, Any]] = None,
+                           chunk_rows: int = 10000, timeout: Optional[float] = None,
+                           name: str = "other", **kwargs) -> AsyncIterator[List[tuple]]:
+        """Stream the rows of a query in lists of up to ``chunk_rows``.
+
+        The pooled client is held until the generator is exhausted or
+        closed; closing it early cancels the query on the server.
+        ``timeout`` bounds the whole query on the server and each wait for
+        a chunk here.
+        """
+        timeout = self.query_timeout if timeout is None else timeout
+        client = await self._acquire()
+        settings = dict(kwargs.pop("settings", None) or {})
+        settings.setdefault("max_execution_time", int(timeout) + 1)
+        # Blocks no larger than a chunk keep the driver's buffering bounded
+        settings.setdefault("max_block_size", chunk_rows)
+
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        rows = None
+        future = loop.run_in_executor(self._executor, functools.partial(
+            client.execute_iter, query, params, settings=settings, chunk_size=chunk_rows, **kwargs
+        ))
+        finished = failed = False
+        try:
+            while True:
+                chunk = await asyncio.wait_for(asyncio.shield(future), timeout)
+                if rows is None:
+                    rows = chunk
+                elif chunk is None:
+                    break
+                else:
+                    yield chunk
+                future = loop.run_in_executor(self._executor, next, rows, None)
+            finished = True
+        except asyncio.TimeoutError:
+            self.query_timeouts += 1
+            raise QueryTimeout(f"Query exceeded {timeout}s")
+        except Exception:
+            self.query_errors += 1
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.query_seconds_total += elapsed
+            self.query_seconds_max = max(self.query_seconds_max, elapsed)
+            self.query_seconds.labels(name).observe(elapsed)
+            if finished:
+                progress = getattr(getattr(client, "last_query", None), "progress", None)
+                if progress is not None:
+                    self.rows_read.labels(name).inc(progress.rows)
+                    self.bytes_read.labels(name).inc(progress.bytes)
+                self._release(client)
+            elif failed:
+                # The client reconnects on next use
+                self._release(client)
+            else:
+                # Timed out, or the consumer went away mid-stream
+                self._cancel_iter(client, future, rows)
+
+    def stats(self) -> Dict[str, Any]:
+        idle = len(self._idle)
+        return {
+            "size": self.size,
+            "created": self._created,
+            "idle": idle,
+            "in_use": self._created - idle,
+            "queries": self.queries,
+            "query_errors": self.query_errors,
+            "query_timeouts": self.query_timeouts,
+            "acquire_timeouts": self.acquire_timeouts,
+            "wait_ms_avg": round(self.wait_seconds_total / self.queries * 1000, 3) if self.queries else 0.0,
+            "wait_ms_max": round(self.wait_seconds_max * 1000, 3),
+            "query_ms_avg": round(self.query_seconds_total / self.queries * 1000, 3) if self.queries else 0.0,
+            "query_ms_max": round(self.query_seconds_max * 1000, 3),
+        }
+
+    async def close(self):
+        while self._idle:
+            self._idle.popleft().disconnect()
+        self._executor.shutdown(wait=False)
+
+    async def _acquire(self):
+        if self._free is None:
+            self._free = asyncio.Semaphore(self.size)
+        started = time.perf_counter()
+        try:
+            try:
+                await asyncio.wait_for(self._free.acquire(), self.acquire_timeout)
+            except asyncio.TimeoutError:
+                self.acquire_timeouts += 1
+                raise PoolTimeout(f"No ClickHouse connection free after {self.acquire_timeout}s")
+            if self._idle:
+                return self._idle.popleft()
+            # A client was discarded or never created; replace it
+            self._created += 1
+            try:
+                return self.client_factory()
+            except Exception:
+                self._created -= 1
+                self._free.release()
+                raise
+        finally:
+            waited = time.perf_counter() - started
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def _release(self, client):
+        self._idle.append(client)
+        self._free.release()
+
+    def _discard(self, client):
+        self._created -= 1
+        self._free.release()
+        try:
+            client.disconnect()
+        except Exception:
+            pass
+
+    def _cancel(self, client, future: asyncio.Future):
+        """Ask the server to stop the query and reclaim the client once it has"""
+        try:
+            client.connection.send_cancel()
+        except Exception:
+            self._discard(client)
+            return
+        asyncio.ensure_future(self._reclaim(client, future))
+
+    def _cancel_iter(self, client, future: asyncio.Future, rows):
+        """Cancel a streaming query left unfinished and reclaim the client
+        once the rest of its result has been drained"""
+        try:
+            client.connection.send_cancel()
+        except Exception:
+            self._discard(client)
+            return
+        asyncio.ensure_future(self._reclaim(client, self._drain(future, rows)))
+
+    async def _drain(self, future: asyncio.Future, rows):
+        # The pending fetch must finish before the generator can be resumed
+        try:
+            await future
+        except Exception:
+            pass
+        if rows is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, _exhaust, rows)
+
+    async def _reclaim(self, client, future: asyncio.Future):
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.cancel_grace)
+        except asyncio.TimeoutError:
+            self._discard(client)
+            return
+        except Exception:
+            # The cancelled query raising is expected; the client reconnects on next use
+            pass
+        self._release(client)
+
+
+def _execute(client, query: str, params, settings: Dict[str, Any], kwargs: Dict[str, Any]) -> Tuple[Any, Tuple[int, int]]:
+    """``client.execute``, plus the rows and bytes the server reported reading"""
+    result = client.execute(query, params, settings=settings, **kwargs)
+    progress = getattr(getattr(client, "last_query", None), "progress", None)
+    return result, (progress.rows, progress.bytes) if progress is not None else (0, 0)
+
+
+def _exhaust(rows):
+    try:
+        for _ in rows:
+            pass
+    except Exception:
+        # The cancelled query raising is expected
+        pass
@@ -0,0 +1,151 @@
+"""Response compression negotiated on Accept-Encoding.
+
+Brotli is preferred when the ``brotli`` package is installed, then gzip.
+Streamed responses are compressed as they are sent: each body chunk is
+flushed through the compressor, so a client sees data as soon as the
+endpoint produces it and neither side holds the whole body. Responses that
+arrive in one piece are compressed only from ``min_size`` bytes.
+
+The ETag of a compressed response is made weak, since its bytes differ
+from the identity encoding's; If-None-Match uses weak comparison anyway.
+"""
+import zlib
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        # wbits 31: gzip header and trailer
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        out = self._z.compress(data)
+        return out + self._z.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class _Brotli:
+    def __init__(self, quality: int):
+        self._b = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        out = self._b.process(data)
+        return out + (self._b.finish() if final else self._b.flush())
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """The encoding to answer with, or None for identity"""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def _vary(headers):
+    """``headers`` with Accept-Encoding added to Vary"""
+    vary = [v for k, v in headers if k == b"vary"]
+    value = b", ".join(vary + [b"Accept-Encoding"])
+    return [(k, v) for k, v in headers if k != b"vary"] + [(b"vary", value)]
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing JSON and text responses"""
+
+    def __init__(self, app, min_size: int = 1024, gzip_level: int = 5, brotli_quality: int = 4):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # Held until the first body message shows whether to compress
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if start is not None:
+                headers = start["headers"]
+                if self._compressible(start["status"], headers, len(body), more):
+                    compressor = _Brotli(self.brotli_quality) if encoding == "br" else _Gzip(self.gzip_level)
+                    headers = [
+                        (k, v) for k, v in _vary(headers) if k not in (b"content-length", b"etag")
+                    ] + [
+                        (b"content-encoding", encoding.encode()),
+                    ] + [
+                        (b"etag", v if v.startswith(b"W/") else b"W/" + v)
+                        for k, v in headers if k == b"etag"
+                    ]
+                    if not more:
+                        body = compressor.compress(body, final=True)
+                        headers.append((b"content-length", str(len(body)).encode()))
+                        compressor = None
+                    else:
+                        body = compressor.compress(body, final=False)
+                else:
+                    headers = _vary(headers)
+                await send({**start, "headers": headers})
+                start = None
+                await send({**message, "body": body})
+                return
+            if compressor is not None:
+                body = compressor.compress(body, final=not more)
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_wrapper)
+        if start is not None:
+            # The app ended without a body message
+            await send(start)
+
+    def _compressible(self, status: int, headers, size: int, streaming: bool) -> bool:
+        if status < 200 or status in (204, 304):
+            return False
+        content_type = b""
+        for k, v in headers:
+            if k == b"content-encoding":
+                return False
+            if k == b"content-type":
+                content_type = v
+        if not content_type.decode("latin-1").startswith(COMPRESSIBLE_TYPES):
+            return False
+        return streaming or size >= self.min_size
@@ -0,0 +1,147 @@
+"""Query building, encoding and responses for /export.
+
+An export reads raw ``spans`` for a time range and streams them back as
+NDJSON, one span per line, in the shape of a /traces/{id} span. Filters
+apply to each span, not to its trace. The query has no ORDER BY, so
+ClickHouse streams blocks as it reads them instead of sorting the whole
+result first; rows arrive roughly in primary key order (service, span name,
+time).
+"""
+import json
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+
+NS_PER_MS = 1_000_000
+
+COLUMNS = (
+    ("traceId", "traceId"),
+    ("spanId", "spanId"),
+    ("parentSpanId", "parentSpanId"),
+    ("spanName", "name"),
+    ("serviceName", "serviceName"),
+    ("startTimeUnixNano", "startTime"),
+    ("duration", "duration"),
+    ("statusCode", "statusCode"),
+    ("statusMessage", "statusMessage"),
+    ("attributes", "attributes"),
+    ("resourceAttributes", "resourceAttributes"),
+)
+
+
+def export_query(
+    start_ms: int,
+    end_ms: int,
+    max_rows: int,
+    service: Optional[str] = None,
+    operation: Optional[str] = None,
+    error: Optional[bool] = None,
+    min_duration: Optional[int] = None,
+    max_duration: Optional[int] = None,
+    attributes: Optional[Dict[str, str]] = None,
+    indexed_keys: FrozenSet[str] = frozenset(),
+) -> Tuple[str, Dict[str, Any]]:
+    """Build the export query; returns (query, params).
+
+    One row more than ``max_rows`` is requested so a truncated export can
+    be told apart from one that fit exactly.
+    """
+    params: Dict[str, Any] = {
+        "start": start_ms * NS_PER_MS,
+        "end": end_ms * NS_PER_MS,
+        "start_s": start_ms // 1000,
+        "end_s": end_ms // 1000,
+        "limit": max_rows + 1,
+    }
+    where = [
+        # timestamp is in the primary key and the partition key
+        "timestamp >= toDateTime(%(start_s)s)",
+        "timestamp <= toDateTime(%(end_s)s)",
+        "startTimeUnixNano >= %(start)s",
+        "startTimeUnixNano <= %(end)s",
+    ]
+    if service:
+        where.append("serviceName = %(service)s")
+        params["service"] = service
+    if operation:
+        where.append("spanName = %(operation)s")
+        params["operation"] = operation
+    if error is not None:
+        where.append("hasError = %(error)s")
+        params["error"] = int(error)
+    if min_duration:
+        where.append("duration >= %(min_duration)s")
+        params["min_duration"] = min_duration
+    if max_duration:
+        where.append("duration <= %(max_duration)s")
+        params["max_duration"] = max_duration
+
+    for i, (key, value) in enumerate(sorted((attributes or {}).items())):
+        params[f"attr_key_{i}"] = key
+        params[f"attr_value_{i}"] = value
+        if key in indexed_keys:
+            # The collector copies indexed keys into a map; no JSON parsing
+            where.append(f"indexedAttributes[%(attr_key_{i})s] = %(attr_value_{i})s")
+        else:
+            where.append(
+                f"(JSONExtractString(attributes, %(attr_key_{i})s) = %(attr_value_{i})s"
+                f" OR resourceAttributes[%(attr_key_{i})s] = %(attr_value_{i})s)"
+            )
+
+    query = f"""
+        SELECT {', '.join(column for column, _ in COLUMNS)}
+        FROM spans
+        WHERE {' AND '.join(where)}
+        LIMIT %(limit)s
+    """
+    return query, params
+
+
+def encode_rows(rows: Iterable[tuple]) -> bytes:
+    """NDJSON lines for a chunk of export rows"""
+    names = [name for _, name in COLUMNS]
+    return b"".join(
+        json.dumps(dict(zip(names, row)), separators=(",", ":")).encode() + b"\n"
+        for row in rows
+    )
+
+
+def truncated_line(max_rows: int) -> bytes:
+    """Last line of an export that hit the row cap"""
+    return json.dumps({"truncated": True, "maxRows": max_rows}, separators=(",", ":")).encode() + b"\n"
+
+
+class ExportSlots:
+    """Limit on concurrent exports; taking a slot never waits"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.running = 0
+
+    def try_acquire(self) -> bool:
+        if self.running >= self.limit:
+            return False
+        self.running += 1
+        return True
+
+    def release(self):
+        self.running -= 1
+
+
+class ExportResponse(StreamingResponse):
+    """NDJSON stream that runs ``cleanup`` however the response ends.
+
+    A generator's ``finally`` only runs once it has been iterated, so a
+    client that disconnects before the body starts would otherwise keep
+    the export's slot and pooled connection.
+    """
+
+    def __init__(self, content, cleanup: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(content, media_type="application/x-ndjson", **kwargs)
+        self.cleanup = cleanup
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.cleanup()
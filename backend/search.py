@@ -0,0 +1,179 @@
+"""Query planning for /search.
+
+Every search is bounded to a time range and reads ``trace_summary``. The
+bucket range is part of the primary key and the partition key, so old data
+is never touched. Filters that can't be answered from trace-level
+summaries, such as the operation (span name) of any span, add a prefilter
+on raw ``spans`` within the same time range. Attribute filters on indexed
+keys read ``attribute_index`` instead, which is ordered by (key, value), so
+they cost a few granules however selective they are; other keys fall back
+to scanning raw spans. The resulting plan is "summary", "index" or "raw".
+
+``error=True`` first selects the traces with an error in any of their
+hourly rows, reading only ``hasError``, so just those are aggregated.
+``min_duration``/``max_duration`` apply to the trace's duration (first
+span start to last span end, in nanoseconds), which is only known after
+a trace's rows from every hour are merged. Those filters therefore run
+after aggregation and can't narrow the scan. Before trace_summary they
+filtered the duration of individual spans.
+
+Pages are ordered by (trace start, traceId) descending. The cursor is the
+last row of the previous page, so deep pages cost the same as the first.
+"""
+import base64
+import json
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+NS_PER_MS = 1_000_000
+
+# Traces are summarized per hour of span arrival; look one bucket past the
+# range end so traces that cross an hour boundary stay complete
+BUCKET_SLACK = "INTERVAL 1 HOUR"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(start_time: int, trace_id: str) -> str:
+    raw = json.dumps([start_time, trace_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        start_time, trace_id = json.loads(raw)
+        return int(start_time), str(trace_id)
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+
+
+def plan_search(
+    start_ms: int,
+    end_ms: int,
+    limit: int,
+    service: Optional[str] = None,
+    operation: Optional[str] = None,
+    error: Optional[bool] = None,
+    min_duration: Optional[int] = None,
+    max_duration: Optional[int] = None,
+    cursor: Optional[str] = None,
+    attributes: Optional[Dict[str, str]] = None,
+    indexed_keys: FrozenSet[str] = frozenset(),
+) -> Tuple[str, Dict[str, Any], str]:
+    """Build the search query; returns (query, params, plan).
+
+    ``attributes`` maps span or resource attribute keys to the value a span
+    of the trace must have; keys in ``indexed_keys`` use the index.
+    """
+    params: Dict[str, Any] = {
+        "start": start_ms * NS_PER_MS,
+        "end": end_ms * NS_PER_MS,
+        "start_s": start_ms // 1000,
+        "end_s": end_ms // 1000,
+        "limit": limit,
+    }
+    where = [
+        "bucket >= toStartOfHour(toDateTime(%(start_s)s))",
+        f"bucket <= toStartOfHour(toDateTime(%(end_s)s)) + {BUCKET_SLACK}",
+    ]
+    having = ["startTime >= %(start)s", "startTime <= %(end)s"]
+    plan = "summary"
+
+    if cursor:
+        cursor_start, cursor_trace = decode_cursor(cursor)
+        params["cursor_start"] = cursor_start
+        params["cursor_trace"] = cursor_trace
+        params["cursor_s"] = cursor_start // 1_000_000_000
+        where.append(f"bucket <= toStartOfHour(toDateTime(%(cursor_s)s)) + {BUCKET_SLACK}")
+        having.append("(startTime, traceId) < (%(cursor_start)s, %(cursor_trace)s)")
+
+    if service:
+        having.append("has(services, %(service)s)")
+        params["service"] = service
+    if error is not None:
+        having.append("hasError = %(error)s")
+        params["error"] = int(error)
+        if error:
+            # Any partial row with an error marks its trace; only those
+            # traces are aggregated, with all their rows
+            where.append(f"""traceId IN (
+                SELECT traceId FROM trace_summary
+                WHERE {' AND '.join(where[:2])} AND hasError = 1
+            )""")
+    # Durations are of whole traces, first span start to last span end, so
+    # they are only known once a trace's hourly rows are merged
+    if min_duration:
+        having.append("totalDuration >= %(min_duration)s")
+        params["min_duration"] = min_duration
+    if max_duration:
+        having.append("totalDuration <= %(max_duration)s")
+        params["max_duration"] = max_duration
+
+    if operation:
+        # Span names only exist on raw spans; (serviceName, spanName,
+        # timestamp) is their primary key, so this stays an index scan
+        raw_where = [
+            "timestamp >= toDateTime(%(start_s)s)",
+            f"timestamp <= toDateTime(%(end_s)s) + {BUCKET_SLACK}",
+            "spanName = %(operation)s",
+        ]
+        params["operation"] = operation
+        if service:
+            raw_where.append("serviceName = %(service)s")
+        where.append(f"traceId IN (SELECT traceId FROM spans WHERE {' AND '.join(raw_where)})")
+        plan = "raw"
+
+    for i, (key, value) in enumerate(sorted((attributes or {}).items())):
+        params[f"attr_key_{i}"] = key
+        params[f"attr_value_{i}"] = value
+        if key in indexed_keys:
+            # attribute_index is bucketed like trace_summary
+            where.append(f"""traceId IN (
+                SELECT traceId FROM attribute_index
+                WHERE key = %(attr_key_{i})s AND value = %(attr_value_{i})s
+                  AND {' AND '.join(where[:2])}
+            )""")
+            if plan == "summary":
+                plan = "index"
+        else:
+            where.append(f"""traceId IN (
+                SELECT traceId FROM spans
+                WHERE timestamp >= toDateTime(%(start_s)s)
+                  AND timestamp <= toDateTime(%(end_s)s) + {BUCKET_SLACK}
+                  AND (JSONExtractString(attributes, %(attr_key_{i})s) = %(attr_value_{i})s
+                       OR resourceAttributes[%(attr_key_{i})s] = %(attr_value_{i})s)
+            )""")
+            plan = "raw"
+
+    query = f"""
+        SELECT
+            traceId,
+            max(rootService) as rootService,
+            max(end) - min(start) as totalDuration,
+            max(hasError) as hasError,
+            sumMap(serviceSpans).1 as services,
+            min(start) as startTime
+        FROM trace_summary
+        WHERE {' AND '.join(where)}
+        GROUP BY traceId
+        HAVING {' AND '.join(having)}
+        ORDER BY startTime DESC, traceId DESC
+        LIMIT %(limit)s
+    """
+    return query, params, plan
+
+
+def format_results(rows: List[tuple]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "traceId": row[0],
+            "rootService": row[1],
+            "totalDuration": row[2],
+            "hasError": bool(row[3]),
+            "services": row[4],
+            "startTime": row[5],
+        }
+        for row in rows
+    ]
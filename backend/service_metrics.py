@@ -0,0 +1,210 @@
+"""Queries over the collector's per-service RED rollups.
+
+``service_rollups`` holds request, error and latency-histogram counters per
+service and operation at 10s and 60s resolution. Reads pick the coarsest
+resolution that divides the requested step and aggregate from there, so
+they never touch raw spans. 10s rows expire with raw spans, so ranges older
+than that read the 60s rows.
+
+``service_dependencies`` holds per-minute call counts, errors and callee
+latency histograms between services, for the dependency graph.
+"""
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+RESOLUTIONS = (10, 60)
+
+# Bucket size of service_dependencies; must match collector/dependencies.py
+DEPENDENCY_RESOLUTION = 60
+
+# Log-spaced latency bins; must match collector/rollups.py
+LATENCY_GAMMA = 1.1
+
+QUANTILES = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+
+
+def histogram_quantile(bins: List[int], counts: List[int], q: float) -> int:
+    """Duration in ns at quantile ``q`` of a latency histogram sorted by bin"""
+    total = sum(counts)
+    if not total:
+        return 0
+    rank = q * (total - 1)
+    seen = 0
+    for b, c in zip(bins, counts):
+        seen += c
+        if seen > rank:
+            break
+    return int(2 * LATENCY_GAMMA ** b / (LATENCY_GAMMA + 1))
+
+
+def _latency(requests: int, duration_sum: int, duration_max: int, latency: Tuple[List[int], List[int]]) -> Dict[str, int]:
+    bins, counts = latency
+    stats = {
+        "avgDuration": duration_sum // requests if requests else 0,
+        "maxDuration": duration_max,
+    }
+    for name, q in QUANTILES:
+        # A bin's estimate can overshoot the largest duration it holds
+        stats[name] = min(histogram_quantile(bins, counts, q), duration_max)
+    return stats
+
+
+def resolution_for(step: int, min_resolution: int = RESOLUTIONS[0]) -> Optional[int]:
+    """Coarsest rollup resolution of at least ``min_resolution`` that evenly divides ``step`` seconds"""
+    for resolution in reversed(RESOLUTIONS):
+        if resolution >= min_resolution and step % resolution == 0:
+            return resolution
+    return None
+
+
+def services_query(start_s: int, end_s: int, min_resolution: int = RESOLUTIONS[0]) -> Tuple[str, Dict[str, Any]]:
+    query = """
+        SELECT
+            serviceName,
+            sum(requests) as spanCount,
+            sum(errors) as errorCount,
+            sum(roots) as traceCount,
+            sum(durationSum),
+            max(durationMax),
+            sumMap(latency)
+        FROM service_rollups
+        WHERE resolution = %(resolution)s
+          AND bucket >= toDateTime(%(start)s)
+          AND bucket < toDateTime(%(end)s)
+        GROUP BY serviceName
+        ORDER BY spanCount DESC
+    """
+    resolution = resolution_for(end_s - start_s, min_resolution) or min_resolution
+    start_s -= start_s % resolution
+    return query, {"resolution": resolution, "start": start_s, "end": end_s}
+
+
+def format_services(rows: List[tuple]) -> List[Dict[str, Any]]:
+    services = []
+    for name, spans, errors, traces, duration_sum, duration_max, latency in rows:
+        service = {
+            "name": name,
+            "spanCount": spans,
+            "traceCount": traces,
+            "errorCount": errors,
+            "errorRate": round(errors / spans, 4) if spans else 0.0,
+        }
+        service.update(_latency(spans, duration_sum, duration_max, latency))
+        services.append(service)
+    return services
+
+
+def metrics_query(
+    service: str,
+    start_s: int,
+    end_s: int,
+    step: int,
+    operation: Optional[str] = None,
+    min_resolution: int = RESOLUTIONS[0],
+) -> Tuple[str, Dict[str, Any]]:
+    """Per-step series for one service; ``step`` must be a multiple of ``min_resolution``"""
+    params: Dict[str, Any] = {
+        "resolution": resolution_for(step, min_resolution),
+        "service": service,
+        "start": start_s - start_s % step,
+        "end": end_s,
+        "step": step,
+    }
+    where = [
+        "resolution = %(resolution)s",
+        "serviceName = %(service)s",
+        "bucket >= toDateTime(%(start)s)",
+        "bucket < toDateTime(%(end)s)",
+    ]
+    if operation:
+        where.append("spanName = %(operation)s")
+        params["operation"] = operation
+    query = f"""
+        SELECT
+            intDiv(toUInt32(bucket), %(step)s) * %(step)s as t,
+            sum(requests),
+            sum(errors),
+            sum(durationSum),
+            max(durationMax),
+            sumMap(latency)
+        FROM service_rollups
+        WHERE {' AND '.join(where)}
+        GROUP BY t
+        ORDER BY t
+    """
+    return query, params
+
+
+def format_metrics(rows: List[tuple], start_s: int, end_s: int, step: int) -> List[Dict[str, Any]]:
+    """One point per step from ``start_s`` to ``end_s``, zero-filled"""
+    by_time = {row[0]: row for row in rows}
+    points = []
+    first = start_s - start_s % step
+    for t in range(first, end_s, step):
+        row = by_time.get(t)
+        if row is None:
+            point = {"timestamp": t * 1000, "requests": 0, "errors": 0, "rate": 0.0, "errorRate": 0.0,
+                     "avgDuration": 0, "maxDuration": 0}
+            point.update({name: 0 for name, _ in QUANTILES})
+        else:
+            _, requests, errors, duration_sum, duration_max, latency = row
+            point = {
+                "timestamp": t * 1000,
+                "requests": requests,
+                "errors": errors,
+                "rate": round(requests / step, 3),
+                "errorRate": round(errors / requests, 4) if requests else 0.0,
+            }
+            point.update(_latency(requests, duration_sum, duration_max, latency))
+        points.append(point)
+    return points
+
+
+def point_count(start_s: int, end_s: int, step: int) -> int:
+    return math.ceil((end_s - (start_s - start_s % step)) / step)
+
+
+def dependencies_query(start_s: int, end_s: int, service: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    params: Dict[str, Any] = {"start": start_s - start_s % DEPENDENCY_RESOLUTION, "end": end_s}
+    where = ["bucket >= toDateTime(%(start)s)", "bucket < toDateTime(%(end)s)"]
+    if service:
+        where.append("(caller = %(service)s OR callee = %(service)s)")
+        params["service"] = service
+    query = f"""
+        SELECT
+            caller,
+            callee,
+            sum(calls) as callCount,
+            sum(errors),
+            sum(durationSum),
+            max(durationMax),
+            sumMap(latency)
+        FROM service_dependencies
+        WHERE {' AND '.join(where)}
+        GROUP BY caller, callee
+        ORDER BY callCount DESC
+    """
+    return query, params
+
+
+def format_dependencies(rows: List[tuple]) -> Dict[str, Any]:
+    """Nodes with their incoming and outgoing call counts, and edges"""
+    nodes: Dict[str, Dict[str, Any]] = {}
+    edges = []
+    for caller, callee, calls, errors, duration_sum, duration_max, latency in rows:
+        for name in (caller, callee):
+            if name not in nodes:
+                nodes[name] = {"name": name, "callsIn": 0, "callsOut": 0, "errorsIn": 0}
+        nodes[caller]["callsOut"] += calls
+        nodes[callee]["callsIn"] += calls
+        nodes[callee]["errorsIn"] += errors
+        edge = {
+            "caller": caller,
+            "callee": callee,
+            "callCount": calls,
+            "errorCount": errors,
+            "errorRate": round(errors / calls, 4) if calls else 0.0,
+        }
+        edge.update(_latency(calls, duration_sum, duration_max, latency))
+        edges.append(edge)
+    return {"nodes": sorted(nodes.values(), key=lambda n: n["name"]), "edges": edges}
@@ -0,0 +1,185 @@
+"""Server-side analysis of an assembled trace.
+
+``analyze_trace`` rebuilds the span tree from ``parentSpanId`` and derives
+what the waterfall view needs, so browsers don't have to do it for large
+traces:
+
+- depth, child count and pre-order position of every span
+- self-time: duration not covered by any child span
+- the critical path: the chain of work that determined the trace's end
+- per-service self-time, critical-path time, span and error counts
+- orphans: spans whose parent never arrived
+
+Everything is iterative, so very deep traces can't hit the recursion limit.
+"""
+from typing import Any, Dict, List
+
+
+def _covered(start: int, end: int, intervals: List[tuple]) -> int:
+    """Length of the union of ``intervals`` (sorted by start) within [start, end]"""
+    covered = 0
+    cur_start = cur_end = None
+    for s, e in intervals:
+        s = max(s, start)
+        e = min(e, end)
+        if e <= s:
+            continue
+        if cur_end is None or s > cur_end:
+            if cur_end is not None:
+                covered += cur_end - cur_start
+            cur_start, cur_end = s, e
+        elif e > cur_end:
+            cur_end = e
+    if cur_end is not None:
+        covered += cur_end - cur_start
+    return covered
+
+
+def analyze_trace(spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Annotate ``spans`` in place and return the trace-level analysis.
+
+    ``spans`` must be sorted by ``startTime`` and carry ``spanId``,
+    ``parentSpanId``, ``serviceName``, ``startTime``, ``duration`` and
+    ``statusCode``. Each span gains ``depth``, ``childCount``, ``selfTime``
+    and ``criticalTime``.
+    """
+    n = len(spans)
+    if not n:
+        return {"roots": [], "orphans": [], "order": [], "criticalPath": [], "services": {},
+                "maxDepth": 0, "traceStart": 0, "traceEnd": 0, "duration": 0}
+
+    index = {}
+    starts = [0] * n
+    ends = [0] * n
+    for i, span in enumerate(spans):
+        index[span["spanId"]] = i
+        starts[i] = span["startTime"]
+        ends[i] = span["startTime"] + span["duration"]
+
+    # Children keep start-time order because spans are sorted by start
+    children: List[List[int]] = [[] for _ in range(n)]
+    roots: List[int] = []
+    orphans: List[int] = []
+    for i, span in enumerate(spans):
+        parent = span["parentSpanId"]
+        if not parent:
+            roots.append(i)
+            continue
+        p = index.get(parent)
+        if p is None or p == i:
+            orphans.append(i)
+        else:
+            children[p].append(i)
+
+    # Pre-order walk from every root, then from orphans as detached subtrees
+    depth = [-1] * n
+    order: List[int] = []
+    for top in roots + orphans:
+        if depth[top] != -1:
+            continue
+        stack = [(top, 0)]
+        while stack:
+            i, d = stack.pop()
+            if depth[i] != -1:
+                continue  # parentSpanId cycle
+            depth[i] = d
+            order.append(i)
+            for c in reversed(children[i]):
+                stack.append((c, d + 1))
+    # Spans only reachable through a cycle
+    for i in range(n):
+        if depth[i] == -1:
+            depth[i] = 0
+            order.append(i)
+
+    self_time = [0] * n
+    for i in range(n):
+        kids = children[i]
+        covered = _covered(starts[i], ends[i], [(starts[c], ends[c]) for c in kids]) if kids else 0
+        self_time[i] = ends[i] - starts[i] - covered
+
+    critical_time = [0] * n
+    critical_path = _critical_path(roots or orphans, starts, ends, children, critical_time)
+
+    services: Dict[str, Dict[str, int]] = {}
+    for i, span in enumerate(spans):
+        span["depth"] = depth[i]
+        span["childCount"] = len(children[i])
+        span["selfTime"] = self_time[i]
+        span["criticalTime"] = critical_time[i]
+        svc = services.get(span["serviceName"])
+        if svc is None:
+            svc = services[span["serviceName"]] = {"spanCount": 0, "errorCount": 0, "selfTime": 0, "criticalTime": 0}
+        svc["spanCount"] += 1
+        svc["errorCount"] += span["statusCode"] == 2
+        svc["selfTime"] += self_time[i]
+        svc["criticalTime"] += critical_time[i]
+
+    trace_start = min(starts)
+    trace_end = max(ends)
+    return {
+        "roots": [spans[i]["spanId"] for i in roots],
+        "orphans": [spans[i]["spanId"] for i in orphans],
+        "order": [spans[i]["spanId"] for i in order],
+        "criticalPath": [
+            {"spanId": spans[i]["spanId"], "serviceName": spans[i]["serviceName"], "start": s, "end": e}
+            for i, s, e in critical_path
+        ],
+        "services": services,
+        "maxDepth": max(depth),
+        "traceStart": trace_start,
+        "traceEnd": trace_end,
+        "duration": trace_end - trace_start,
+    }
+
+
+def _critical_path(tops: List[int], starts: List[int], ends: List[int],
+                   children: List[List[int]], critical_time: List[int]) -> List[tuple]:
+    """Return chronological (span, start, end) segments of the critical path.
+
+    Walks back from the end of the longest top-level span: the child that
+    finished last before the cursor is on the path, the cursor moves to that
+    child's start, and any gap between children is the parent's own time.
+    """
+    if not tops:
+        return []
+    top = max(tops, key=lambda i: ends[i] - starts[i])
+    segments: List[tuple] = []
+
+    def by_end(i):
+        return sorted(children[i], key=lambda c: ends[c], reverse=True)
+
+    # Frames are [span, cursor, children by end desc, next child position]
+    stack = [[top, ends[top], by_end(top), 0]]
+    while stack:
+        frame = stack[-1]
+        span, cursor, kids, pos = frame
+        descended = False
+        while pos < len(kids):
+            c = kids[pos]
+            pos += 1
+            child_end = min(ends[c], cursor)
+            if starts[c] >= cursor or child_end <= starts[span]:
+                continue
+            if child_end < cursor:
+                segments.append((span, child_end, cursor))
+            frame[1] = max(starts[c], starts[span])
+            frame[3] = pos
+            stack.append([c, child_end, by_end(c), 0])
+            descended = True
+            break
+        if descended:
+            continue
+        if cursor > starts[span]:
+            segments.append((span, starts[span], cursor))
+        stack.pop()
+
+    # Segments were collected latest-first; merge neighbours of the same span
+    merged: List[tuple] = []
+    for span, s, e in reversed(segments):
+        critical_time[span] += e - s
+        if merged and merged[-1][0] == span and merged[-1][2] == s:
+            merged[-1] = (span, merged[-1][1], e)
+        else:
+            merged.append((span, s, e))
+    return merged
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class CachedTrace:
+    """A serialized trace response and its validator"""
+
+    __slots__ = ("body", "etag", "size", "complete", "expires_at")
+
+    def __init__(self, body: bytes, complete: bool, expires_at: Optional[float]):
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.size = len(body)
+        self.complete = complete
+        self.expires_at = expires_at
+
+
+class CachedSkeleton:
+    """A trace's windowing skeleton (see trace_window), or None without spans"""
+
+    __slots__ = ("skeleton", "size", "complete", "expires_at")
+
+    def __init__(self, skeleton, complete: bool, expires_at: Optional[float]):
+        self.skeleton = skeleton
+        self.size = skeleton.nbytes if skeleton is not None else 0
+        self.complete = complete
+        self.expires_at = expires_at
+
+
+class TraceCache:
+    """Size-bounded LRU of assembled /traces/{id} responses and skeletons.
+
+    Complete traces never change, so they stay until evicted. Traces that may
+    still be receiving spans expire after ``incomplete_ttl`` seconds.
+    Concurrent misses for the same trace share one load. Responses and
+    skeletons share the ``max_bytes`` budget.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, incomplete_ttl: float = 10.0):
+        self.max_bytes = max_bytes
+        self.incomplete_ttl = incomplete_ttl
+
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.not_modified = 0
+
+    async def get_or_load(
+        self,
+        trace_id: str,
+        loader: Callable[[], Awaitable[Tuple[Dict[str, Any], bool]]],
+    ) -> CachedTrace:
+        """Return the cached response, loading it at most once at a time.
+
+        ``loader`` returns ``(payload, complete)``.
+        """
+        async def load() -> CachedTrace:
+            payload, complete = await loader()
+            body = json.dumps(payload, separators=(",", ":")).encode()
+            return CachedTrace(body, complete, self._expires_at(complete))
+
+        return await self._get(trace_id, load)
+
+    async def get_or_load_skeleton(
+        self,
+        trace_id: str,
+        loader: Callable[[], Awaitable[Tuple[Any, bool]]],
+    ) -> CachedSkeleton:
+        """Return the cached skeleton, loading it at most once at a time.
+
+        ``loader`` returns ``(skeleton, complete)``.
+        """
+        async def load() -> CachedSkeleton:
+            skeleton, complete = await loader()
+            return CachedSkeleton(skeleton, complete, self._expires_at(complete))
+
+        return await self._get(("skeleton", trace_id), load)
+
+    async def _get(self, key: Hashable, load: Callable[[], Awaitable[Any]]):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at is None or entry.expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self._remove(key)
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise  # this request was cancelled
+                # The request doing the load went away; load it here instead
+                return await self._get(key, load)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            entry = await load()
+            self._store(key, entry)
+            future.set_result(entry)
+            return entry
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure doesn't log a warning
+            future.exception()
+            raise
+        except BaseException:
+            # Cancelled with this request, which says nothing about the
+            # trace: waiters retry the load instead of failing with it
+            future.cancel()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _expires_at(self, complete: bool) -> Optional[float]:
+        return None if complete else time.monotonic() + self.incomplete_ttl
+
+    def invalidate(self, trace_id: str):
+        for key in (trace_id, ("skeleton", trace_id)):
+            if key in self._entries:
+                self._remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "not_modified": self.not_modified,
+        }
+
+    def _store(self, key: Hashable, entry):
+        if entry.size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
@@ -0,0 +1,163 @@
+"""Windowed views of very large traces.
+
+A full /traces/{id} response carries every span with its attributes. For
+fan-out traces of tens of thousands of spans, a window returns part of the
+tree instead:
+
+- the top ``depth`` levels of the tree
+- a time slice: spans overlapping [start, end], with their ancestors so
+  the window stays a connected tree
+- the subtree below one span, a few levels at a time, for expanding it
+
+Windows are built from a skeleton of the trace: the columns the span tree
+and its analysis need, without ``attributes`` and ``resourceAttributes``,
+which make up most of a span's size and are fetched per span on demand.
+Window spans carry ``hiddenChildren``, the number of their children left
+out, so the UI can offer to expand them. Skeletons are cached with the
+trace responses, so expanding span after span reuses one instead of
+reading the trace again.
+
+Responses are encoded a chunk of spans at a time, so the JSON of a large
+window is never held in memory as a whole.
+"""
+import json
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from trace_analysis import analyze_trace
+
+# Spans per chunk of an encoded window
+CHUNK_SPANS = 500
+
+SKELETON_COLUMNS = (
+    ("spanId", "spanId"),
+    ("parentSpanId", "parentSpanId"),
+    ("spanName", "name"),
+    ("serviceName", "serviceName"),
+    ("startTimeUnixNano", "startTime"),
+    ("duration", "duration"),
+    ("statusCode", "statusCode"),
+)
+
+
+def skeleton_query(trace_id: str, max_spans: int) -> Tuple[str, Dict[str, Any]]:
+    """Query for a trace's skeleton; one row past ``max_spans`` detects truncation"""
+    query = f"""
+        SELECT {', '.join(column for column, _ in SKELETON_COLUMNS)}
+        FROM spans
+        WHERE traceId = %(trace_id)s
+        ORDER BY startTimeUnixNano
+        -- Copies from exporter retries until ClickHouse merges them away
+        LIMIT 1 BY spanId
+        LIMIT %(limit)s
+    """
+    return query, {"trace_id": trace_id, "limit": max_spans + 1}
+
+
+def attributes_query(trace_id: str, span_id: str) -> Tuple[str, Dict[str, Any]]:
+    """Query for the attributes of one span"""
+    query = """
+        SELECT attributes, resourceAttributes, statusMessage
+        FROM spans
+        WHERE traceId = %(trace_id)s AND spanId = %(span_id)s
+        LIMIT 1
+    """
+    return query, {"trace_id": trace_id, "span_id": span_id}
+
+
+# analyze_trace's per-span annotations, kept after the skeleton's columns
+ANALYSIS_FIELDS = ("depth", "childCount", "selfTime", "criticalTime")
+FIELDS = tuple(name for _, name in SKELETON_COLUMNS) + ANALYSIS_FIELDS
+_START, _DURATION, _DEPTH = FIELDS.index("startTime"), FIELDS.index("duration"), FIELDS.index("depth")
+_SERVICE = FIELDS.index("serviceName")
+
+# Approximate memory per span of a built skeleton, for cache accounting
+SPAN_BYTES = 750
+
+
+class TraceSkeleton:
+    """The analyzed span tree of a trace, without attributes.
+
+    Spans are kept as tuples of ``FIELDS`` rather than dicts, about two
+    thirds of the memory, since skeletons are cached between requests.
+    """
+
+    def __init__(self, rows: List[tuple], truncated: bool = False):
+        names = [name for _, name in SKELETON_COLUMNS]
+        spans = [dict(zip(names, row)) for row in rows]
+        self.truncated = truncated
+        self.analysis = analyze_trace(spans)
+        self.spans = [tuple(span[f] for f in FIELDS) for span in spans]
+        del spans
+        self.index = {span[0]: i for i, span in enumerate(self.spans)}
+        # Pre-order positions; a window lists its spans in this order
+        self.order = [self.index[span_id] for span_id in self.analysis.pop("order")]
+        self.parents = [self.index.get(span[1], -1) for span in self.spans]
+        # Only spans with children have an entry
+        self.children: Dict[int, List[int]] = {}
+        for i, p in enumerate(self.parents):
+            if p != -1 and p != i and self.spans[i][_DEPTH] == self.spans[p][_DEPTH] + 1:
+                self.children.setdefault(p, []).append(i)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.spans) * SPAN_BYTES
+
+    def header(self, trace_id: str) -> Dict[str, Any]:
+        """Trace-level fields of a window response"""
+        analysis = self.analysis
+        tops = analysis["roots"] or analysis["orphans"]
+        root = self.spans[self.index[tops[0]]] if tops else None
+        return {
+            "traceId": trace_id,
+            "rootService": root[_SERVICE] if root else None,
+            "totalDuration": analysis["duration"],
+            "total_spans": len(self.spans),
+            "truncated": self.truncated,
+            "analysis": analysis,
+        }
+
+    def window(self, depth: Optional[int] = None, start: Optional[int] = None,
+               end: Optional[int] = None) -> List[int]:
+        """Spans of the top ``depth`` levels overlapping [start, end], in pre-order"""
+        selected = [False] * len(self.spans)
+        for i, span in enumerate(self.spans):
+            if depth is not None and span[_DEPTH] >= depth:
+                continue
+            if start is not None and span[_START] + span[_DURATION] < start:
+                continue
+            if end is not None and span[_START] > end:
+                continue
+            selected[i] = True
+            # Ancestors keep the window connected
+            p = self.parents[i]
+            while p != -1 and not selected[p]:
+                selected[p] = True
+                p = self.parents[p]
+        return [i for i in self.order if selected[i]]
+
+    def subtree(self, span_id: str, depth: int) -> Optional[List[int]]:
+        """Descendants of ``span_id`` up to ``depth`` levels below it, in pre-order"""
+        top = self.index.get(span_id)
+        if top is None:
+            return None
+        spans: List[int] = []
+        stack = [(c, 1) for c in reversed(self.children.get(top, ()))]
+        while stack:
+            i, level = stack.pop()
+            spans.append(i)
+            if level < depth:
+                stack.extend((c, level + 1) for c in reversed(self.children.get(i, ())))
+        return spans
+
+    def encode(self, header: Dict[str, Any], selection: List[int]) -> Iterator[bytes]:
+        """JSON of ``header`` with the selected spans as "spans", in chunks"""
+        in_window = set(selection)
+        yield json.dumps(header, separators=(",", ":")).encode()[:-1] + b',"spans":['
+        for pos in range(0, len(selection), CHUNK_SPANS):
+            chunk = []
+            for i in selection[pos:pos + CHUNK_SPANS]:
+                span = dict(zip(FIELDS, self.spans[i]))
+                span["hiddenChildren"] = sum(1 for c in self.children.get(i, ()) if c not in in_window)
+                chunk.append(json.dumps(span, separators=(",", ":")))
+            yield (b"," if pos else b"") + ",".join(chunk).encode()
+        yield b"]}"
@@ -0,0 +1,50 @@
+"""Per-span cost of the collector's AnomalyDetector.
+
+Feeds batches of decoded spans through ``AnomalyDetector.observe`` and
+reports the per-span cost plus the share of one core it would take at
+``--rate`` spans/s (100k by default), including window closes.
+
+Usage: python benchmarks/bench_anomaly.py [--spans N] [--batch B] [--rate R]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "collector"))
+
+from anomaly_detector import AnomalyDetector  # noqa: E402
+from otlp import decode_request  # noqa: E402
+from payloads import make_spans, to_json  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--spans", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=512)
+    parser.add_argument("--rate", type=int, default=100000)
+    args = parser.parse_args()
+
+    spans = make_spans(args.spans)
+    batches = [
+        decode_request(to_json(spans[i:i + args.batch]), "application/json")
+        for i in range(0, len(spans), args.batch)
+    ]
+
+    # Simulated clock: each batch advances time as if spans arrive at --rate
+    detector = AnomalyDetector(window_seconds=1.0)
+    clock = 0.0
+    started = time.perf_counter()
+    for batch in batches:
+        clock += len(batch) / args.rate
+        detector.observe(batch, now=clock)
+    elapsed = time.perf_counter() - started
+
+    per_span_us = elapsed / len(spans) * 1e6
+    print(f"spans: {len(spans)}  batch: {args.batch}  windows closed: {int(clock)}")
+    print(f"detector cost: {per_span_us:.3f} us/span")
+    print(f"core share at {args.rate} spans/s: {per_span_us * args.rate / 1e6:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Compare OTLP/JSON and OTLP/protobuf decode cost per span.
+
+Usage: python benchmarks/bench_decode.py [--spans N] [--repeat R]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "collector"))
+
+from otlp import decode_request  # noqa: E402
+from payloads import make_spans, to_json, to_protobuf  # noqa: E402
+
+
+def bench(body: bytes, content_type: str, n_spans: int, repeat: int) -> float:
+    """Return the best-of-``repeat`` decode time per span in microseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = decode_request(body, content_type)
+        best = min(best, time.perf_counter() - started)
+    assert len(rows) == n_spans
+    return best / n_spans * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--spans", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    spans = make_spans(args.spans)
+    json_body = to_json(spans)
+    proto_body = to_protobuf(spans)
+
+    json_us = bench(json_body, "application/json", args.spans, args.repeat)
+    proto_us = bench(proto_body, "application/x-protobuf", args.spans, args.repeat)
+
+    print(f"spans: {args.spans}")
+    print(f"json:     {len(json_body) / args.spans:7.1f} B/span  {json_us:7.2f} us/span")
+    print(f"protobuf: {len(proto_body) / args.spans:7.1f} B/span  {proto_us:7.2f} us/span")
+    print(f"protobuf speedup: {json_us / proto_us:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
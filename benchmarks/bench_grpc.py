@@ -0,0 +1,164 @@
+"""Collector ingest throughput over OTLP/HTTP and OTLP/gRPC.
+
+Starts the multi-worker collector against a fake ClickHouse client and
+drives it with the same protobuf export requests over each transport,
+uncompressed and gzip-compressed. Every client process keeps
+``--concurrency`` requests in flight: HTTP clients over a pool of
+keep-alive connections, gRPC clients as concurrent streams on one channel.
+Reports accepted spans per second and request latency.
+
+Usage:
+    python benchmarks/bench_grpc.py [--workers 2] [--duration 10] [--clients 4]
+        [--concurrency 8] [--spans-per-request 500]
+"""
+import argparse
+import asyncio
+import gzip
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import grpc
+import httpx
+
+from bench_workers import COLLECTOR_DIR, HERE, _wait_ready
+from payloads import make_spans, to_protobuf
+
+EXPORT_METHOD = "/opentelemetry.proto.collector.trace.v1.TraceService/Export"
+
+
+async def _http_client(port: int, body: bytes, compressed: bool, concurrency: int, duration: float):
+    headers = {"content-type": "application/x-protobuf"}
+    if compressed:
+        body = gzip.compress(body, compresslevel=6)
+        headers["content-encoding"] = "gzip"
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+
+        async def loop(deadline: float):
+            nonlocal errors
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                r = await client.post("/v1/traces", content=body, headers=headers)
+                if r.status_code == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(loop(deadline) for _ in range(concurrency)))
+    return latencies, errors
+
+
+async def _grpc_client(port: int, body: bytes, compressed: bool, concurrency: int, duration: float):
+    latencies = []
+    errors = 0
+    compression = grpc.Compression.Gzip if compressed else grpc.Compression.NoCompression
+    async with grpc.aio.insecure_channel(f"127.0.0.1:{port}", compression=compression) as channel:
+        # Raw bytes in and out, like the receiver
+        export = channel.unary_unary(EXPORT_METHOD)
+
+        async def loop(deadline: float):
+            nonlocal errors
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    await export(body, timeout=30)
+                    latencies.append(time.perf_counter() - started)
+                except grpc.aio.AioRpcError:
+                    errors += 1
+
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*(loop(deadline) for _ in range(concurrency)))
+    return latencies, errors
+
+
+def _client(transport: str, port: int, body: bytes, compressed: bool, concurrency: int, duration: float, results):
+    run = _grpc_client if transport == "grpc" else _http_client
+    results.put(asyncio.run(run(port, body, compressed, concurrency, duration)))
+
+
+def run(args, transport: str, compressed: bool, body: bytes):
+    env = dict(
+        os.environ,
+        COLLECTOR_WORKERS=str(args.workers),
+        OTLP_PORT=str(args.port),
+        GRPC_PORT=str(args.grpc_port),
+        ADMIN_PORT=str(args.admin_port),
+        CLICKHOUSE_CLIENT_FACTORY="fake_clickhouse:FakeClient",
+        PYTHONPATH=HERE,
+        SPOOL_DIR=tempfile.mkdtemp(prefix="bench-spool-"),
+        SAMPLER_ENABLED="false",
+        # No quotas or sampling rules
+        RULES_PATH=os.devnull,
+    )
+    supervisor = subprocess.Popen(
+        [sys.executable, "workers.py"], cwd=COLLECTOR_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_ready(args.admin_port, args.workers)
+        port = args.grpc_port if transport == "grpc" else args.port
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=_client,
+                args=(transport, port, body, compressed, args.concurrency, args.duration, results),
+            )
+            for _ in range(args.clients)
+        ]
+        started = time.perf_counter()
+        for c in clients:
+            c.start()
+        totals = [results.get() for _ in clients]
+        elapsed = time.perf_counter() - started
+        for c in clients:
+            c.join()
+    finally:
+        supervisor.terminate()
+        supervisor.wait(60)
+    latencies = sorted(latency for t in totals for latency in t[0])
+    errors = sum(t[1] for t in totals)
+    rate = len(latencies) * args.spans_per_request / elapsed
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0.0
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0
+    return rate, p50, p99, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=4, help="load-generator processes")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight per client")
+    parser.add_argument("--spans-per-request", type=int, default=500)
+    parser.add_argument("--port", type=int, default=14318)
+    parser.add_argument("--grpc-port", type=int, default=14317)
+    parser.add_argument("--admin-port", type=int, default=18001)
+    args = parser.parse_args()
+
+    body = to_protobuf(make_spans(args.spans_per_request))
+    print(
+        f"{os.cpu_count()} CPUs, {args.workers} workers, {args.clients} clients x {args.concurrency} "
+        f"in flight, {args.spans_per_request} spans/request ({len(body)} B, "
+        f"{len(gzip.compress(body, compresslevel=6))} B gzipped)"
+    )
+    baseline = None
+    for transport in ("http", "grpc"):
+        for compressed in (False, True):
+            rate, p50, p99, errors = run(args, transport, compressed, body)
+            baseline = baseline or rate
+            label = f"{transport}{'+gzip' if compressed else ''}"
+            line = f"{label:10s} {rate:12,.0f} spans/s  x{rate / baseline:.2f}  p50 {p50:6.1f}ms  p99 {p99:6.1f}ms"
+            if errors:
+                line += f"  ({errors} requests failed)"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Compare the typed OTLP/JSON decoder with a plain dict walk, and the cost
+of gzip/zstd request bodies.
+
+The dict walk is the straightforward decoder: ``json.loads`` and a chain of
+``in`` checks per AnyValue kind. Both decoders produce the same span batch.
+
+Usage: python benchmarks/bench_json_decode.py [--spans N] [--repeat R] [--strings-only]
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "collector"))
+
+from otlp import _append_span, _resource_indexed, decode_request, decompress_body  # noqa: E402
+from span_batch import SpanBatch, intern  # noqa: E402
+from payloads import add_typed_attributes, make_spans, to_json, to_protobuf  # noqa: E402
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _walk_value(value):
+    if "stringValue" in value:
+        return value["stringValue"]
+    if "intValue" in value:
+        return int(value["intValue"])
+    if "boolValue" in value:
+        return value["boolValue"]
+    if "doubleValue" in value:
+        return float(value["doubleValue"])
+    if "bytesValue" in value:
+        return value["bytesValue"]
+    if "arrayValue" in value:
+        return [_walk_value(x) for x in value["arrayValue"].get("values", [])]
+    if "kvlistValue" in value:
+        return {kv["key"]: _walk_value(kv.get("value", {})) for kv in value["kvlistValue"].get("values", [])}
+    return None
+
+
+def _walk_attributes(attributes):
+    attrs = {}
+    for attr in attributes:
+        value = attr.get("value", {})
+        v = _walk_value(value)
+        if v is None:
+            continue
+        attrs[attr.get("key", "")] = json.dumps(v, separators=(",", ":")) if isinstance(v, (list, dict)) else str(v)
+    return attrs
+
+
+def dict_walk_decode(body: bytes) -> SpanBatch:
+    """Baseline: json.loads and per-kind lookups on every AnyValue"""
+    data = json.loads(body)
+    batch = SpanBatch()
+    for resource_span in data.get("resourceSpans", []):
+        resource_attrs = _walk_attributes(resource_span.get("resource", {}).get("attributes", []))
+        service_name = intern(resource_attrs.get("service.name", "unknown"))
+        resource_indexed = _resource_indexed(resource_attrs, frozenset())
+        for scope_span in resource_span.get("scopeSpans", []):
+            for span in scope_span.get("spans", []):
+                status = span.get("status", {})
+                _append_span(
+                    batch, service_name, span.get("traceId", ""), span.get("spanId", ""),
+                    span.get("parentSpanId", ""), span.get("name", "unknown"),
+                    int(span.get("startTimeUnixNano", 0)), int(span.get("endTimeUnixNano", 0)),
+                    _walk_attributes(span.get("attributes", [])),
+                    status.get("code", 0), status.get("message", ""),
+                    resource_attrs, frozenset(), resource_indexed,
+                )
+    return batch
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--spans", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--strings-only", action="store_true",
+                        help="only string attributes, as most SDKs send")
+    args = parser.parse_args()
+
+    spans = make_spans(args.spans)
+    if not args.strings_only:
+        add_typed_attributes(spans)
+    json_body = to_json(spans)
+    proto_body = to_protobuf(spans)
+    n = args.spans
+
+    typed = decode_request(json_body, "application/json")
+    walked = dict_walk_decode(json_body)
+    assert len(typed) == len(walked) == n
+    assert [json.loads(a) for a in typed.attributes] == [json.loads(a) for a in walked.attributes]
+    assert decode_request(proto_body, "application/x-protobuf").attributes == typed.attributes
+
+    walk_us = best_of(lambda: dict_walk_decode(json_body), args.repeat) / n * 1e6
+    typed_us = best_of(lambda: decode_request(json_body, "application/json"), args.repeat) / n * 1e6
+    proto_us = best_of(lambda: decode_request(proto_body, "application/x-protobuf"), args.repeat) / n * 1e6
+
+    print(f"spans: {n}, attributes: {'strings only' if args.strings_only else 'all AnyValue kinds'}")
+    print(f"json dict walk: {walk_us:7.2f} us/span")
+    print(f"json typed:     {typed_us:7.2f} us/span  ({walk_us / typed_us:.2f}x)")
+    print(f"protobuf:       {proto_us:7.2f} us/span")
+
+    print("\nrequest body compression (decompression time per span)")
+    limit = 1 << 30
+    for name, body in (("json", json_body), ("protobuf", proto_body)):
+        print(f"{name:9s} identity {len(body) / n:7.1f} B/span")
+        encoded = [("gzip", gzip.compress(body, compresslevel=6))]
+        if zstandard is not None:
+            encoded.append(("zstd", zstandard.ZstdCompressor(level=3).compress(body)))
+        for encoding, compressed in encoded:
+            assert decompress_body(compressed, encoding, limit) == body
+            us = best_of(lambda: decompress_body(compressed, encoding, limit), args.repeat) / n * 1e6
+            print(f"{'':9s} {encoding:8s} {len(compressed) / n:7.1f} B/span  "
+                  f"{len(body) / len(compressed):5.1f}x smaller  {us:6.2f} us/span")
+    if zstandard is None:
+        print("(zstandard not installed, zstd skipped)")
+
+    # A body that inflates past the limit is cut off at limit + 1 bytes
+    bomb = gzip.compress(b"\0" * (64 << 20), compresslevel=9)
+    inflated = decompress_body(bomb, "gzip", 16 << 20)
+    print(f"\n64 MiB gzip bomb ({len(bomb)} B) inflated to {len(inflated)} B with a 16 MiB limit")
+
+
+if __name__ == "__main__":
+    main()
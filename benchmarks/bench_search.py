@@ -0,0 +1,138 @@
+"""/search latency over a large synthetic dataset.
+
+Loads ``--spans`` synthetic spans (100M by default) spread over ``--days``
+into a real ClickHouse with the schema from clickhouse/init.sql. The data is
+generated server-side with numbers(), so loading needs no client bandwidth.
+Then it runs the backend's search plans repeatedly and reports p50/p99 per
+scenario. Re-run with a larger --spans (and --skip-load to reuse data) to
+check that latency stays flat as retention grows.
+
+Usage:
+    python benchmarks/bench_search.py --host localhost [--spans 100000000]
+        [--days 7] [--repeat 50] [--skip-load]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from clickhouse_driver import Client
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from search import encode_cursor, plan_search  # noqa: E402
+
+LOAD_CHUNK = 10_000_000
+SPANS_PER_TRACE = 8
+
+# Eight spans per trace across four services, ~5% errors, and root
+# durations of 1ms-1s. Spans are ordered by trace, so each trace's spans
+# land within the same second.
+LOAD_QUERY = """
+INSERT INTO spans (
+    timestamp, startTimeUnixNano, traceId, spanId, parentSpanId, serviceName,
+    spanName, duration, hasError, statusCode, statusMessage, attributes,
+    httpMethod, httpUrl, httpStatusCode
+)
+SELECT
+    toDateTime(intDiv(start_ns, 1000000000)),
+    start_ns,
+    lower(hex(cityHash64(trace_no))) || lower(hex(cityHash64(trace_no, 1))),
+    lower(hex(cityHash64(number))),
+    if(number % {spt} = 0, '', lower(hex(cityHash64(number - number % {spt})))),
+    ['auth-service', 'order-service', 'payment-service', 'inventory-service'][number % 4 + 1],
+    ['user.login', 'order.create', 'payment.process', 'inventory.check'][number % 4 + 1],
+    1000000 + cityHash64(number) % 1000000000,
+    cityHash64(number, 2) % 100 < 5,
+    if(cityHash64(number, 2) % 100 < 5, 2, 0),
+    '', '{{}}', '', '', ''
+FROM (
+    SELECT
+        number,
+        intDiv(number, {spt}) AS trace_no,
+        toUInt64({start_ns} + intDiv(number, {spt}) * {step_ns}) AS start_ns
+    FROM numbers({offset}, {count})
+)
+"""
+
+
+def load(client: Client, n_spans: int, days: int):
+    now_ns = time.time_ns()
+    span_ns = days * 86400 * 1_000_000_000
+    n_traces = max(n_spans // SPANS_PER_TRACE, 1)
+    step_ns = span_ns // n_traces
+    start_ns = now_ns - span_ns
+    for offset in range(0, n_spans, LOAD_CHUNK):
+        count = min(LOAD_CHUNK, n_spans - offset)
+        started = time.perf_counter()
+        client.execute(LOAD_QUERY.format(
+            spt=SPANS_PER_TRACE, start_ns=start_ns, step_ns=step_ns, offset=offset, count=count,
+        ))
+        print(f"loaded {offset + count:>12,} spans ({time.perf_counter() - started:.1f}s)")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def run(client: Client, name: str, repeat: int, **kwargs):
+    latencies = []
+    plan = None
+    for _ in range(repeat):
+        query, params, plan = plan_search(**kwargs)
+        started = time.perf_counter()
+        client.execute(query, params)
+        latencies.append((time.perf_counter() - started) * 1000)
+    print(f"{name:32s} plan={plan:7s} p50={statistics.median(latencies):8.1f}ms "
+          f"p99={percentile(latencies, 0.99):8.1f}ms")
+
+
+def run_deep_paging(client: Client, repeat: int, pages: int, start_ms: int, end_ms: int):
+    latencies = []
+    for _ in range(max(repeat // pages, 1)):
+        cursor = None
+        for _ in range(pages):
+            query, params, _ = plan_search(start_ms, end_ms, 100, cursor=cursor)
+            started = time.perf_counter()
+            rows = client.execute(query, params)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if len(rows) < 100:
+                break
+            cursor = encode_cursor(rows[-1][5], rows[-1][0])
+    print(f"{f'deep paging ({pages} pages)':32s} plan=summary p50={statistics.median(latencies):8.1f}ms "
+          f"p99={percentile(latencies, 0.99):8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("CLICKHOUSE_HOST", "localhost"))
+    parser.add_argument("--database", default=os.getenv("CLICKHOUSE_DB", "traces"))
+    parser.add_argument("--spans", type=int, default=100_000_000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--skip-load", action="store_true")
+    args = parser.parse_args()
+
+    client = Client(host=args.host, database=args.database)
+    if not args.skip_load:
+        load(client, args.spans, args.days)
+    total = client.execute("SELECT count() FROM spans")[0][0]
+    print(f"spans in table: {total:,}")
+
+    now_ms = int(time.time() * 1000)
+    hour_ago = now_ms - 3_600_000
+    run(client, "last hour", args.repeat, start_ms=hour_ago, end_ms=now_ms, limit=20)
+    run(client, "last 15m, errors", args.repeat, start_ms=now_ms - 900_000, end_ms=now_ms,
+        limit=20, error=True)
+    run(client, "last hour, service + duration", args.repeat, start_ms=hour_ago, end_ms=now_ms,
+        limit=20, service="payment-service", min_duration=500_000_000)
+    run(client, "last hour, operation", args.repeat, start_ms=hour_ago, end_ms=now_ms,
+        limit=20, service="order-service", operation="order.create")
+    run(client, "last day", max(args.repeat // 5, 1), start_ms=now_ms - 86_400_000, end_ms=now_ms, limit=20)
+    run_deep_paging(client, args.repeat, 20, hour_ago, now_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Columnar SpanBatch vs the previous dict-per-row ingest path.
+
+Both paths decode the same OTLP/JSON payloads and build the columns handed
+to clickhouse_driver. Reports time per span, GC collections triggered, and
+the memory retained per buffered span (what the sampler holds on to).
+
+Usage: python benchmarks/bench_span_batch.py [--spans N] [--batch B]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "collector"))
+
+from otlp import spans_from_json  # noqa: E402
+from payloads import make_spans, to_json  # noqa: E402
+from span_batch import INSERT_COLUMNS  # noqa: E402
+
+
+def dict_rows_from_json(data):
+    """The pre-SpanBatch decoder: one attribute dict and one row dict per span"""
+    rows = []
+    for resource_span in data.get("resourceSpans", []):
+        resource_attrs = {}
+        for attr in resource_span.get("resource", {}).get("attributes", []):
+            resource_attrs[attr["key"]] = attr["value"].get("stringValue")
+        service_name = resource_attrs.get("service.name", "unknown")
+        for scope_span in resource_span.get("scopeSpans", []):
+            for span in scope_span.get("spans", []):
+                span_attrs = {}
+                for attr in span.get("attributes", []):
+                    value = attr.get("value", {})
+                    if "stringValue" in value:
+                        span_attrs[attr.get("key", "")] = value["stringValue"]
+                start_time = int(span.get("startTimeUnixNano", 0))
+                end_time = int(span.get("endTimeUnixNano", 0))
+                status = span.get("status", {})
+                rows.append({
+                    'timestamp': datetime.fromtimestamp(start_time / 1e9),
+                    'traceId': span.get("traceId", ""),
+                    'spanId': span.get("spanId", ""),
+                    'parentSpanId': span.get("parentSpanId", ""),
+                    'serviceName': service_name,
+                    'spanName': span.get("name", "unknown"),
+                    'duration': end_time - start_time,
+                    'hasError': 1 if status.get("code", 0) == 2 else 0,
+                    'statusCode': status.get("code", 0),
+                    'statusMessage': status.get("message", ""),
+                    'attributes': json.dumps(span_attrs),
+                    'httpMethod': span_attrs.get("http.method", ""),
+                    'httpUrl': span_attrs.get("http.url", ""),
+                    'httpStatusCode': span_attrs.get("http.status_code", ""),
+                })
+    return rows
+
+
+def dict_path(payloads):
+    decoded = [dict_rows_from_json(p) for p in payloads]
+    # clickhouse_driver transposes row dicts into columns before sending
+    for rows in decoded:
+        [[row[c] for row in rows] for c in INSERT_COLUMNS]
+    return decoded
+
+
+def batch_path(payloads):
+    decoded = [spans_from_json(p) for p in payloads]
+    for batch in decoded:
+        batch.insert_columns()
+    return decoded
+
+
+def measure(name, fn, payloads, n_spans):
+    gc.collect()
+    collections = sum(s["collections"] for s in gc.get_stats())
+    started = time.perf_counter()
+    fn(payloads)
+    elapsed = time.perf_counter() - started
+    collections = sum(s["collections"] for s in gc.get_stats()) - collections
+
+    gc.collect()
+    tracemalloc.start()
+    held = fn(payloads)
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+
+    print(f"{name:10s} {elapsed / n_spans * 1e6:7.2f} us/span  "
+          f"{collections:5d} gc runs  {retained / n_spans:7.1f} B/span retained")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--spans", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=512)
+    args = parser.parse_args()
+
+    spans = make_spans(args.spans)
+    payloads = [json.loads(to_json(spans[i:i + args.batch])) for i in range(0, len(spans), args.batch)]
+
+    print(f"spans: {args.spans}  batch: {args.batch}")
+    measure("dict rows", dict_path, payloads, args.spans)
+    measure("SpanBatch", batch_path, payloads, args.spans)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+"""Reproducible ingest and query benchmark suite.
+
+Runs the collector (collector/workers.py) and the backend as subprocesses
+and drives them over HTTP:
+
+- ingest: OTLP export requests of synthetic traces (payloads.make_traces),
+  once per encoding, from several client processes. Reports accepted
+  spans/s, request latency p50/p99 and the collector's peak RSS.
+- query: /search pages and /traces/{id}, first cold and then again from
+  the backend's trace cache. Reports latency p50/p99.
+
+By default both run against fake_clickhouse.RecordingClient, so no
+database is needed and the numbers are the services' own cost; the queries
+and rows each service sent are included in the results. With
+--clickhouse-host they run against a real ClickHouse that has the schema
+from clickhouse/init.sql, and the query phase reads what ingest wrote.
+
+Payloads are generated from a fixed seed, so runs are comparable. Results
+are written as JSON; --compare prints each metric's change against the
+results of an earlier run.
+
+Usage:
+    python benchmarks/bench_suite.py [--output results.json] [--compare old.json]
+        [--only ingest|query] [--duration 10] [--clients 4] [--workers 1]
+        [--formats json,protobuf] [--traces-per-request 20] [--fanout 3]
+        [--depth 3] [--attrs 5] [--error-rate 0.05] [--clickhouse-host HOST]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import yaml
+
+from fake_clickhouse import write_dataset
+from payloads import make_traces, to_json, to_protobuf
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+
+CONTENT_TYPES = {"json": "application/json", "protobuf": "application/x-protobuf"}
+ENCODERS = {"json": to_json, "protobuf": to_protobuf}
+
+# Distinct request bodies each client cycles through
+BODIES_PER_FORMAT = 32
+
+
+def latency_stats(latencies: List[float]) -> Dict[str, float]:
+    """p50/p99/mean of latencies in seconds, in milliseconds"""
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p99_ms": round(ordered[min(int(0.99 * len(ordered)), len(ordered) - 1)] * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+    }
+
+
+def _process_tree(pid: int) -> List[int]:
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; ppid follows it
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        p = stack.pop()
+        tree.append(p)
+        stack.extend(children.get(p, ()))
+    return tree
+
+
+def rss_bytes(pid: int) -> int:
+    """Resident memory of a process and all its descendants"""
+    total = 0
+    for p in _process_tree(pid):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total
+
+
+class RssSampler(threading.Thread):
+    """Tracks the peak RSS of a process tree while it runs"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            self.peak = max(self.peak, rss_bytes(self.pid))
+            self._done.wait(self.interval)
+
+    def stop(self) -> int:
+        self._done.set()
+        self.join()
+        return self.peak
+
+
+def _wait_for(url: str, ready, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            r = httpx.get(url)
+            if r.status_code == 200 and ready(r.json()):
+                return
+        except (httpx.HTTPError, ValueError, KeyError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+def _stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def _service_env(args, record_path: str, **extra) -> Dict[str, str]:
+    env = dict(os.environ, PYTHONPATH=HERE, FAKE_CLICKHOUSE_RECORD=record_path, **extra)
+    if args.clickhouse_host:
+        env["CLICKHOUSE_HOST"] = args.clickhouse_host
+        env.pop("CLICKHOUSE_CLIENT_FACTORY", None)
+    else:
+        env["CLICKHOUSE_CLIENT_FACTORY"] = "fake_clickhouse:RecordingClient"
+    return env
+
+
+def _recorded_queries(path: str) -> Dict[str, Dict[str, int]]:
+    """Sum the query counts the service processes appended to ``path``"""
+    totals: Dict[str, Dict[str, int]] = {}
+    if not os.path.exists(path):
+        return totals
+    with open(path) as f:
+        for line in f:
+            for kind, counts in json.loads(line)["queries"].items():
+                total = totals.setdefault(kind, {"queries": 0, "rows": 0})
+                total["queries"] += counts["queries"]
+                total["rows"] += counts["rows"]
+    return totals
+
+
+def _rules_without_quotas(directory: str) -> str:
+    """The collector's rules.yaml minus admission quotas, which would throttle the load"""
+    with open(os.path.join(ROOT, "collector", "rules.yaml")) as f:
+        rules = yaml.safe_load(f) or {}
+    rules.pop("admission", None)
+    for service in rules.get("services") or []:
+        service.pop("rate_limit", None)
+        service.pop("burst", None)
+    path = os.path.join(directory, "rules.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(rules, f)
+    return path
+
+
+def _ingest_client(url: str, bodies: List[bytes], content_type: str, duration: float, results):
+    latencies = []
+    statuses: Dict[str, int] = {}
+    headers = {"content-type": content_type}
+    deadline = time.monotonic() + duration
+    i = 0
+    with httpx.Client(timeout=30) as client:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                status = str(client.post(url, content=bodies[i % len(bodies)], headers=headers).status_code)
+            except httpx.TransportError:
+                status = "error"
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+            i += 1
+    results.put((latencies, statuses))
+
+
+def bench_ingest(args, fmt: str, workdir: str) -> Dict[str, Any]:
+    traces = [
+        make_traces(args.traces_per_request, args.fanout, args.depth, args.attrs, seed=seed,
+                    error_rate=args.error_rate)
+        for seed in range(BODIES_PER_FORMAT)
+    ]
+    spans_per_request = len(traces[0])
+    bodies = [ENCODERS[fmt](spans) for spans in traces]
+
+    record_path = os.path.join(workdir, f"ingest-{fmt}.jsonl")
+    env = _service_env(
+        args, record_path,
+        COLLECTOR_WORKERS=str(args.workers),
+        OTLP_PORT=str(args.port),
+        ADMIN_PORT=str(args.admin_port),
+        SPOOL_DIR=tempfile.mkdtemp(prefix=f"spool-{fmt}-", dir=workdir),
+        RULES_PATH=_rules_without_quotas(workdir),
+    )
+    collector = subprocess.Popen(
+        [sys.executable, "workers.py"], cwd=os.path.join(ROOT, "collector"), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        # Every worker has started its pipeline and published its stats once
+        _wait_for(
+            f"http://127.0.0.1:{args.admin_port}/stats",
+            lambda stats: len(stats["workers"]) == args.workers and all(w["stats"] for w in stats["workers"].values()),
+        )
+        idle_rss = rss_bytes(collector.pid)
+        sampler = RssSampler(collector.pid)
+        sampler.start()
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(target=_ingest_client, args=(
+                f"http://127.0.0.1:{args.port}/v1/traces", bodies, CONTENT_TYPES[fmt], args.duration, results,
+            ))
+            for _ in range(args.clients)
+        ]
+        started = time.perf_counter()
+        for c in clients:
+            c.start()
+        outcomes = [results.get() for _ in clients]
+        elapsed = time.perf_counter() - started
+        for c in clients:
+            c.join()
+        peak_rss = sampler.stop()
+    finally:
+        _stop(collector)
+
+    latencies = [latency for client_latencies, _ in outcomes for latency in client_latencies]
+    statuses: Dict[str, int] = {}
+    for _, client_statuses in outcomes:
+        for status, n in client_statuses.items():
+            statuses[status] = statuses.get(status, 0) + n
+    accepted = statuses.get("200", 0)
+    return {
+        "spans_per_request": spans_per_request,
+        "request_bytes": sum(map(len, bodies)) // len(bodies),
+        "requests": len(latencies),
+        "statuses": statuses,
+        "spans_per_sec": round(accepted * spans_per_request / elapsed, 1),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "latency": latency_stats(latencies),
+        "rss_idle_mb": round(idle_rss / 2**20, 1),
+        "rss_peak_mb": round(peak_rss / 2**20, 1),
+        "clickhouse": _recorded_queries(record_path),
+    }
+
+
+def _timed_get(client: httpx.Client, url: str, latencies: List[float], **kwargs) -> httpx.Response:
+    started = time.perf_counter()
+    r = client.get(url, **kwargs)
+    latencies.append(time.perf_counter() - started)
+    r.raise_for_status()
+    return r
+
+
+def bench_query(args, workdir: str) -> Dict[str, Any]:
+    record_path = os.path.join(workdir, "query.jsonl")
+    extra = {}
+    if not args.clickhouse_host:
+        dataset = os.path.join(workdir, "dataset.json")
+        write_dataset(dataset, make_traces(
+            args.query_traces, args.fanout, args.depth, args.attrs, error_rate=args.error_rate,
+        ))
+        extra["FAKE_CLICKHOUSE_DATASET"] = dataset
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend:app", "--port", str(args.backend_port), "--log-level", "warning"],
+        cwd=os.path.join(ROOT, "backend"), env=_service_env(args, record_path, **extra),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{args.backend_port}"
+    search_first, search_pages, trace_cold, trace_warm = [], [], [], []
+    try:
+        _wait_for(f"{base}/health", lambda body: body["status"] == "ok")
+        with httpx.Client(base_url=base, timeout=60) as client:
+            for _ in range(args.repeat):
+                _timed_get(client, "/search", search_first, params={"limit": 20})
+
+            # Page through the range 100 at a time for trace IDs
+            trace_ids: List[str] = []
+            cursor: Optional[str] = None
+            while len(trace_ids) < args.query_traces:
+                params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+                r = _timed_get(client, "/search", search_pages, params=params)
+                trace_ids.extend(t["traceId"] for t in r.json())
+                cursor = r.headers.get("x-next-cursor")
+                if not cursor:
+                    break
+
+            for trace_id in trace_ids:
+                _timed_get(client, f"/traces/{trace_id}", trace_cold)
+            for trace_id in trace_ids:
+                _timed_get(client, f"/traces/{trace_id}", trace_warm)
+    finally:
+        _stop(backend)
+
+    return {
+        "traces": len(trace_ids),
+        "search_first_page": latency_stats(search_first),
+        "search_pages": latency_stats(search_pages),
+        "trace_cold": latency_stats(trace_cold),
+        "trace_cached": latency_stats(trace_warm),
+        "clickhouse": _recorded_queries(record_path),
+    }
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metrics(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves of a results file by dotted path, minus the config"""
+    metrics = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if key in ("config", "host", "clickhouse"):
+            continue
+        if isinstance(value, dict):
+            metrics.update(_metrics(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[path] = value
+    return metrics
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]):
+    print(f"\ncompared with {old.get('commit') or 'previous run'} ({old.get('timestamp')}):")
+    before, after = _metrics(old), _metrics(new)
+    for path in sorted(before.keys() & after.keys()):
+        a, b = before[path], after[path]
+        change = f"{(b - a) / a * 100:+7.1f}%" if a else "      -"
+        print(f"  {path:48s} {a:>12,.3f} -> {b:>12,.3f} {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--compare", help="results file of an earlier run")
+    parser.add_argument("--only", choices=("ingest", "query"))
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load per encoding")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=1, help="collector worker processes")
+    parser.add_argument("--formats", default="json,protobuf")
+    parser.add_argument("--traces-per-request", type=int, default=20)
+    parser.add_argument("--fanout", type=int, default=3)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--attrs", type=int, default=5, help="attributes per span")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--query-traces", type=int, default=500, help="traces fetched in the query phase")
+    parser.add_argument("--repeat", type=int, default=50, help="first-page searches")
+    parser.add_argument("--clickhouse-host", help="run against this ClickHouse instead of the fake client")
+    parser.add_argument("--port", type=int, default=14318)
+    parser.add_argument("--admin-port", type=int, default=18001)
+    parser.add_argument("--backend-port", type=int, default=18002)
+    args = parser.parse_args()
+    # Stop the services on the way out; orphaned workers would keep the ports
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(1))
+
+    results: Dict[str, Any] = {
+        "commit": _commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "host": {"cpus": os.cpu_count(), "python": platform.python_version()},
+        "config": vars(args),
+    }
+    with tempfile.TemporaryDirectory(prefix="bench-suite-") as workdir:
+        if args.only != "query":
+            results["ingest"] = {}
+            for fmt in args.formats.split(","):
+                ingest = results["ingest"][fmt] = bench_ingest(args, fmt, workdir)
+                print(f"ingest {fmt:8s} {ingest['spans_per_sec']:>10,.0f} spans/s  "
+                      f"p50={ingest['latency'].get('p50_ms')}ms p99={ingest['latency'].get('p99_ms')}ms  "
+                      f"rss={ingest['rss_peak_mb']}MB")
+        if args.only != "ingest":
+            query = results["query"] = bench_query(args, workdir)
+            for name in ("search_first_page", "search_pages", "trace_cold", "trace_cached"):
+                stats = query[name]
+                print(f"query  {name:18s} p50={stats.get('p50_ms')}ms p99={stats.get('p99_ms')}ms (n={stats['count']})")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
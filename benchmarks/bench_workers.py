@@ -0,0 +1,121 @@
+"""Collector ingest throughput by number of workers.
+
+Starts the multi-worker collector (collector/workers.py) against a fake
+ClickHouse client for each worker count, drives it with protobuf export
+requests from several load-generator processes, and reports accepted spans
+per second and the speedup over one worker.
+
+Usage:
+    python benchmarks/bench_workers.py [--workers 1,2,4] [--duration 10]
+        [--clients 8] [--spans-per-request 500]
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from payloads import make_spans, to_protobuf
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+COLLECTOR_DIR = os.path.join(HERE, "..", "collector")
+
+
+def _client(port: int, body: bytes, duration: float, results):
+    url = f"http://127.0.0.1:{port}/v1/traces"
+    headers = {"content-type": "application/x-protobuf"}
+    ok = rejected = 0
+    deadline = time.monotonic() + duration
+    with httpx.Client(timeout=30) as client:
+        while time.monotonic() < deadline:
+            r = client.post(url, content=body, headers=headers)
+            if r.status_code == 200:
+                ok += 1
+            else:
+                rejected += 1
+    results.put((ok, rejected))
+
+
+def _wait_ready(admin_port: int, workers: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            health = httpx.get(f"http://127.0.0.1:{admin_port}/health").json()
+            stats = httpx.get(f"http://127.0.0.1:{admin_port}/stats").json()
+            # Every worker has started its pipeline and published once
+            if health["alive"] == workers and all(w["stats"] for w in stats["workers"].values()):
+                return
+        except (httpx.HTTPError, ValueError, KeyError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("collector did not start")
+
+
+def run(workers: int, args, body: bytes, spans_per_request: int) -> float:
+    env = dict(
+        os.environ,
+        COLLECTOR_WORKERS=str(workers),
+        OTLP_PORT=str(args.port),
+        ADMIN_PORT=str(args.admin_port),
+        CLICKHOUSE_CLIENT_FACTORY="fake_clickhouse:FakeClient",
+        PYTHONPATH=HERE,
+        SPOOL_DIR=tempfile.mkdtemp(prefix="bench-spool-"),
+        SAMPLER_ENABLED="false",
+        # No quotas or sampling rules
+        RULES_PATH=os.devnull,
+    )
+    supervisor = subprocess.Popen(
+        [sys.executable, "workers.py"], cwd=COLLECTOR_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_ready(args.admin_port, workers)
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(target=_client, args=(args.port, body, args.duration, results))
+            for _ in range(args.clients)
+        ]
+        started = time.perf_counter()
+        for c in clients:
+            c.start()
+        totals = [results.get() for _ in clients]
+        elapsed = time.perf_counter() - started
+        for c in clients:
+            c.join()
+    finally:
+        supervisor.terminate()
+        supervisor.wait(60)
+    ok = sum(t[0] for t in totals)
+    rejected = sum(t[1] for t in totals)
+    if rejected:
+        print(f"  ({rejected} requests rejected)")
+    return ok * spans_per_request / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default=",".join(
+        str(n) for n in (1, 2, 4, 8, 16) if n <= (os.cpu_count() or 1)
+    ))
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=max((os.cpu_count() or 1), 4))
+    parser.add_argument("--spans-per-request", type=int, default=500)
+    parser.add_argument("--port", type=int, default=14318)
+    parser.add_argument("--admin-port", type=int, default=18001)
+    args = parser.parse_args()
+
+    body = to_protobuf(make_spans(args.spans_per_request))
+    print(f"{os.cpu_count()} CPUs, {args.clients} clients, {args.spans_per_request} spans/request")
+    baseline = None
+    for workers in [int(n) for n in args.workers.split(",")]:
+        rate = run(workers, args, body, args.spans_per_request)
+        baseline = baseline or rate
+        print(f"workers={workers:2d}  {rate:12,.0f} spans/s  x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
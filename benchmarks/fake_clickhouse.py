@@ -0,0 +1,154 @@
+"""Stand-in ClickHouse clients for benchmarks.
+
+Point the collector or the backend at one with
+``CLICKHOUSE_CLIENT_FACTORY=fake_clickhouse:FakeClient`` (with benchmarks/
+on PYTHONPATH) to measure them without a database.
+
+``RecordingClient`` also counts every query and the rows it carried, and
+answers the backend's /traces/{id} (whole, windowed and per-span
+attributes) and /search queries from a dataset
+written by ``write_dataset``. It is configured through the environment:
+
+- ``FAKE_CLICKHOUSE_DATASET``: dataset file to serve reads from
+- ``FAKE_CLICKHOUSE_RECORD``: file the process appends its query counts to
+  (one JSON line) when it exits
+"""
+import atexit
+import json
+import multiprocessing.util
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+_TABLE = re.compile(r"\b(?:FROM|INTO)\s+([\w.]+)", re.IGNORECASE)
+
+
+class FakeClient:
+    """Accepts every query; inserts are discarded"""
+
+    def execute(self, query, params=None, **kwargs):
+        if query.lstrip().upper().startswith("SELECT"):
+            return [(0,)]
+        return None
+
+    def execute_iter(self, query, params=None, chunk_size=1, **kwargs):
+        rows = self.execute(query, params, **kwargs) or []
+        if chunk_size > 1:
+            return (rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size))
+        return iter(rows)
+
+    def disconnect(self):
+        pass
+
+
+def write_dataset(path: str, spans: List[Dict[str, Any]]):
+    """Save payload span dicts (see payloads.py) as rows of the backend's trace query"""
+    rows = [
+        [
+            s["trace_id"].hex(), s["span_id"].hex(), s["parent_span_id"].hex(),
+            s["name"], s["service"], s["start"], s["end"] - s["start"],
+            2 if s["error"] else 0, json.dumps(s["attributes"]), {"service.name": s["service"]},
+        ]
+        for s in spans
+    ]
+    with open(path, "w") as f:
+        json.dump(rows, f)
+
+
+class _Dataset:
+    def __init__(self, path: Optional[str]):
+        self.spans: Dict[str, List[tuple]] = {}
+        # (traceId, rootService, totalDuration, hasError, services, startTime), newest first
+        self.summaries: List[tuple] = []
+        if not path:
+            return
+        with open(path) as f:
+            rows = json.load(f)
+        for row in sorted(rows, key=lambda r: r[5]):
+            self.spans.setdefault(row[0], []).append(tuple(row))
+        for trace_id, spans in self.spans.items():
+            root = next((s for s in spans if not s[2]), spans[0])
+            start = min(s[5] for s in spans)
+            end = max(s[5] + s[6] for s in spans)
+            services = sorted({s[4] for s in spans})
+            self.summaries.append((trace_id, root[4], end - start, int(any(s[7] == 2 for s in spans)), services, start))
+        self.summaries.sort(key=lambda s: (s[5], s[0]), reverse=True)
+
+    def search(self, params: Dict[str, Any]) -> List[tuple]:
+        rows = self.summaries
+        if "cursor_start" in params:
+            cursor = (params["cursor_start"], params["cursor_trace"])
+            rows = [r for r in rows if (r[5], r[0]) < cursor]
+        return rows[:params.get("limit", 20)]
+
+
+_lock = threading.Lock()
+_dataset: Optional[_Dataset] = None
+# "<verb> <table>" -> [queries, rows]
+_counts: Dict[str, List[int]] = {}
+
+
+def _record_counts():
+    path = os.getenv("FAKE_CLICKHOUSE_RECORD")
+    with _lock:
+        if not path or not _counts:
+            return
+        line = json.dumps({"pid": os.getpid(), "queries": {k: {"queries": q, "rows": r} for k, (q, r) in _counts.items()}})
+        _counts.clear()
+    with open(path, "a") as f:
+        f.write(line + "\n")
+
+
+atexit.register(_record_counts)
+# Processes started by multiprocessing (the collector's workers) skip atexit
+multiprocessing.util.Finalize(None, _record_counts, exitpriority=0)
+
+
+def _kind(query: str) -> Tuple[str, str]:
+    verb = query.lstrip().split(None, 1)[0].upper()
+    table = _TABLE.search(query)
+    return verb, table.group(1) if table else ""
+
+
+class RecordingClient(FakeClient):
+    """Counts queries and serves reads from ``FAKE_CLICKHOUSE_DATASET``"""
+
+    def execute(self, query, params=None, columnar=False, **kwargs):
+        global _dataset
+        verb, table = _kind(query)
+        if verb == "INSERT":
+            rows = len(params[0]) if columnar and params else len(params or ())
+            result = None
+        else:
+            if _dataset is None:
+                with _lock:
+                    if _dataset is None:
+                        _dataset = _Dataset(os.getenv("FAKE_CLICKHOUSE_DATASET"))
+            if table == "spans" and params and "span_id" in params:
+                result = [
+                    (s[8], s[9], "") for s in _dataset.spans.get(params["trace_id"], []) if s[1] == params["span_id"]
+                ][:1]
+            elif table == "spans" and params and "trace_id" in params and "limit" in params:
+                # A windowed trace's skeleton: no traceId or attribute columns
+                result = [s[1:8] for s in _dataset.spans.get(params["trace_id"], [])][:params["limit"]]
+            elif table == "spans" and params and "trace_id" in params:
+                result = _dataset.spans.get(params["trace_id"], [])
+            elif table == "trace_summary" and params and "trace_id" in params:
+                # Every trace in the dataset still has its spans
+                result = []
+            elif table == "trace_summary":
+                result = _dataset.search(params or {})
+            elif table == "schema_version":
+                result = [(0,)]
+            else:
+                result = []
+            rows = len(result)
+        key = f"{verb} {table}".strip()
+        with _lock:
+            counts = _counts.get(key)
+            if counts is None:
+                counts = _counts[key] = [0, 0]
+            counts[0] += 1
+            counts[1] += rows
+        return result
@@ -0,0 +1,195 @@
+"""Synthetic OTLP trace export payloads for the benchmarks"""
+import base64
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+SERVICES = ["auth-service", "order-service", "payment-service", "inventory-service"]
+OPERATIONS = ["user.login", "order.create", "payment.process", "inventory.check"]
+
+
+def make_spans(n_spans: int, spans_per_trace: int = 10, n_attrs: int = 5, seed: int = 42,
+               error_rate: float = 0.05) -> List[Dict[str, Any]]:
+    """Generate encoding-neutral span dicts grouped into flat traces"""
+    rng = random.Random(seed)
+    now = time.time_ns()
+    spans = []
+    trace_id = span_id = root_id = b""
+    for i in range(n_spans):
+        if i % spans_per_trace == 0:
+            trace_id = rng.randbytes(16)
+            root_id = b""
+        span_id = rng.randbytes(8)
+        start = now - rng.randint(0, 10_000_000_000)
+        spans.append({
+            "trace_id": trace_id,
+            "span_id": span_id,
+            "parent_span_id": root_id,
+            "service": SERVICES[i % len(SERVICES)],
+            "name": OPERATIONS[i % len(OPERATIONS)],
+            "start": start,
+            "end": start + rng.randint(1_000_000, 500_000_000),
+            "error": rng.random() < error_rate,
+            "attributes": _attributes(rng, n_attrs),
+        })
+        if not root_id:
+            root_id = span_id
+    return spans
+
+
+def make_traces(n_traces: int, fanout: int = 3, depth: int = 3, n_attrs: int = 5, seed: int = 42,
+                error_rate: float = 0.05, start_ns: int = 0) -> List[Dict[str, Any]]:
+    """Generate traces shaped as trees: every span below ``depth`` has
+    ``fanout`` children, each calling the next service and running within
+    its parent. A trace has (fanout ** depth - 1) / (fanout - 1) spans.
+    """
+    rng = random.Random(seed)
+    start_ns = start_ns or time.time_ns() - 60_000_000_000
+    spans: List[Dict[str, Any]] = []
+
+    def add(trace_id: bytes, parent: bytes, level: int, index: int, start: int, end: int):
+        span_id = rng.randbytes(8)
+        service = (level + index) % len(SERVICES)
+        spans.append({
+            "trace_id": trace_id,
+            "span_id": span_id,
+            "parent_span_id": parent,
+            "service": SERVICES[service],
+            "name": OPERATIONS[service],
+            "start": start,
+            "end": end,
+            "error": rng.random() < error_rate,
+            "attributes": _attributes(rng, n_attrs),
+        })
+        if level + 1 < depth:
+            # Children run one after another inside the parent
+            slot = (end - start) // fanout
+            for i in range(fanout):
+                child_start = start + i * slot + rng.randint(0, slot // 10)
+                add(trace_id, span_id, level + 1, i, child_start, child_start + slot * 8 // 10)
+
+    for t in range(n_traces):
+        start = start_ns + t * 1_000_000
+        add(rng.randbytes(16), b"", 0, t, start, start + rng.randint(10_000_000, 1_000_000_000))
+    return spans
+
+
+def _attributes(rng: random.Random, n_attrs: int) -> Dict[str, str]:
+    """``n_attrs`` attributes, the first being an indexed one (user.id)"""
+    if not n_attrs:
+        return {}
+    attrs = {"user.id": str(rng.randint(0, 10_000))}
+    attrs.update((f"attr.{k}", f"value-{rng.randint(0, 1000)}") for k in range(1, n_attrs))
+    return attrs
+
+
+def add_typed_attributes(spans: List[Dict[str, Any]], seed: int = 42) -> List[Dict[str, Any]]:
+    """Add one attribute of every non-string AnyValue kind to each span"""
+    rng = random.Random(seed)
+    for span in spans:
+        span["attributes"].update({
+            "http.status_code": rng.choice((200, 200, 200, 404, 500)),
+            "db.rows": rng.randint(0, 1 << 40),
+            "cache.hit": rng.random() < 0.8,
+            "sample.ratio": rng.random(),
+            "peer.addresses": ["10.0.0.1", "10.0.0.2"],
+            "request.headers": {"accept": "application/json", "retries": rng.randint(0, 3)},
+            "payload.digest": rng.randbytes(16),
+        })
+    return spans
+
+
+def _by_service(spans):
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for span in spans:
+        grouped.setdefault(span["service"], []).append(span)
+    return grouped
+
+
+def to_json(spans: List[Dict[str, Any]]) -> bytes:
+    """Encode spans as an OTLP/JSON ExportTraceServiceRequest"""
+    resource_spans = []
+    for service, group in _by_service(spans).items():
+        resource_spans.append({
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+            "scopeSpans": [{"spans": [{
+                "traceId": s["trace_id"].hex(),
+                "spanId": s["span_id"].hex(),
+                "parentSpanId": s["parent_span_id"].hex(),
+                "name": s["name"],
+                "startTimeUnixNano": str(s["start"]),
+                "endTimeUnixNano": str(s["end"]),
+                "attributes": [{"key": k, "value": _json_any(v)} for k, v in s["attributes"].items()],
+                "status": {"code": 2 if s["error"] else 0},
+            } for s in group]}],
+        })
+    return json.dumps({"resourceSpans": resource_spans}).encode()
+
+
+def to_protobuf(spans: List[Dict[str, Any]]) -> bytes:
+    """Encode spans as a binary OTLP/protobuf ExportTraceServiceRequest"""
+    from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import ExportTraceServiceRequest
+
+    request = ExportTraceServiceRequest()
+    for service, group in _by_service(spans).items():
+        resource_span = request.resource_spans.add()
+        attr = resource_span.resource.attributes.add()
+        attr.key = "service.name"
+        attr.value.string_value = service
+        scope_span = resource_span.scope_spans.add()
+        for s in group:
+            span = scope_span.spans.add()
+            span.trace_id = s["trace_id"]
+            span.span_id = s["span_id"]
+            span.parent_span_id = s["parent_span_id"]
+            span.name = s["name"]
+            span.start_time_unix_nano = s["start"]
+            span.end_time_unix_nano = s["end"]
+            span.status.code = 2 if s["error"] else 0
+            for k, v in s["attributes"].items():
+                kv = span.attributes.add()
+                kv.key = k
+                _proto_any(kv.value, v)
+    return request.SerializeToString()
+
+
+def _json_any(v: Any) -> Dict[str, Any]:
+    """A Python value as an OTLP/JSON AnyValue"""
+    if isinstance(v, str):
+        return {"stringValue": v}
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        # 64-bit integers are strings in the protobuf JSON mapping
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    if isinstance(v, bytes):
+        return {"bytesValue": base64.b64encode(v).decode()}
+    if isinstance(v, dict):
+        return {"kvlistValue": {"values": [{"key": k, "value": _json_any(x)} for k, x in v.items()]}}
+    return {"arrayValue": {"values": [_json_any(x) for x in v]}}
+
+
+def _proto_any(value, v: Any):
+    """Set an AnyValue message from a Python value"""
+    if isinstance(v, str):
+        value.string_value = v
+    elif isinstance(v, bool):
+        value.bool_value = v
+    elif isinstance(v, int):
+        value.int_value = v
+    elif isinstance(v, float):
+        value.double_value = v
+    elif isinstance(v, bytes):
+        value.bytes_value = v
+    elif isinstance(v, dict):
+        for k, x in v.items():
+            kv = value.kvlist_value.values.add()
+            kv.key = k
+            _proto_any(kv.value, x)
+    else:
+        value.array_value.SetInParent()
+        for x in v:
+            _proto_any(value.array_value.values.add(), x)
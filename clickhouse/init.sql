@@ -1,9 +1,214 @@
-CREATE DATABASE IF NOT EXISTS tracing;
-CREATE TABLE IF NOT EXISTS tracing.spans (
-  traceId String,
-  spanId String,
-  serviceName String,
-  duration UInt64,
-  receivedAt DateTime
-) ENGINE = MergeTree()
-ORDER BY (receivedAt, traceId);
+-- Tracing schema shared by the collector (writes traces.spans) and the
+-- backend (reads spans and the derived tables).
+--
+-- Every change to this file gets a new row in traces.schema_version and the
+-- matching SCHEMA_VERSION bump in collector/collector.py and
+-- backend/backend.py; both log a warning on startup when they disagree with
+-- the database.
+
+CREATE DATABASE IF NOT EXISTS traces;
+
+CREATE TABLE IF NOT EXISTS traces.schema_version (
+    version UInt32,
+    description String,
+    appliedAt DateTime DEFAULT now()
+) ENGINE = ReplacingMergeTree
+ORDER BY version;
+
+-- Raw spans, one row per span, partitioned by day. Copies of a span sent
+-- again by a retrying exporter share its sorting key, so merges keep one;
+-- the collector drops most of them before they are written. Only this table
+-- is deduplicated: the materialized views below see every inserted copy,
+-- and the collector's rollups and dependencies count each copy it accepts.
+CREATE TABLE IF NOT EXISTS traces.spans (
+    timestamp DateTime CODEC(Delta, ZSTD(1)),
+    startTimeUnixNano UInt64 CODEC(Delta, ZSTD(1)),
+    traceId String CODEC(ZSTD(1)),
+    spanId String CODEC(ZSTD(1)),
+    parentSpanId String CODEC(ZSTD(1)),
+    serviceName LowCardinality(String),
+    spanName LowCardinality(String),
+    duration UInt64 CODEC(T64, ZSTD(1)),
+    hasError UInt8,
+    statusCode UInt8,
+    statusMessage String CODEC(ZSTD(1)),
+    attributes String CODEC(ZSTD(1)),
+    httpMethod LowCardinality(String),
+    httpUrl String CODEC(ZSTD(1)),
+    httpStatusCode LowCardinality(String),
+    resourceAttributes Map(LowCardinality(String), String) CODEC(ZSTD(1)),
+    -- Span and resource attributes whose keys are in the collector's
+    -- indexed_attributes; feeds attribute_index
+    indexedAttributes Map(LowCardinality(String), String) CODEC(ZSTD(1)),
+    INDEX idx_trace_id traceId TYPE bloom_filter(0.001) GRANULARITY 1,
+    INDEX idx_duration duration TYPE minmax GRANULARITY 4,
+    INDEX idx_resource_keys mapKeys(resourceAttributes) TYPE bloom_filter(0.01) GRANULARITY 4,
+    INDEX idx_resource_values mapValues(resourceAttributes) TYPE bloom_filter(0.01) GRANULARITY 4
+) ENGINE = ReplacingMergeTree
+PARTITION BY toDate(timestamp)
+PRIMARY KEY (serviceName, spanName, timestamp)
+ORDER BY (serviceName, spanName, timestamp, traceId, spanId);
+
+-- One row per trace and hour, maintained at insert time by trace_summary_mv.
+-- Rows of the same trace are combined on merge; readers must still
+-- GROUP BY traceId with the matching aggregate functions.
+CREATE TABLE IF NOT EXISTS traces.trace_summary (
+    bucket DateTime,
+    traceId String,
+    start SimpleAggregateFunction(min, UInt64),
+    end SimpleAggregateFunction(max, UInt64),
+    rootService SimpleAggregateFunction(max, String),
+    rootName SimpleAggregateFunction(max, String),
+    rootDuration SimpleAggregateFunction(max, UInt64),
+    hasError SimpleAggregateFunction(max, UInt8),
+    -- Rows inserted, including copies from exporter retries
+    spanCount SimpleAggregateFunction(sum, UInt64),
+    -- Distinct spanIds (uniq keeps exact hashes below 65536 of them)
+    uniqueSpans AggregateFunction(uniq, String),
+    -- (service names, span counts including copies)
+    serviceSpans SimpleAggregateFunction(sumMap, Tuple(Array(String), Array(UInt64))),
+    INDEX idx_trace_id traceId TYPE bloom_filter(0.001) GRANULARITY 1
+) ENGINE = AggregatingMergeTree
+PARTITION BY toDate(bucket)
+ORDER BY (bucket, traceId);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS traces.trace_summary_mv TO traces.trace_summary AS
+SELECT
+    toStartOfHour(timestamp) AS bucket,
+    traceId,
+    min(startTimeUnixNano) AS start,
+    max(startTimeUnixNano + duration) AS end,
+    max(if(parentSpanId = '', toString(serviceName), '')) AS rootService,
+    max(if(parentSpanId = '', toString(spanName), '')) AS rootName,
+    max(if(parentSpanId = '', duration, 0)) AS rootDuration,
+    max(hasError) AS hasError,
+    count() AS spanCount,
+    uniqState(spanId) AS uniqueSpans,
+    sumMap([toString(serviceName)], [toUInt64(1)]) AS serviceSpans
+FROM traces.spans
+GROUP BY bucket, traceId;
+
+-- Per-service, per-operation RED metrics, written by the collector's
+-- ServiceRollups at 10s and 60s resolution from every ingested span
+-- (before sampling). Partial rows from each flush and collector process
+-- are summed on merge; readers must still aggregate with the matching
+-- functions.
+CREATE TABLE IF NOT EXISTS traces.service_rollups (
+    resolution UInt16,
+    bucket DateTime CODEC(Delta, ZSTD(1)),
+    serviceName LowCardinality(String),
+    spanName LowCardinality(String),
+    requests SimpleAggregateFunction(sum, UInt64),
+    errors SimpleAggregateFunction(sum, UInt64),
+    -- Spans without a parent, i.e. traces started by this operation
+    roots SimpleAggregateFunction(sum, UInt64),
+    durationSum SimpleAggregateFunction(sum, UInt64),
+    durationMax SimpleAggregateFunction(max, UInt64),
+    -- Latency histogram: (log-spaced bins, span counts)
+    latency SimpleAggregateFunction(sumMap, Tuple(Array(UInt16), Array(UInt64)))
+) ENGINE = AggregatingMergeTree
+PARTITION BY toDate(bucket)
+ORDER BY (resolution, serviceName, bucket, spanName);
+
+-- Upgrade of a version 2 database; no-ops on a fresh one
+ALTER TABLE traces.spans
+    ADD COLUMN IF NOT EXISTS resourceAttributes Map(LowCardinality(String), String) CODEC(ZSTD(1)),
+    ADD COLUMN IF NOT EXISTS indexedAttributes Map(LowCardinality(String), String) CODEC(ZSTD(1)),
+    ADD INDEX IF NOT EXISTS idx_resource_keys mapKeys(resourceAttributes) TYPE bloom_filter(0.01) GRANULARITY 4,
+    ADD INDEX IF NOT EXISTS idx_resource_values mapValues(resourceAttributes) TYPE bloom_filter(0.01) GRANULARITY 4;
+
+-- Traces by indexed attribute, one row per (key, value, hour, trace),
+-- maintained at insert time by attribute_index_mv. Duplicates from several
+-- spans of a trace collapse on merge; readers use it as an IN set.
+CREATE TABLE IF NOT EXISTS traces.attribute_index (
+    key LowCardinality(String),
+    value String,
+    bucket DateTime,
+    traceId String CODEC(ZSTD(1))
+) ENGINE = ReplacingMergeTree
+PARTITION BY toDate(bucket)
+ORDER BY (key, value, bucket, traceId);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS traces.attribute_index_mv TO traces.attribute_index AS
+SELECT DISTINCT
+    attribute.1 AS key,
+    attribute.2 AS value,
+    toStartOfHour(timestamp) AS bucket,
+    traceId
+FROM traces.spans
+ARRAY JOIN arrayZip(mapKeys(indexedAttributes), mapValues(indexedAttributes)) AS attribute;
+
+-- Calls between services per minute, written by the collector's
+-- ServiceDependencies from the parent span IDs of every ingested span.
+-- Partial rows are summed on merge like service_rollups.
+CREATE TABLE IF NOT EXISTS traces.service_dependencies (
+    bucket DateTime CODEC(Delta, ZSTD(1)),
+    caller LowCardinality(String),
+    callee LowCardinality(String),
+    calls SimpleAggregateFunction(sum, UInt64),
+    errors SimpleAggregateFunction(sum, UInt64),
+    -- Callee span durations
+    durationSum SimpleAggregateFunction(sum, UInt64),
+    durationMax SimpleAggregateFunction(max, UInt64),
+    latency SimpleAggregateFunction(sumMap, Tuple(Array(UInt16), Array(UInt64)))
+) ENGINE = AggregatingMergeTree
+PARTITION BY toDate(bucket)
+ORDER BY (bucket, caller, callee);
+
+-- Retention tiers. Raw spans and the 10s rollups are kept for 7 days;
+-- trace summaries, the attribute index, 60s rollups and service
+-- dependencies for 90 days, so traces can still be found and their summary
+-- shown after their spans are gone; then everything is deleted. To change
+-- the tiers, edit the intervals and re-run these statements, and set the
+-- backend's SPAN_RETENTION_DAYS and SUMMARY_RETENTION_DAYS to match.
+-- Tables partitioned by day drop whole parts once all their rows expire
+-- instead of rewriting them.
+ALTER TABLE traces.spans MODIFY SETTING ttl_only_drop_parts = 1;
+ALTER TABLE traces.spans MODIFY TTL timestamp + INTERVAL 7 DAY;
+
+ALTER TABLE traces.trace_summary MODIFY SETTING ttl_only_drop_parts = 1;
+ALTER TABLE traces.trace_summary MODIFY TTL bucket + INTERVAL 90 DAY;
+
+ALTER TABLE traces.attribute_index MODIFY SETTING ttl_only_drop_parts = 1;
+ALTER TABLE traces.attribute_index MODIFY TTL bucket + INTERVAL 90 DAY;
+
+-- Both resolutions share partitions, so the 10s rows are deleted by rewriting them
+ALTER TABLE traces.service_rollups MODIFY TTL
+    bucket + INTERVAL 7 DAY DELETE WHERE resolution = 10,
+    bucket + INTERVAL 90 DAY;
+
+ALTER TABLE traces.service_dependencies MODIFY SETTING ttl_only_drop_parts = 1;
+ALTER TABLE traces.service_dependencies MODIFY TTL bucket + INTERVAL 90 DAY;
+
+-- Upgrade of a version 5 database. ClickHouse can't change the engine or
+-- sorting key of an existing table, so spans is copied into a new one; the
+-- materialized views stay attached to traces.spans across the exchange.
+-- Run by hand with the collectors stopped:
+--
+--   CREATE TABLE traces.spans_v6 AS traces.spans ENGINE = ReplacingMergeTree
+--       PARTITION BY toDate(timestamp)
+--       PRIMARY KEY (serviceName, spanName, timestamp)
+--       ORDER BY (serviceName, spanName, timestamp, traceId, spanId)
+--       TTL timestamp + INTERVAL 7 DAY
+--       SETTINGS ttl_only_drop_parts = 1;
+--   INSERT INTO traces.spans_v6 SELECT * FROM traces.spans;
+--   EXCHANGE TABLES traces.spans AND traces.spans_v6;
+--   DROP TABLE traces.spans_v6;
+
+-- Upgrade of a version 6 database. Rows written before it have an empty
+-- uniqueSpans, and readers fall back to spanCount. The view must be
+-- recreated by hand with the collectors stopped:
+--
+--   DROP VIEW traces.trace_summary_mv;
+--   -- then re-run the CREATE MATERIALIZED VIEW traces.trace_summary_mv above
+ALTER TABLE traces.trace_summary
+    ADD COLUMN IF NOT EXISTS uniqueSpans AggregateFunction(uniq, String) AFTER spanCount;
+
+INSERT INTO traces.schema_version (version, description) VALUES
+    (1, 'spans partitioned by day, trace_summary materialized view'),
+    (2, 'service_rollups'),
+    (3, 'span resource and indexed attributes, attribute_index'),
+    (4, 'service_dependencies'),
+    (5, 'retention tiers: 7 days of spans, 90 days of summaries and rollups'),
+    (6, 'spans deduplicated on (traceId, spanId) by ReplacingMergeTree'),
+    (7, 'trace_summary counts distinct spans');
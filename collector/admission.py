@@ -0,0 +1,264 @@
+"""Admission control for /v1/traces.
+
+Requests are checked in three places, cheapest first:
+
+1. before the body is read: its size against ``max_request_bytes``, and the
+   bytes of all in-flight requests against ``max_inflight_bytes``
+2. after decoding: the spans of all in-flight requests against
+   ``max_inflight_spans``
+3. per service: a token bucket of spans per second, configured with
+   ``rate_limit`` and ``burst`` on the entries under ``services:`` in
+   rules.yaml (``admission.default_rate_limit``/``default_burst`` apply to
+   services without their own)
+
+Rejections map to OTLP/HTTP retryable responses: 503 when the collector is
+saturated and 429 when a service is over its quota, both with Retry-After.
+When only some services in a request are over quota, their spans are
+dropped and the rest are accepted as a partial success.
+"""
+import math
+import multiprocessing
+import time
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+from sampler import RulesFile
+from span_batch import SpanBatch
+
+# Rules are re-read from disk at most this often
+_RELOAD_INTERVAL = 1.0
+
+
+class Rejected(Exception):
+    """A request or batch that must not be accepted"""
+
+    def __init__(self, status_code: int, reason: str, message: str, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _take(tokens: float, updated: float, n: int, now: float, rate: float, burst: float) -> Tuple[float, float]:
+    """Refill a token bucket and try to take ``n``; returns (tokens, wait).
+
+    ``wait`` is 0 when the tokens were taken, otherwise the seconds until
+    they would be available. A full bucket admits a request larger than the
+    burst and goes into debt, so such requests aren't rejected forever.
+    """
+    tokens = burst if updated == 0 else min(burst, tokens + (now - updated) * rate)
+    if n <= tokens or tokens >= burst:
+        return tokens - n, 0.0
+    return tokens, (min(n, burst) - tokens) / rate
+
+
+class TokenBuckets:
+    """Per-service token buckets of ``rate`` spans per second, up to ``burst``"""
+
+    def __init__(self):
+        # service -> [tokens, last refill]
+        self._buckets: Dict[str, list] = {}
+
+    def take(self, service: str, n: int, now: float, rate: float, burst: float) -> float:
+        bucket = self._buckets.get(service)
+        if bucket is None:
+            bucket = self._buckets[service] = [0.0, 0.0]
+        bucket[0], wait = _take(bucket[0], bucket[1], n, now, rate, burst)
+        bucket[1] = now
+        return wait
+
+
+class SharedTokenBuckets:
+    """Token buckets in shared memory, for workers forked from one parent.
+
+    Every worker takes from the same buckets, so a service's quota holds
+    across the collector no matter which workers its connections land on.
+    Services hash onto ``slots`` buckets; the rare collision shares a quota.
+    """
+
+    def __init__(self, slots: int = 4096):
+        self.slots = slots
+        # tokens and last refill (monotonic, shared across processes) per slot
+        self._state = multiprocessing.RawArray("d", 2 * slots)
+        self._lock = multiprocessing.Lock()
+
+    def take(self, service: str, n: int, now: float, rate: float, burst: float) -> float:
+        i = 2 * (zlib.crc32(service.encode()) % self.slots)
+        state = self._state
+        with self._lock:
+            state[i], wait = _take(state[i], state[i + 1], n, now, rate, burst)
+            state[i + 1] = now
+        return wait
+
+
+class _ServiceStats:
+    __slots__ = ("accepted_spans", "throttled_spans", "shed_spans", "throttled_requests")
+
+    def __init__(self):
+        self.accepted_spans = 0
+        self.throttled_spans = 0
+        self.shed_spans = 0
+        self.throttled_requests = 0
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        rules_file: RulesFile,
+        max_request_bytes: int = 16 * 1024 * 1024,
+        max_inflight_bytes: int = 256 * 1024 * 1024,
+        max_inflight_spans: int = 500_000,
+        retry_after: int = 1,
+        buckets=None,
+    ):
+        self.rules_file = rules_file
+        self.max_request_bytes = max_request_bytes
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_inflight_spans = max_inflight_spans
+        self.retry_after = retry_after
+
+        self.inflight_bytes = 0
+        self.inflight_spans = 0
+        self._buckets = buckets if buckets is not None else TokenBuckets()
+        # (rate, burst) per service, and for services not listed
+        self._quotas: Dict[str, Tuple[float, float]] = {}
+        self._default_quota: Optional[Tuple[float, float]] = None
+        self._rules_mtime = None
+        self._checked_at = 0.0
+
+        self.rejected_requests = {"too_large": 0, "inflight_bytes": 0, "inflight_spans": 0, "quota": 0}
+        self.services: Dict[str, _ServiceStats] = {}
+
+    def check_size(self, nbytes: int):
+        """Reject request bodies over ``max_request_bytes``; not retryable"""
+        if nbytes > self.max_request_bytes:
+            self.rejected_requests["too_large"] += 1
+            raise Rejected(413, "too_large", f"Request body exceeds {self.max_request_bytes} bytes")
+
+    def enter(self, nbytes: int):
+        """Admit a request body of ``nbytes`` before it is read"""
+        self.check_size(nbytes)
+        # A single request is always admitted into an idle collector
+        if self.inflight_bytes and self.inflight_bytes + nbytes > self.max_inflight_bytes:
+            self.rejected_requests["inflight_bytes"] += 1
+            raise Rejected(503, "inflight_bytes", "Collector is over its in-flight bytes limit", self.retry_after)
+        self.inflight_bytes += nbytes
+
+    def admit(self, batch: SpanBatch) -> Tuple[SpanBatch, int]:
+        """Apply the span limit and service quotas to a decoded batch.
+
+        Returns the admitted spans and the number rejected. The admitted spans
+        count as in flight until ``leave``.
+        """
+        self._maybe_reload()
+        counts: Dict[str, int] = {}
+        for service in batch.service:
+            counts[service] = counts.get(service, 0) + 1
+
+        if self.inflight_spans and self.inflight_spans + len(batch) > self.max_inflight_spans:
+            self.rejected_requests["inflight_spans"] += 1
+            for service, n in counts.items():
+                self._stats(service).shed_spans += n
+            raise Rejected(503, "inflight_spans", "Collector is over its in-flight spans limit", self.retry_after)
+
+        now = time.monotonic()
+        throttled: Dict[str, float] = {}
+        for service, n in counts.items():
+            wait = self._take(service, n, now)
+            if wait:
+                throttled[service] = wait
+                stats = self._stats(service)
+                stats.throttled_spans += n
+                stats.throttled_requests += 1
+            else:
+                self._stats(service).accepted_spans += n
+
+        if throttled:
+            if len(throttled) == len(counts):
+                self.rejected_requests["quota"] += 1
+                raise Rejected(
+                    429, "quota",
+                    f"Over span quota: {', '.join(sorted(throttled))}",
+                    max(math.ceil(min(throttled.values())), 1),
+                )
+            keep = [i for i, service in enumerate(batch.service) if service not in throttled]
+            rejected = len(batch) - len(keep)
+            batch = batch.take(keep)
+        else:
+            rejected = 0
+        self.inflight_spans += len(batch)
+        return batch, rejected
+
+    def leave(self, nbytes: int, nspans: int = 0):
+        self.inflight_bytes -= nbytes
+        self.inflight_spans -= nspans
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight_bytes": self.inflight_bytes,
+            "max_inflight_bytes": self.max_inflight_bytes,
+            "inflight_spans": self.inflight_spans,
+            "max_inflight_spans": self.max_inflight_spans,
+            "max_request_bytes": self.max_request_bytes,
+            "rejected_requests": dict(self.rejected_requests),
+            "services": {name: self._service_stats(name, s) for name, s in self.services.items()},
+        }
+
+    def _service_stats(self, name: str, stats: _ServiceStats) -> Dict[str, Any]:
+        quota = self._quota(name)
+        return {
+            "accepted_spans": stats.accepted_spans,
+            "throttled_spans": stats.throttled_spans,
+            "shed_spans": stats.shed_spans,
+            "throttled_requests": stats.throttled_requests,
+            "rate_limit": quota[0] if quota else None,
+            "burst": quota[1] if quota else None,
+        }
+
+    def _stats(self, service: str) -> _ServiceStats:
+        stats = self.services.get(service)
+        if stats is None:
+            stats = self.services[service] = _ServiceStats()
+        return stats
+
+    def _quota(self, service: str) -> Optional[Tuple[float, float]]:
+        return self._quotas.get(service, self._default_quota)
+
+    def _take(self, service: str, n: int, now: float) -> float:
+        quota = self._quota(service)
+        if quota is None:
+            return 0.0
+        return self._buckets.take(service, n, now, *quota)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < _RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        self.rules_file.reload()
+        if self.rules_file.mtime == self._rules_mtime:
+            return
+        self._rules_mtime = self.rules_file.mtime
+        self._load(self.rules_file.data)
+
+    def _load(self, data: Dict[str, Any]):
+        defaults = data.get("admission") or {}
+        self._default_quota = _parse_quota(defaults.get("default_rate_limit"), defaults.get("default_burst"))
+        quotas = {}
+        for entry in data.get("services") or []:
+            if "name" not in entry:
+                continue
+            quota = _parse_quota(entry.get("rate_limit"), entry.get("burst"))
+            if quota is not None:
+                quotas[entry["name"]] = quota
+        # Buckets keep their fill level; new limits apply from the next refill
+        self._quotas = quotas
+
+
+def _parse_quota(rate_limit: Any, burst: Any) -> Optional[Tuple[float, float]]:
+    """(rate, burst) from rules.yaml values; no or zero rate means unlimited"""
+    if not rate_limit:
+        return None
+    rate = float(rate_limit)
+    # Default to one second's worth of spans
+    return rate, float(burst) if burst else rate
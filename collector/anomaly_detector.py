@@ -1,59 +1,205 @@
 # anomaly_detector.py
-import numpy as np
-from collections import defaultdict, deque
-import numpy as np
-class AnomalyDetector:
-    def __init__(self):
-        self.baseline_p95 = 100_000_000
-    def detect(self, spans):
-        return False
-detector = AnomalyDetector()
+import math
+import time
+from array import array
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from span_batch import STATUS_CODE_ERROR, SpanBatch
+
+
+class DDSketch:
+    """Fixed-size DDSketch over durations in nanoseconds.
+
+    Bins are log-spaced with relative accuracy ``alpha`` and pre-allocated,
+    so adding a value never allocates and two sketches merge by adding bins.
+    """
+
+    def __init__(self, alpha: float = 0.01, min_value: float = 1_000, max_value: float = 3_600_000_000_000):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.inv_log_gamma = 1 / math.log(self.gamma)
+        self.min_value = min_value
+        self.offset = math.ceil(math.log(min_value) * self.inv_log_gamma)
+        self.n_bins = math.ceil(math.log(max_value) * self.inv_log_gamma) - self.offset + 1
+        self.bins = array("Q", bytes(8 * self.n_bins))
+        self.count = 0
+
+    def add(self, value: float):
+        if value <= self.min_value:
+            idx = 0
+        else:
+            idx = math.ceil(math.log(value) * self.inv_log_gamma) - self.offset
+            if idx >= self.n_bins:
+                idx = self.n_bins - 1
+        self.bins[idx] += 1
+        self.count += 1
+
+    def merge(self, other: "DDSketch"):
+        bins = self.bins
+        for i, c in enumerate(other.bins):
+            if c:
+                bins[i] += c
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = 0
+        for i, c in enumerate(self.bins):
+            seen += c
+            if seen > rank:
+                return 2 * self.gamma ** (i + self.offset) / (self.gamma + 1)
+        return 2 * self.gamma ** (self.n_bins - 1 + self.offset) / (self.gamma + 1)
+
+
+class _ServiceWindows:
+    """Current window plus a ring of closed windows for one service"""
+
+    __slots__ = ("current", "errors", "total", "history", "last_seen")
+
+    def __init__(self, history: int, alpha: float, now: float):
+        self.current = DDSketch(alpha)
+        self.errors = 0
+        self.total = 0
+        # End of the last window with spans, for evicting idle services
+        self.last_seen = now
+        # (sketch, errors, total) for each closed window, oldest first
+        self.history: Deque = deque(maxlen=history)
+
 
 class AnomalyDetector:
-    def __init__(self):
-        self.latency_history = defaultdict(deque)
-        self.error_history = defaultdict(deque)
-        self.window_size = 100
-    
-    def detect_latency_spike(self, spans, service_name):
-        """Detect 2x P95 latency increase"""
-        if not spans or len(spans) < 10:
-            return False
-        
-        latencies = [
-            (s.endTimeUnixNano - s.startTimeUnixNano) // 1000  # microseconds
-            for s in spans
-        ]
-        
-        current_p95 = np.percentile(latencies, 95)
-        
-        if len(self.latency_history[service_name]) > 50:
-            prev_p95 = np.percentile(
-                list(self.latency_history[service_name])[-50:], 
-                95
-            )
+    """Per-service latency and error-rate anomaly detection.
+
+    Every ingested batch is added to the service's current window. When a
+    window closes its p95 is compared against the p95 of the merged previous
+    windows, and its error rate against ``error_rate_threshold``.
+
+    Windows also close when anomalies or stats are read, so the last window
+    of a service that went quiet is still evaluated. Services without spans
+    for ``history_windows`` windows are forgotten.
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = 10.0,
+        history_windows: int = 30,
+        spike_factor: float = 2.0,
+        error_rate_threshold: float = 0.05,
+        min_samples: int = 10,
+        alpha: float = 0.01,
+        max_anomalies: int = 1000,
+    ):
+        self.window_seconds = window_seconds
+        self.history_windows = history_windows
+        self.spike_factor = spike_factor
+        self.error_rate_threshold = error_rate_threshold
+        self.min_samples = min_samples
+        self.alpha = alpha
+
+        self.services: Dict[str, _ServiceWindows] = {}
+        self.anomalies: Deque[Dict[str, Any]] = deque(maxlen=max_anomalies)
+        self.window_started: Optional[float] = None
+
+    def observe(self, batch: SpanBatch, now: Optional[float] = None):
+        """Add a batch of spans, closing the window first if it is due"""
+        now = time.time() if now is None else now
+        if self.window_started is None:
+            self.window_started = now
         else:
-            prev_p95 = current_p95
-        
-        self.latency_history[service_name].append(current_p95)
-        if len(self.latency_history[service_name]) > self.window_size:
-            self.latency_history[service_name].popleft()
-        
-        return current_p95 > prev_p95 * 2  # 2x spike threshold
-    
-    def detect_error_spike(self, spans, service_name):
-        """Detect >5% error rate"""
-        if not spans:
-            return False
-        
-        errors = sum(1 for s in spans if s.status.get("code") == 2)
-        total = len(spans)
-        error_rate = errors / total if total > 0 else 0
-        
-        self.error_history[service_name].append(error_rate)
-        if len(self.error_history[service_name]) > self.window_size:
-            self.error_history[service_name].popleft()
-        
-        return error_rate > 0.05  # 5% threshold
-
-detector = AnomalyDetector()
+            self.advance(now)
+
+        services = self.services
+        last_name = None
+        windows = None
+        # Service names are interned, so consecutive spans of one service
+        # skip the dict lookup
+        for name, duration, status_code in zip(batch.service, batch.duration, batch.status_code):
+            if name is not last_name:
+                windows = services.get(name)
+                if windows is None:
+                    windows = services[name] = _ServiceWindows(self.history_windows, self.alpha, now)
+                last_name = name
+            windows.current.add(duration)
+            if status_code == STATUS_CODE_ERROR:
+                windows.errors += 1
+            windows.total += 1
+
+    def advance(self, now: Optional[float] = None):
+        """Close the current window if it is due"""
+        now = time.time() if now is None else now
+        if self.window_started is not None and now - self.window_started >= self.window_seconds:
+            self.close_window(now)
+
+    def close_window(self, now: Optional[float] = None):
+        """Evaluate the current window of every service and start a new one"""
+        now = time.time() if now is None else now
+        idle_after = self.window_seconds * self.history_windows
+        for name, windows in list(self.services.items()):
+            if windows.total:
+                windows.last_seen = now
+            elif now - windows.last_seen >= idle_after:
+                del self.services[name]
+                continue
+            current = windows.current
+            if windows.total >= self.min_samples:
+                self._check_latency(name, windows, now)
+                self._check_errors(name, windows, now)
+            windows.history.append((current, windows.errors, windows.total))
+            windows.current = DDSketch(self.alpha)
+            windows.errors = 0
+            windows.total = 0
+        self.window_started = now
+
+    def _check_latency(self, name: str, windows: _ServiceWindows, now: float):
+        if not windows.history:
+            return
+        baseline = DDSketch(self.alpha)
+        for sketch, _, _ in windows.history:
+            baseline.merge(sketch)
+        if baseline.count < self.min_samples:
+            return
+        current_p95 = windows.current.quantile(0.95)
+        baseline_p95 = baseline.quantile(0.95)
+        if current_p95 > baseline_p95 * self.spike_factor:
+            self.anomalies.append({
+                "type": "latency_spike",
+                "service": name,
+                "timestamp": now,
+                "p95Ms": round(current_p95 / 1e6, 3),
+                "baselineP95Ms": round(baseline_p95 / 1e6, 3),
+                "samples": windows.total,
+            })
+
+    def _check_errors(self, name: str, windows: _ServiceWindows, now: float):
+        error_rate = windows.errors / windows.total
+        if error_rate > self.error_rate_threshold:
+            self.anomalies.append({
+                "type": "error_spike",
+                "service": name,
+                "timestamp": now,
+                "errorRate": round(error_rate, 4),
+                "errors": windows.errors,
+                "samples": windows.total,
+            })
+
+    def recent(self, since: float = 0, service: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Detected anomalies, newest first"""
+        self.advance()
+        return [
+            a for a in reversed(self.anomalies)
+            if a["timestamp"] >= since and (service is None or a["service"] == service)
+        ]
+
+    def service_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Current-window p95 and error rate per service"""
+        self.advance()
+        return {
+            name: {
+                "p95Ms": round(w.current.quantile(0.95) / 1e6, 3),
+                "errorRate": round(w.errors / w.total, 4) if w.total else 0.0,
+                "samples": w.total,
+            }
+            for name, w in self.services.items()
+        }
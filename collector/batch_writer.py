@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import SIZE_BUCKETS, Histogram
+from span_batch import INSERT_COLUMNS, SpanBatch
+
+logger = logging.getLogger(__name__)
+
+INSERT_SPANS_QUERY = f"INSERT INTO spans ({', '.join(INSERT_COLUMNS)}) VALUES"
+
+# Marks the end of the queue on shutdown
+_STOP = object()
+
+
+class BatchWriter:
+    """Background writer that batches spans into large ClickHouse inserts.
+
+    Request handlers hand ``SpanBatch`` objects over through a bounded queue.
+    A single task drains the queue and flushes when ``max_batch_size`` spans
+    are pending or ``flush_interval`` seconds after the first one arrived,
+    whichever comes first. Pending batches are concatenated and written with
+    one columnar insert on a dedicated thread, so the event loop never blocks.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Any],
+        max_batch_size: int = 10000,
+        flush_interval: float = 1.0,
+        queue_size: int = 1000,
+    ):
+        self.client_factory = client_factory
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+
+        self._client = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # One thread: the ClickHouse client is not thread-safe
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ch-writer")
+
+        self.batches_flushed = 0
+        self.spans_written = 0
+        self.spans_failed = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.spans_written_by_service: Dict[str, int] = {}
+        self.insert_seconds = Histogram("collector_insert_seconds", "Time to insert a batch of spans into ClickHouse")
+        self.insert_batch_spans = Histogram("collector_insert_batch_spans", "Spans per ClickHouse insert", SIZE_BUCKETS)
+
+    async def start(self):
+        """Start the background flush task"""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"🚚 Batch writer started (batch={self.max_batch_size}, "
+            f"interval={self.flush_interval}s, queue={self.queue_size})"
+        )
+
+    async def stop(self):
+        """Flush everything still queued and stop the background task"""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, batch: SpanBatch):
+        """Queue a batch for insertion, waiting while the queue is full"""
+        if len(batch):
+            await self._queue.put(batch)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth(),
+            "queue_size": self.queue_size,
+            "max_batch_size": self.max_batch_size,
+            "flush_interval": self.flush_interval,
+            "batches_flushed": self.batches_flushed,
+            "spans_written": self.spans_written,
+            "spans_failed": self.spans_failed,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+    async def _run(self):
+        batches: List[SpanBatch] = []
+        pending = 0
+        deadline = None
+        stopping = False
+
+        while not stopping:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                await self._flush(batches)
+                batches, pending, deadline = [], 0, None
+                continue
+
+            # Drain whatever else is already queued without yielding
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                batches.append(item)
+                pending += len(item)
+                if pending >= self.max_batch_size:
+                    await self._flush(batches)
+                    batches, pending, deadline = [], 0, None
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+
+        await self._flush(batches)
+
+    async def _flush(self, batches: List[SpanBatch]):
+        if not batches:
+            return
+        batch = batches[0] if len(batches) == 1 else SpanBatch.concat(batches)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            by_service = await loop.run_in_executor(self._executor, self._insert, batch)
+            self.spans_written += len(batch)
+            add_counts(self.spans_written_by_service, by_service)
+            self.insert_seconds.observe(time.perf_counter() - started)
+            self.insert_batch_spans.observe(len(batch))
+        except Exception as e:
+            self.spans_failed += len(batch)
+            logger.error(f"❌ Failed to insert batch of {len(batch)} spans: {e}")
+        self.batches_flushed += 1
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    def _insert(self, batch: SpanBatch) -> Counter:
+        """Insert the batch; returns its spans per service"""
+        if self._client is None:
+            self._client = self.client_factory()
+        try:
+            self._client.execute(INSERT_SPANS_QUERY, batch.insert_columns(), columnar=True)
+        except Exception:
+            # Drop the connection so the next flush reconnects
+            self._client = None
+            raise
+        return Counter(batch.service)
+
+
+def add_counts(total: Dict[str, int], counts: Dict[str, int]):
+    for key, n in counts.items():
+        total[key] = total.get(key, 0) + n
@@ -1,14 +1,32 @@
 import os
+import asyncio
+import importlib
 import json
 import logging
+import time
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, FrozenSet, List, Any, Optional
 import uvicorn
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from clickhouse_driver import Client
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import ExportTraceServiceResponse
 import random
 
+from admission import AdmissionController, Rejected
+from anomaly_detector import AnomalyDetector
+from batch_writer import BatchWriter
+from dedup import SpanDeduplicator
+from dependencies import ServiceDependencies
+from grpc_receiver import GrpcReceiver
+from metrics import SIZE_BUCKETS, Histogram, Registry, RequestMetrics, family, monitor_event_loop, render
+from otlp import PROTOBUF_CONTENT_TYPE, UnsupportedEncoding, decode_request, decompress_body
+from rollups import ServiceRollups
+from sampler import RulesFile, TailSampler
+from span_batch import SpanBatch
+from spool import Spool, SpoolReplayer
+from workers import SHARED_BUCKETS, WORKER_ID, WORKER_RUN_DIR, DecisionPeers, DependencyPeers, publish_state
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -23,29 +41,317 @@ CLICKHOUSE_HOST = os.getenv("CLICKHOUSE_HOST", "clickhouse")
 CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", "8123"))
 CLICKHOUSE_DB = os.getenv("CLICKHOUSE_DB", "traces")
 
+# Version of clickhouse/init.sql this collector writes
+SCHEMA_VERSION = 7
+
+# Batch writer configuration
+WRITER_BATCH_SIZE = int(os.getenv("WRITER_BATCH_SIZE", "10000"))
+WRITER_FLUSH_INTERVAL_MS = int(os.getenv("WRITER_FLUSH_INTERVAL_MS", "1000"))
+WRITER_QUEUE_SIZE = int(os.getenv("WRITER_QUEUE_SIZE", "1000"))
+
+# Spool configuration: spans are acknowledged once on disk and replayed
+# into ClickHouse in the background
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "true").lower() == "true"
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+SPOOL_SEGMENT_MB = int(os.getenv("SPOOL_SEGMENT_MB", "64"))
+SPOOL_MAX_MB = int(os.getenv("SPOOL_MAX_MB", "1024"))
+SPOOL_FSYNC = os.getenv("SPOOL_FSYNC", "false").lower() == "true"
+SPOOL_REPLAY_BATCH_SIZE = int(os.getenv("SPOOL_REPLAY_BATCH_SIZE", "50000"))
+SPOOL_REPLAY_MAX_SPANS_PER_SEC = float(os.getenv("SPOOL_REPLAY_MAX_SPANS_PER_SEC", "0"))
+
+# Admission control; per-service quotas live in rules.yaml
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(16 * 1024 * 1024)))
+MAX_INFLIGHT_BYTES = int(os.getenv("MAX_INFLIGHT_BYTES", str(256 * 1024 * 1024)))
+MAX_INFLIGHT_SPANS = int(os.getenv("MAX_INFLIGHT_SPANS", "500000"))
+
+# OTLP/gRPC receiver, served by every worker next to OTLP/HTTP
+GRPC_ENABLED = os.getenv("GRPC_ENABLED", "true").lower() == "true"
+GRPC_PORT = int(os.getenv("GRPC_PORT", "4317"))
+GRPC_MAX_CONCURRENT_RPCS = int(os.getenv("GRPC_MAX_CONCURRENT_RPCS", "1000"))
+GRPC_MAX_CONCURRENT_STREAMS = int(os.getenv("GRPC_MAX_CONCURRENT_STREAMS", "100"))
+
+# Suppression of spans exporters send again after a failed or timed out request
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "300"))
+DEDUP_CAPACITY = int(os.getenv("DEDUP_CAPACITY", "2000000"))
+DEDUP_FP_RATE = float(os.getenv("DEDUP_FP_RATE", "0.0001"))
+
+# Tail sampling configuration
+RULES_PATH = os.getenv("RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.yaml"))
+SAMPLER_ENABLED = os.getenv("SAMPLER_ENABLED", "true").lower() == "true"
+SAMPLER_DECISION_WAIT_MS = int(os.getenv("SAMPLER_DECISION_WAIT_MS", "10000"))
+SAMPLER_MAX_TRACES = int(os.getenv("SAMPLER_MAX_TRACES", "50000"))
+SAMPLER_MAX_SPANS = int(os.getenv("SAMPLER_MAX_SPANS", "500000"))
+
+# Anomaly detection configuration
+ANOMALY_WINDOW_SECONDS = float(os.getenv("ANOMALY_WINDOW_SECONDS", "10"))
+ANOMALY_HISTORY_WINDOWS = int(os.getenv("ANOMALY_HISTORY_WINDOWS", "30"))
+
+# Service rollup configuration
+ROLLUP_FLUSH_INTERVAL_MS = int(os.getenv("ROLLUP_FLUSH_INTERVAL_MS", "10000"))
+
+# Service dependency graph configuration
+DEPENDENCY_FLUSH_INTERVAL_MS = int(os.getenv("DEPENDENCY_FLUSH_INTERVAL_MS", "10000"))
+DEPENDENCY_WINDOW_SECONDS = float(os.getenv("DEPENDENCY_WINDOW_SECONDS", "30"))
+DEPENDENCY_MAX_SPANS = int(os.getenv("DEPENDENCY_MAX_SPANS", "200000"))
+DEPENDENCY_MAX_PENDING = int(os.getenv("DEPENDENCY_MAX_PENDING", "100000"))
+
 # Initialize ClickHouse client
 ch_client = None
 
+# "module:function" returning a client to use instead of clickhouse_driver,
+# e.g. the fake client the benchmarks run against
+CLICKHOUSE_CLIENT_FACTORY = os.getenv("CLICKHOUSE_CLIENT_FACTORY")
+
+def create_clickhouse_client():
+    """Create a new ClickHouse client"""
+    if CLICKHOUSE_CLIENT_FACTORY:
+        module, _, name = CLICKHOUSE_CLIENT_FACTORY.partition(":")
+        return getattr(importlib.import_module(module), name)()
+    return Client(
+        host=CLICKHOUSE_HOST,
+        port=9000,  # Native protocol port
+        database=CLICKHOUSE_DB
+    )
+
 def get_clickhouse_client():
     """Get or create ClickHouse client"""
     global ch_client
     if ch_client is None:
         try:
-            ch_client = Client(
-                host=CLICKHOUSE_HOST,
-                port=9000,  # Native protocol port
-                database=CLICKHOUSE_DB
-            )
+            ch_client = create_clickhouse_client()
             logger.info(f"✅ Connected to ClickHouse at {CLICKHOUSE_HOST}")
         except Exception as e:
             logger.error(f"❌ Failed to connect to ClickHouse: {e}")
             raise
     return ch_client
 
+def check_schema_version(client):
+    """Warn when the database schema differs from the one this collector expects"""
+    try:
+        version = client.execute("SELECT max(version) FROM schema_version")[0][0]
+    except Exception as e:
+        logger.warning(f"⚠️ Could not read schema version: {e}")
+        return
+    if version != SCHEMA_VERSION:
+        logger.warning(f"⚠️ ClickHouse schema is version {version}, collector expects {SCHEMA_VERSION}")
+
+writer = BatchWriter(
+    create_clickhouse_client,
+    max_batch_size=WRITER_BATCH_SIZE,
+    flush_interval=WRITER_FLUSH_INTERVAL_MS / 1000,
+    queue_size=WRITER_QUEUE_SIZE,
+)
+
+spool_replayer = SpoolReplayer(
+    Spool(
+        SPOOL_DIR,
+        segment_bytes=SPOOL_SEGMENT_MB * 1024 * 1024,
+        max_bytes=SPOOL_MAX_MB * 1024 * 1024,
+        fsync=SPOOL_FSYNC,
+    ),
+    create_clickhouse_client,
+    batch_size=SPOOL_REPLAY_BATCH_SIZE,
+    flush_interval=WRITER_FLUSH_INTERVAL_MS / 1000,
+    max_spans_per_sec=SPOOL_REPLAY_MAX_SPANS_PER_SEC,
+)
+
+# Where spans go once decoded and sampled
+sink = spool_replayer.submit if SPOOL_ENABLED else writer.submit
+
+rules_file = RulesFile(RULES_PATH)
+
+# indexed_attributes from rules.yaml, for the rules_file.mtime they were read at
+_indexed_keys = (None, frozenset())
+
+
+def indexed_attribute_keys() -> FrozenSet[str]:
+    """Attribute keys written to indexedAttributes for /search"""
+    global _indexed_keys
+    mtime, keys = _indexed_keys
+    if mtime != rules_file.mtime:
+        keys = frozenset(str(k) for k in rules_file.data.get("indexed_attributes") or ())
+        _indexed_keys = (rules_file.mtime, keys)
+    return keys
+
+admission = AdmissionController(
+    rules_file,
+    max_request_bytes=MAX_REQUEST_BYTES,
+    max_inflight_bytes=MAX_INFLIGHT_BYTES,
+    max_inflight_spans=MAX_INFLIGHT_SPANS,
+    buckets=SHARED_BUCKETS,
+)
+
+deduplicator = SpanDeduplicator(
+    window=DEDUP_WINDOW_SECONDS,
+    capacity=DEDUP_CAPACITY,
+    fp_rate=DEDUP_FP_RATE,
+) if DEDUP_ENABLED else None
+
+detector = AnomalyDetector(
+    window_seconds=ANOMALY_WINDOW_SECONDS,
+    history_windows=ANOMALY_HISTORY_WINDOWS,
+)
+
+rollups = ServiceRollups(
+    create_clickhouse_client,
+    flush_interval=ROLLUP_FLUSH_INTERVAL_MS / 1000,
+)
+
+# Set when running as one of several workers (see workers.py)
+peers = DecisionPeers(WORKER_RUN_DIR, WORKER_ID) if WORKER_RUN_DIR else None
+dependency_peers = DependencyPeers(WORKER_RUN_DIR, WORKER_ID) if WORKER_RUN_DIR else None
+publish_task = None
+
+dependencies = ServiceDependencies(
+    create_clickhouse_client,
+    flush_interval=DEPENDENCY_FLUSH_INTERVAL_MS / 1000,
+    window=DEPENDENCY_WINDOW_SECONDS,
+    max_spans=DEPENDENCY_MAX_SPANS,
+    max_pending=DEPENDENCY_MAX_PENDING,
+    peers=dependency_peers,
+)
+
+sampler = TailSampler(
+    rules_file,
+    sink,
+    decision_wait=SAMPLER_DECISION_WAIT_MS / 1000,
+    max_traces=SAMPLER_MAX_TRACES,
+    max_spans=SAMPLER_MAX_SPANS,
+    peers=peers,
+)
+
+# Prometheus metrics; counters the components keep for /stats are read at
+# scrape time instead of being counted twice
+metrics = Registry()
+decode_seconds = Histogram(
+    "collector_decode_seconds", "Time to decode an OTLP export request", labelnames=("encoding",),
+)
+request_spans = Histogram("collector_request_spans", "Spans per admitted OTLP export request", SIZE_BUCKETS)
+event_loop_lag = Histogram(
+    "collector_event_loop_lag_seconds", "How late the event loop ran a timer",
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+http_requests = Histogram(
+    "collector_http_request_seconds", "HTTP request latency by route", labelnames=("route", "method", "status"),
+)
+grpc_requests = Histogram(
+    "collector_grpc_request_seconds", "gRPC request latency by method", labelnames=("method", "code"),
+)
+span_writer = spool_replayer if SPOOL_ENABLED else writer
+metrics.register(
+    decode_seconds, request_spans, event_loop_lag, http_requests, grpc_requests,
+    span_writer.insert_seconds, span_writer.insert_batch_spans,
+)
+app.add_middleware(RequestMetrics, histogram=http_requests)
+event_loop_task = None
+
+
+def pipeline_metrics():
+    services = admission.services
+    yield family(
+        "collector_spans_received_total", "counter", "Decoded spans per service",
+        (("collector_spans_received_total", {"service": name}, s.accepted_spans + s.throttled_spans + s.shed_spans)
+         for name, s in services.items()),
+    )
+    dropped = []
+    for name, s in services.items():
+        dropped.append(("collector_spans_dropped_total", {"service": name, "reason": "quota"}, s.throttled_spans))
+        dropped.append(("collector_spans_dropped_total", {"service": name, "reason": "overload"}, s.shed_spans))
+    for name, n in dict(sampler.dropped_spans).items():
+        dropped.append(("collector_spans_dropped_total", {"service": name, "reason": "sampling"}, n))
+    yield family("collector_spans_dropped_total", "counter", "Spans not stored per service and reason", dropped)
+    yield family(
+        "collector_spans_inserted_total", "counter", "Spans inserted into ClickHouse per service",
+        (("collector_spans_inserted_total", {"service": name}, n)
+         for name, n in dict(span_writer.spans_written_by_service).items()),
+    )
+    yield family(
+        "collector_rejected_requests_total", "counter", "Export requests rejected by admission control",
+        (("collector_rejected_requests_total", {"reason": reason}, n)
+         for reason, n in admission.rejected_requests.items()),
+    )
+    if deduplicator is not None:
+        yield family(
+            "collector_duplicate_spans_total", "counter", "Spans dropped as copies of recently accepted ones",
+            [("collector_duplicate_spans_total", {}, deduplicator.duplicate_spans)],
+        )
+        yield family(
+            "collector_dedup_memory_bytes", "gauge", "Memory of the duplicate span filters",
+            [("collector_dedup_memory_bytes", {}, deduplicator.memory_bytes())],
+        )
+        yield family(
+            "collector_dedup_false_positive_rate", "gauge", "Estimated chance a new span is taken for a duplicate",
+            [("collector_dedup_false_positive_rate", {}, deduplicator.false_positive_rate())],
+        )
+    yield family(
+        "collector_dependency_calls_total", "counter", "Cross-service calls resolved from parent span IDs",
+        [("collector_dependency_calls_total", {}, dependencies.calls_observed)],
+    )
+    yield family(
+        "collector_dependency_unresolved_spans_total", "counter", "Spans whose parent span was never seen",
+        [("collector_dependency_unresolved_spans_total", {}, dependencies.unresolved_spans)],
+    )
+    gauges = [
+        ("collector_inflight_bytes", "Request bytes being received or processed", admission.inflight_bytes),
+        ("collector_inflight_spans", "Spans being processed", admission.inflight_spans),
+        ("collector_sampler_buffered_spans", "Spans waiting for a sampling decision", sampler.buffered_spans),
+    ]
+    if SPOOL_ENABLED:
+        gauges.append(("collector_spool_lag_bytes", "Spooled bytes not yet in ClickHouse", spool_replayer.spool.lag_bytes()))
+        gauges.append(("collector_spool_lag_seconds", "Age of the oldest span not yet in ClickHouse", spool_replayer.lag_seconds))
+    else:
+        gauges.append(("collector_writer_queue_batches", "Batches queued for the writer", writer.queue_depth()))
+    for name, documentation, value in gauges:
+        yield family(name, "gauge", documentation, [(name, {}, value)])
+
+
+metrics.register_callback(pipeline_metrics)
+
 @app.on_event("startup")
 async def startup_event():
-    """Initialize ClickHouse connection on startup"""
-    get_clickhouse_client()
+    """Initialize ClickHouse connection and start the ingest pipeline"""
+    check_schema_version(get_clickhouse_client())
+    if SPOOL_ENABLED:
+        await spool_replayer.start()
+    else:
+        await writer.start()
+    await rollups.start()
+    await dependencies.start()
+    if SAMPLER_ENABLED:
+        await sampler.start()
+    global event_loop_task
+    event_loop_task = asyncio.create_task(monitor_event_loop(event_loop_lag))
+    if WORKER_RUN_DIR:
+        global publish_task
+        if SAMPLER_ENABLED:
+            peers.start()
+        dependency_peers.start()
+        publish_task = asyncio.create_task(publish_state(worker_state))
+    if GRPC_ENABLED:
+        await grpc_receiver.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush pending spans before exiting"""
+    # Finish in-flight gRPC exports while the pipeline still runs
+    await grpc_receiver.stop()
+    if publish_task is not None:
+        publish_task.cancel()
+    if event_loop_task is not None:
+        event_loop_task.cancel()
+    if SAMPLER_ENABLED:
+        await sampler.stop()
+        if peers is not None:
+            peers.stop()
+    if dependency_peers is not None:
+        dependency_peers.stop()
+    await rollups.stop()
+    await dependencies.stop()
+    if SPOOL_ENABLED:
+        await spool_replayer.stop()
+    else:
+        await writer.stop()
 
 @app.get("/")
 async def health_check():
@@ -73,119 +379,197 @@ async def detailed_health():
             }
         )
 
+@app.get("/stats")
+async def stats():
+    """Ingest pipeline statistics"""
+    return {
+        "writer": writer.stats() if not SPOOL_ENABLED else None,
+        "spool": spool_replayer.stats() if SPOOL_ENABLED else None,
+        "sampler": sampler.stats() if SAMPLER_ENABLED else None,
+        "rollups": rollups.stats(),
+        "dependencies": dependencies.stats(),
+        "admission": admission.stats(),
+        "dedup": deduplicator.stats() if deduplicator is not None else None,
+        "peers": peers.stats() if peers is not None else None,
+        "dependency_peers": dependency_peers.stats() if dependency_peers is not None else None,
+        "grpc": grpc_receiver.stats() if GRPC_ENABLED else None,
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """This process's metrics in the Prometheus text format"""
+    return PlainTextResponse(render(metrics.collect()), media_type="text/plain; version=0.0.4")
+
+async def worker_state():
+    """What this worker publishes for the supervisor's admin server"""
+    return {"stats": await stats(), "anomalies": detector.recent(), "metrics": metrics.collect()}
+
+@app.get("/anomalies")
+async def anomalies(since: float = 0, service: Optional[str] = None):
+    """Recently detected latency and error-rate anomalies"""
+    return {
+        "anomalies": detector.recent(since, service),
+        "services": detector.service_stats(),
+    }
+
+def rejected_response(e: Rejected) -> JSONResponse:
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+    return JSONResponse(status_code=e.status_code, content={"error": str(e)}, headers=headers)
+
+async def read_body(request: Request) -> bytes:
+    """Read the body, stopping at the size limit even if Content-Length lied"""
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        admission.check_size(size)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def process(batch: SpanBatch):
+    """Hand an admitted batch to the pipeline, for OTLP/HTTP and OTLP/gRPC alike"""
+    request_spans.observe(len(batch))
+    if deduplicator is not None:
+        # Reserves the spans, so a retry arriving while this request is
+        # still being queued is dropped as well
+        batch, keys = deduplicator.filter(batch)
+        if not batch:
+            return
+    try:
+        # RED metrics and dependency edges count every admitted span,
+        # including ones sampling drops
+        detector.observe(batch)
+        rollups.observe(batch)
+        dependencies.observe(batch)
+
+        if SAMPLER_ENABLED:
+            await sampler.add(batch)
+        else:
+            await sink(batch)
+    except BaseException:
+        if deduplicator is not None:
+            # Not accepted; the exporter's retry must get through
+            deduplicator.release(keys)
+        raise
+    logger.debug(f"✅ Queued {len(batch)} spans")
+    if deduplicator is not None:
+        deduplicator.add(keys)
+
+def quota_message(rejected: int) -> str:
+    return f"{rejected} spans of services over their quota were dropped" if rejected else ""
+
+def export_response(rejected: int) -> ExportTraceServiceResponse:
+    response = ExportTraceServiceResponse()
+    if rejected:
+        response.partial_success.rejected_spans = rejected
+        response.partial_success.error_message = quota_message(rejected)
+    return response
+
+async def grpc_export(message: bytes) -> bytes:
+    """TraceService/Export; gRPC has already inflated and size-checked the message"""
+    nbytes = len(message)
+    nspans = 0
+    admission.enter(nbytes)
+    try:
+        started = time.perf_counter()
+        try:
+            batch = decode_request(message, PROTOBUF_CONTENT_TYPE, indexed_attribute_keys())
+        except Exception as e:
+            logger.warning(f"Failed to decode OTLP/gRPC request: {e}")
+            raise ValueError(f"Invalid OTLP payload: {e}") from e
+        decode_seconds.labels("grpc").observe(time.perf_counter() - started)
+        del message
+
+        batch, rejected = admission.admit(batch)
+        nspans = len(batch)
+        await process(batch)
+        return export_response(rejected).SerializeToString()
+    finally:
+        admission.leave(nbytes, nspans)
+
+grpc_receiver = GrpcReceiver(
+    grpc_export,
+    port=GRPC_PORT,
+    max_message_bytes=MAX_REQUEST_BYTES,
+    max_concurrent_rpcs=GRPC_MAX_CONCURRENT_RPCS,
+    max_concurrent_streams=GRPC_MAX_CONCURRENT_STREAMS,
+    histogram=grpc_requests,
+)
+
 @app.post("/v1/traces")
 async def receive_traces(request: Request):
-    """Receive OTLP traces via HTTP"""
+    """Receive OTLP traces via HTTP (JSON or protobuf)"""
+    try:
+        nbytes = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        nbytes = 0
+    nspans = 0
     try:
-        # Get raw body
-        body = await request.body()
-        
+        admission.enter(nbytes)
+    except Rejected as e:
+        return rejected_response(e)
+
+    try:
+        try:
+            body = await read_body(request)
+            # gzip/zstd bodies are inflated up to the size limit, so a small
+            # compressed body cannot expand past it
+            body = decompress_body(
+                body, request.headers.get("content-encoding", ""), admission.max_request_bytes
+            )
+            admission.check_size(len(body))
+            # Chunked and compressed bodies are admitted once read
+            if len(body) > nbytes:
+                admission.enter(len(body) - nbytes)
+                nbytes = len(body)
+        except Rejected as e:
+            return rejected_response(e)
+        except UnsupportedEncoding as e:
+            return JSONResponse(status_code=415, content={"error": str(e)})
+        except Exception as e:
+            logger.warning(f"Failed to decompress OTLP request: {e}")
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Invalid compressed body: {e}"}
+            )
+
         if not body:
             return JSONResponse(
                 status_code=400,
                 content={"error": "Empty request body"}
             )
 
-        # Try to parse as JSON
+        content_type = request.headers.get("content-type", "")
+        started = time.perf_counter()
         try:
-            data = json.loads(body)
-        except json.JSONDecodeError:
-            # If not JSON, try to handle as protobuf (simplified)
-            logger.warning("Received non-JSON data, treating as protobuf")
-            return {"status": "accepted", "message": "Protobuf traces received"}
+            batch = decode_request(body, content_type, indexed_attribute_keys())
+            decode_seconds.labels(
+                "protobuf" if content_type.startswith(PROTOBUF_CONTENT_TYPE) else "json"
+            ).observe(time.perf_counter() - started)
+        except Exception as e:
+            logger.warning(f"Failed to decode OTLP request: {e}")
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Invalid OTLP payload: {e}"}
+            )
+        del body
 
-        # Process resource spans
-        if "resourceSpans" not in data:
-            logger.warning("No resourceSpans in request")
-            return {"status": "accepted", "message": "No spans to process"}
+        try:
+            batch, rejected = admission.admit(batch)
+        except Rejected as e:
+            return rejected_response(e)
+        nspans = len(batch)
+        await process(batch)
 
-        client = get_clickhouse_client()
-        spans_inserted = 0
-
-        for resource_span in data.get("resourceSpans", []):
-            # Extract resource attributes
-            resource_attrs = {}
-            if "resource" in resource_span and "attributes" in resource_span["resource"]:
-                for attr in resource_span["resource"]["attributes"]:
-                    key = attr.get("key", "")
-                    value = attr.get("value", {})
-                    if "stringValue" in value:
-                        resource_attrs[key] = value["stringValue"]
-                    elif "intValue" in value:
-                        resource_attrs[key] = value["intValue"]
-
-            service_name = resource_attrs.get("service.name", "unknown")
-
-            # Process scope spans
-            for scope_span in resource_span.get("scopeSpans", []):
-                for span in scope_span.get("spans", []):
-                    try:
-                        # Extract span data
-                        trace_id = span.get("traceId", "")
-                        span_id = span.get("spanId", "")
-                        parent_span_id = span.get("parentSpanId", "")
-                        span_name = span.get("name", "unknown")
-                        start_time = int(span.get("startTimeUnixNano", 0))
-                        end_time = int(span.get("endTimeUnixNano", 0))
-                        duration_ns = end_time - start_time
-
-                        # Extract span attributes
-                        span_attrs = {}
-                        for attr in span.get("attributes", []):
-                            key = attr.get("key", "")
-                            value = attr.get("value", {})
-                            if "stringValue" in value:
-                                span_attrs[key] = value["stringValue"]
-                            elif "intValue" in value:
-                                span_attrs[key] = str(value["intValue"])
-                            elif "boolValue" in value:
-                                span_attrs[key] = str(value["boolValue"])
-
-                        # Check for errors
-                        status = span.get("status", {})
-                        status_code = status.get("code", 0)
-                        status_message = status.get("message", "")
-                        has_error = status_code == 2  # ERROR status
-
-                        # Extract HTTP attributes
-                        http_method = span_attrs.get("http.method", "")
-                        http_url = span_attrs.get("http.url", "")
-                        http_status_code = span_attrs.get("http.status_code", "")
-
-                        # Insert into ClickHouse
-                        insert_query = """
-                        INSERT INTO spans (
-                            timestamp, traceId, spanId, parentSpanId, serviceName,
-                            spanName, duration, hasError, statusCode, statusMessage,
-                            attributes, httpMethod, httpUrl, httpStatusCode
-                        ) VALUES
-                        """
-
-                        client.execute(insert_query, [{
-                            'timestamp': datetime.fromtimestamp(start_time / 1e9),
-                            'traceId': trace_id,
-                            'spanId': span_id,
-                            'parentSpanId': parent_span_id,
-                            'serviceName': service_name,
-                            'spanName': span_name,
-                            'duration': duration_ns,
-                            'hasError': 1 if has_error else 0,
-                            'statusCode': status_code,
-                            'statusMessage': status_message,
-                            'attributes': json.dumps(span_attrs),
-                            'httpMethod': http_method,
-                            'httpUrl': http_url,
-                            'httpStatusCode': http_status_code
-                        }])
-
-                        spans_inserted += 1
-
-                    except Exception as e:
-                        logger.error(f"Error processing span: {e}")
-                        continue
-
-        logger.info(f"✅ Inserted {spans_inserted} spans")
-        return {"status": "success", "spans_received": spans_inserted}
+        if content_type.startswith(PROTOBUF_CONTENT_TYPE):
+            return Response(
+                content=export_response(rejected).SerializeToString(),
+                media_type=PROTOBUF_CONTENT_TYPE
+            )
+        result = {"status": "success", "spans_received": len(batch)}
+        if rejected:
+            result["partialSuccess"] = {"rejectedSpans": rejected, "errorMessage": quota_message(rejected)}
+        return result
 
     except Exception as e:
         logger.error(f"❌ Error processing traces: {e}")
@@ -193,23 +577,10 @@ async def receive_traces(request: Request):
             status_code=500,
             content={"error": str(e)}
         )
+    finally:
+        admission.leave(nbytes, nspans)
 
 if __name__ == "__main__":
-    import multiprocessing as mp
-    
-    # Run two servers: one for OTLP (4318) and one for health checks (8001)
-    def run_otlp_server():
-        uvicorn.run(app, host="0.0.0.0", port=4318, log_level="info")
-    
-    def run_health_server():
-        uvicorn.run(app, host="0.0.0.0", port=8001, log_level="info")
-    
-    # Start both servers
-    p1 = mp.Process(target=run_otlp_server)
-    p2 = mp.Process(target=run_health_server)
-    
-    p1.start()
-    p2.start()
-    
-    p1.join()
-    p2.join()
\ No newline at end of file
+    # OTLP on 4318 and 4317 served by COLLECTOR_WORKERS processes, admin API on 8001
+    import workers
+    workers.main()
@@ -0,0 +1,150 @@
+"""Suppression of spans that exporters send again.
+
+An OTLP exporter whose request failed or timed out sends the same spans
+again, even when the collector did store them the first time. Each
+collector process remembers the (traceId, spanId) of the spans it accepted
+recently and drops spans it has already seen, before they reach the
+detector, rollups or ClickHouse.
+
+Spans are remembered in two Bloom filters of ``capacity`` spans each, in
+packed bit arrays sized for ``fp_rate``. New spans go into the current
+filter, and lookups check both. Every ``window`` seconds, or when the
+current filter is full, the older filter is cleared and becomes the
+current one, so spans are remembered for one to two windows and memory
+stays fixed.
+
+Spans are reserved by ``filter`` while their request is being queued, so
+a retry that arrives before the original is accepted is dropped too; a
+request that fails gives its reservation back with ``release``.
+
+A false positive drops a span that was never stored, at about ``fp_rate``
+when both filters are full; ``stats()`` reports the current estimate.
+Retries that reach another worker, or that arrive after the window, are
+not caught here. ``spans`` is a ReplacingMergeTree on (traceId, spanId),
+so ClickHouse removes those copies from it when it merges parts, and
+trace summaries count distinct spanIds. Everything else that counts spans
+counts those copies: the service rollups and dependencies this worker
+keeps, and the per-service span counts of ``trace_summary``.
+"""
+import math
+import time
+from typing import Any, Dict, Set, Tuple
+
+import numpy as np
+
+from span_batch import SpanBatch
+
+_LOW_BITS = np.uint64(0xFFFFFFFF)
+
+
+class SpanDeduplicator:
+    """Rotating Bloom filters over recently accepted (traceId, spanId) pairs"""
+
+    def __init__(self, window: float = 300.0, capacity: int = 2_000_000, fp_rate: float = 1e-4):
+        self.window = window
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        # Optimal size and hash count for ``capacity`` items at ``fp_rate``
+        self.bits = max(int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)), 64)
+        self.hashes = max(int(round(self.bits / capacity * math.log(2))), 1)
+        self._offsets = np.arange(self.hashes, dtype=np.uint64)[:, None]
+        self._modulus = np.uint64(self.bits)
+
+        self._current = np.zeros((self.bits + 7) // 8, dtype=np.uint8)
+        self._previous = np.zeros_like(self._current)
+        self._current_count = 0
+        self._previous_count = 0
+        self._rotated = time.monotonic()
+        # Keys of spans in requests still being queued
+        self._pending: Set[int] = set()
+
+        self.checked_spans = 0
+        self.duplicate_spans = 0
+        self.rotations = 0
+
+    def filter(self, batch: SpanBatch) -> Tuple[SpanBatch, np.ndarray]:
+        """Drop spans seen or reserved before and reserve the rest.
+
+        Returns the remaining spans and their hashes, to pass to ``add``
+        once they are accepted or to ``release`` if they are not.
+        """
+        n = len(batch)
+        if not n:
+            return batch, np.empty(0, dtype=np.uint64)
+        now = time.monotonic()
+        if now - self._rotated >= self.window:
+            self._rotate(now)
+        # Python's string hashes are keyed per process, which is all a filter
+        # kept in memory needs
+        keys = np.fromiter(map(hash, zip(batch.trace_id, batch.span_id)), dtype=np.int64, count=n).view(np.uint64)
+        byte, bit = self._positions(keys)
+        seen = ((self._current[byte] & bit) != 0).all(axis=0)
+        if self._previous_count:
+            seen |= ((self._previous[byte] & bit) != 0).all(axis=0)
+        pending = self._pending
+        if pending:
+            seen |= np.fromiter(map(pending.__contains__, keys.tolist()), dtype=bool, count=n)
+        self.checked_spans += n
+        duplicates = int(np.count_nonzero(seen))
+        if duplicates:
+            self.duplicate_spans += duplicates
+            keep = np.flatnonzero(~seen)
+            batch, keys = batch.take(keep.tolist()), keys[keep]
+        pending.update(keys.tolist())
+        return batch, keys
+
+    def add(self, keys: np.ndarray):
+        """Remember reserved spans once they are accepted"""
+        if not len(keys):
+            return
+        self._pending.difference_update(keys.tolist())
+        if self._current_count + len(keys) > self.capacity:
+            self._rotate(time.monotonic())
+        byte, bit = self._positions(keys)
+        np.bitwise_or.at(self._current, byte.ravel(), bit.ravel())
+        self._current_count += len(keys)
+
+    def release(self, keys: np.ndarray):
+        """Drop the reservation of spans that weren't accepted, so their retry isn't dropped"""
+        self._pending.difference_update(keys.tolist())
+
+    def false_positive_rate(self) -> float:
+        """Estimated chance that a new span is taken for a duplicate"""
+        def rate(count: int) -> float:
+            return (1 - math.exp(-self.hashes * count / self.bits)) ** self.hashes
+
+        current, previous = rate(self._current_count), rate(self._previous_count)
+        return current + previous - current * previous
+
+    def memory_bytes(self) -> int:
+        return self._current.nbytes + self._previous.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window": self.window,
+            "capacity": self.capacity,
+            "hash_functions": self.hashes,
+            "memory_bytes": self.memory_bytes(),
+            "remembered_spans": self._current_count + self._previous_count,
+            "pending_spans": len(self._pending),
+            "checked_spans": self.checked_spans,
+            "duplicate_spans": self.duplicate_spans,
+            "rotations": self.rotations,
+            "estimated_fp_rate": self.false_positive_rate(),
+        }
+
+    def _positions(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Byte offsets and bit masks of every key's bits, one row per hash function"""
+        # Double hashing: bit i of a key is h1 + i * h2 (Kirsch & Mitzenmacher)
+        h1 = keys & _LOW_BITS
+        h2 = (keys >> np.uint64(32)) | np.uint64(1)
+        positions = (h1 + self._offsets * h2) % self._modulus
+        return positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+
+    def _rotate(self, now: float):
+        self._current, self._previous = self._previous, self._current
+        self._current.fill(0)
+        self._previous_count = self._current_count
+        self._current_count = 0
+        self._rotated = now
+        self.rotations += 1
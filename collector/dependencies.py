@@ -0,0 +1,308 @@
+"""Service dependency graph maintained at ingest.
+
+A span whose parent belongs to another service is a call from the parent's
+service (caller) to its own (callee). Parents are found in a short-lived
+index of spanId -> service kept in generations: every ``window`` seconds a
+new one is started and the oldest is dropped. A generation that grows past
+``max_spans`` is rotated early, so memory stays bounded under any load.
+
+Spans often arrive before their parent (a callee's span ends, and is
+exported, before its caller's). Those wait in a pending set, keyed by the
+parent spanId, for one to two windows until the parent arrives. Spans
+still waiting then are handed to the other collector workers when there
+are any, since the parent may have reached one of them. The index keeps
+one generation more than the pending set, so the peers still have the
+parent when the span reaches them.
+
+Each call is counted into a per-minute edge with the callee span's error
+status and duration, in the same log-spaced latency histogram as
+``rollups.py``. Edges are written to ``service_dependencies`` every
+``flush_interval`` seconds, and summed on merge like service rollups.
+"""
+import asyncio
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from rollups import LATENCY_GAMMA
+from span_batch import STATUS_CODE_ERROR, SpanBatch
+
+logger = logging.getLogger(__name__)
+
+RESOLUTION = 60
+
+_INV_LOG_GAMMA = 1 / math.log(LATENCY_GAMMA)
+
+INSERT_DEPENDENCIES_QUERY = """
+    INSERT INTO service_dependencies (
+        bucket, caller, callee, calls, errors, durationSum, durationMax, latency
+    ) VALUES
+"""
+
+# A span waiting for its parent: (service, start, duration, is error)
+Pending = Tuple[str, int, int, bool]
+
+
+class _Edge:
+    """Calls from one service to another in one bucket"""
+
+    __slots__ = ("calls", "errors", "duration_sum", "duration_max", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.duration_sum = 0
+        self.duration_max = 0
+        self.latency: Dict[int, int] = {}
+
+    def merge(self, other: "_Edge"):
+        self.calls += other.calls
+        self.errors += other.errors
+        self.duration_sum += other.duration_sum
+        if other.duration_max > self.duration_max:
+            self.duration_max = other.duration_max
+        latency = self.latency
+        for b, c in other.latency.items():
+            latency[b] = latency.get(b, 0) + c
+
+
+# (bucket start in epoch seconds, caller, callee)
+EdgeKey = Tuple[int, str, str]
+
+
+class ServiceDependencies:
+    """Caller -> callee edge stats resolved from parent span IDs"""
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Any],
+        flush_interval: float = 10.0,
+        window: float = 30.0,
+        max_spans: int = 200_000,
+        max_pending: int = 100_000,
+        max_pending_edges: int = 100_000,
+        peers=None,
+    ):
+        self.client_factory = client_factory
+        self.flush_interval = flush_interval
+        self.window = window
+        self.max_spans = max_spans
+        self.max_pending = max_pending
+        self.max_pending_edges = max_pending_edges
+        # workers.DependencyPeers when other collector workers share the traffic
+        self.peers = peers
+        if peers is not None:
+            peers.on_orphans = self.resolve_orphans
+
+        # Three generations of spanId -> service, two of parent spanId -> waiting spans
+        self._spans: Dict[str, str] = {}
+        self._old_spans: Dict[str, str] = {}
+        self._oldest_spans: Dict[str, str] = {}
+        self._pending: Dict[str, List[Pending]] = {}
+        self._old_pending: Dict[str, List[Pending]] = {}
+        self._pending_count = 0
+        self._rotated = time.monotonic()
+
+        self._edges: Dict[EdgeKey, _Edge] = {}
+        self._client = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ch-dependencies")
+
+        self.calls_observed = 0
+        self.resolved_late = 0
+        self.resolved_by_peers = 0
+        self.unresolved_spans = 0
+        self.early_rotations = 0
+        self.rows_written = 0
+        self.flushes_failed = 0
+        self.buckets_dropped = 0
+        self.last_flush_ms = 0.0
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"🕸️ Service dependencies started (window={self.window}s, max_spans={self.max_spans}, "
+            f"interval={self.flush_interval}s)"
+        )
+
+    async def stop(self):
+        """Flush the edges counted so far and stop; pending spans are dropped"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
+
+    def observe(self, batch: SpanBatch):
+        """Index a batch of spans and count the calls they resolve"""
+        now = time.monotonic()
+        if now - self._rotated >= self.window:
+            self._rotate(now)
+        spans = self._spans
+        old_spans = self._old_spans
+        oldest_spans = self._oldest_spans
+        pending = self._pending
+        old_pending = self._old_pending
+        for span_id, parent, service, start, duration, status_code in zip(
+            batch.span_id, batch.parent_span_id, batch.service, batch.start, batch.duration, batch.status_code
+        ):
+            error = status_code == STATUS_CODE_ERROR
+            if parent:
+                caller = spans.get(parent) or old_spans.get(parent) or oldest_spans.get(parent)
+                if caller is not None:
+                    if caller != service:
+                        self._count(caller, service, start, duration, error)
+                elif self._pending_count < self.max_pending:
+                    waiting = pending.get(parent)
+                    if waiting is None:
+                        waiting = pending[parent] = []
+                    waiting.append((service, start, duration, error))
+                    self._pending_count += 1
+                else:
+                    self.unresolved_spans += 1
+
+            spans[span_id] = service
+            # Children that arrived first
+            for waiting in (pending.pop(span_id, None), old_pending.pop(span_id, None)):
+                if waiting:
+                    self._pending_count -= len(waiting)
+                    self.resolved_late += len(waiting)
+                    for callee, child_start, child_duration, child_error in waiting:
+                        if callee != service:
+                            self._count(service, callee, child_start, child_duration, child_error)
+
+        if len(spans) >= self.max_spans:
+            self.early_rotations += 1
+            self._rotate(now)
+
+    def resolve_orphans(self, orphans: List[list]):
+        """Count spans another worker could not find the parent of"""
+        spans = self._spans
+        old_spans = self._old_spans
+        oldest_spans = self._oldest_spans
+        for parent, service, start, duration, error in orphans:
+            caller = spans.get(parent) or old_spans.get(parent) or oldest_spans.get(parent)
+            if caller is not None:
+                self.resolved_by_peers += 1
+                if caller != service:
+                    self._count(caller, service, start, duration, error)
+
+    async def flush(self):
+        """Write all edges counted since the last flush"""
+        edges, self._edges = self._edges, {}
+        if not edges:
+            return
+        rows = self._rows(edges)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            await loop.run_in_executor(self._executor, self._insert, rows)
+            self.rows_written += len(rows)
+        except Exception as e:
+            self.flushes_failed += 1
+            logger.error(f"❌ Failed to write {len(rows)} service dependency rows: {e}")
+            self._restore(edges)
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "indexed_spans": len(self._spans) + len(self._old_spans) + len(self._oldest_spans),
+            "pending_spans": self._pending_count,
+            "pending_edges": len(self._edges),
+            "calls_observed": self.calls_observed,
+            "resolved_late": self.resolved_late,
+            "resolved_by_peers": self.resolved_by_peers,
+            "unresolved_spans": self.unresolved_spans,
+            "early_rotations": self.early_rotations,
+            "rows_written": self.rows_written,
+            "flushes_failed": self.flushes_failed,
+            "buckets_dropped": self.buckets_dropped,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+    def _count(self, caller: str, callee: str, start: int, duration: int, error: bool):
+        key = (start // 1_000_000_000 // RESOLUTION * RESOLUTION, caller, callee)
+        edge = self._edges.get(key)
+        if edge is None:
+            edge = self._edges[key] = _Edge()
+        edge.calls += 1
+        if error:
+            edge.errors += 1
+        edge.duration_sum += duration
+        if duration > edge.duration_max:
+            edge.duration_max = duration
+        b = math.ceil(math.log(duration) * _INV_LOG_GAMMA) if duration > 1 else 0
+        edge.latency[b] = edge.latency.get(b, 0) + 1
+        self.calls_observed += 1
+
+    def _rotate(self, now: float):
+        """Start new generations; spans pending in the dropped one will never resolve here"""
+        expired = self._old_pending
+        self._oldest_spans, self._old_spans, self._spans = self._old_spans, self._spans, {}
+        self._old_pending, self._pending = self._pending, {}
+        self._rotated = now
+        if not expired:
+            return
+        count = sum(len(waiting) for waiting in expired.values())
+        self._pending_count -= count
+        if self.peers is not None:
+            self.peers.publish([
+                (parent, service, start, duration, error)
+                for parent, waiting in expired.items()
+                for service, start, duration, error in waiting
+            ])
+        else:
+            self.unresolved_spans += count
+
+    def _rows(self, edges: Dict[EdgeKey, _Edge]) -> List[tuple]:
+        rows = []
+        for (bucket, caller, callee), e in edges.items():
+            bins = sorted(e.latency)
+            rows.append((
+                bucket, caller, callee, e.calls, e.errors, e.duration_sum, e.duration_max,
+                (bins, [e.latency[b] for b in bins]),
+            ))
+        return rows
+
+    def _restore(self, edges: Dict[EdgeKey, _Edge]):
+        """Put unwritten edges back so the next flush retries them"""
+        current = self._edges
+        for key, edge in edges.items():
+            existing = current.get(key)
+            if existing is None:
+                current[key] = edge
+            else:
+                existing.merge(edge)
+        overflow = len(current) - self.max_pending_edges
+        if overflow > 0:
+            # Oldest buckets go first
+            for key in sorted(current)[:overflow]:
+                del current[key]
+            self.buckets_dropped += overflow
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # Expire pending spans even when no traffic arrives
+            if time.monotonic() - self._rotated >= self.window:
+                self._rotate(time.monotonic())
+            # A flush interrupted by stop() would lose the edges it took
+            await asyncio.shield(self.flush())
+
+    def _insert(self, rows: List[tuple]):
+        if self._client is None:
+            self._client = self.client_factory()
+        try:
+            self._client.execute(INSERT_DEPENDENCIES_QUERY, rows)
+        except Exception:
+            self._client = None
+            raise
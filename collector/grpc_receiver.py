@@ -0,0 +1,127 @@
+"""OTLP/gRPC trace receiver.
+
+Serves ``TraceService/Export`` on GRPC_PORT next to the OTLP/HTTP app, on
+the same event loop, so gRPC exports go through the same admission,
+sampling and write pipeline. The method is registered without a request
+deserializer: handlers get the raw message bytes and decode them once,
+with the same columnar protobuf decoder as OTLP/HTTP, instead of first
+into ExportTraceServiceRequest objects.
+
+gRPC inflates gzip-compressed messages itself and applies
+``max_message_bytes`` to the inflated size. Concurrency is limited per
+process by ``max_concurrent_rpcs`` (further RPCs fail at once with
+RESOURCE_EXHAUSTED) and per HTTP/2 connection by ``max_concurrent_streams``.
+The port is bound with SO_REUSEPORT, so every collector worker serves it.
+
+Rejections follow the OTLP retry rules: overload and quotas are UNAVAILABLE,
+which exporters retry with backoff; a message over the size limit is
+RESOURCE_EXHAUSTED without retry info, which they don't.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from admission import Rejected
+from metrics import Histogram
+
+try:
+    import grpc
+except ImportError:  # the collector then serves OTLP/HTTP only
+    grpc = None
+
+logger = logging.getLogger(__name__)
+
+TRACE_SERVICE = "opentelemetry.proto.collector.trace.v1.TraceService"
+
+
+class GrpcReceiver:
+    """TraceService/Export handing raw request messages to ``export``.
+
+    ``export`` returns the serialized ExportTraceServiceResponse. It raises
+    ``Rejected`` when admission control refuses the request and
+    ``ValueError`` when the message can't be decoded.
+    """
+
+    def __init__(
+        self,
+        export: Callable[[bytes], Awaitable[bytes]],
+        port: int = 4317,
+        max_message_bytes: int = 16 * 1024 * 1024,
+        max_concurrent_rpcs: int = 1000,
+        max_concurrent_streams: int = 100,
+        histogram: Optional[Histogram] = None,
+    ):
+        self.export = export
+        self.port = port
+        self.max_message_bytes = max_message_bytes
+        self.max_concurrent_rpcs = max_concurrent_rpcs
+        self.max_concurrent_streams = max_concurrent_streams
+        # Labelled (method, code)
+        self.histogram = histogram
+        self.requests: Dict[str, int] = {}
+        self._server = None
+
+    async def start(self):
+        if grpc is None:
+            logger.warning("⚠️ grpcio is not installed, OTLP/gRPC receiver disabled")
+            return
+        if self._server is not None:
+            return
+        server = grpc.aio.server(
+            handlers=[grpc.method_handlers_generic_handler(
+                TRACE_SERVICE, {"Export": grpc.unary_unary_rpc_method_handler(self._export)},
+            )],
+            maximum_concurrent_rpcs=self.max_concurrent_rpcs,
+            options=[
+                ("grpc.so_reuseport", 1),
+                ("grpc.max_receive_message_length", self.max_message_bytes),
+                ("grpc.max_concurrent_streams", self.max_concurrent_streams),
+            ],
+        )
+        server.add_insecure_port(f"0.0.0.0:{self.port}")
+        await server.start()
+        self._server = server
+        logger.info(
+            f"📡 OTLP/gRPC receiver listening on :{self.port} "
+            f"(max_concurrent_rpcs={self.max_concurrent_rpcs}, max_message_bytes={self.max_message_bytes})"
+        )
+
+    async def stop(self, grace: float = 5.0):
+        """Stop accepting RPCs and wait up to ``grace`` seconds for running ones"""
+        if self._server is None:
+            return
+        await self._server.stop(grace)
+        self._server = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "port": self.port,
+            "serving": self._server is not None,
+            "max_concurrent_rpcs": self.max_concurrent_rpcs,
+            "requests": dict(self.requests),
+        }
+
+    async def _export(self, request: bytes, context) -> bytes:
+        started = time.perf_counter()
+        code = grpc.StatusCode.OK
+        try:
+            return await self.export(request)
+        except Rejected as e:
+            code = grpc.StatusCode.RESOURCE_EXHAUSTED if e.status_code == 413 else grpc.StatusCode.UNAVAILABLE
+            await context.abort(code, str(e))
+        except ValueError as e:
+            code = grpc.StatusCode.INVALID_ARGUMENT
+            await context.abort(code, str(e))
+        except asyncio.CancelledError:
+            # The client went away or its deadline passed
+            code = grpc.StatusCode.CANCELLED
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error processing gRPC export: {e}")
+            code = grpc.StatusCode.INTERNAL
+            await context.abort(code, str(e))
+        finally:
+            self.requests[code.name] = self.requests.get(code.name, 0) + 1
+            if self.histogram is not None:
+                self.histogram.labels("Export", code.name).observe(time.perf_counter() - started)
@@ -0,0 +1,271 @@
+"""Decoding of OTLP/HTTP trace export requests into span batches.
+
+Both the JSON and protobuf encodings fill the same columnar ``SpanBatch`` so
+the rest of the pipeline never needs to know which one a client used.
+
+Attribute values of every AnyValue kind are kept as strings: strings as-is,
+ints, doubles and bools in their Python form, bytes base64-encoded, and
+arrays and key-value lists as JSON.
+"""
+import base64
+import zlib
+from typing import Any, Dict, FrozenSet, List
+
+import orjson
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import ExportTraceServiceRequest
+
+from span_batch import NO_ATTRIBUTES, STATUS_CODE_ERROR, STATUS_CODE_OK, STATUS_CODE_UNSET, SpanBatch, intern
+
+try:
+    import zstandard
+except ImportError:  # zstd bodies are then rejected with 415
+    zstandard = None
+
+PROTOBUF_CONTENT_TYPE = "application/x-protobuf"
+
+SUPPORTED_ENCODINGS = ("gzip", "zstd") if zstandard is not None else ("gzip",)
+
+_DECOMPRESS_CHUNK = 256 * 1024
+
+# Enum names some OTLP/JSON exporters send instead of numbers
+_STATUS_CODE_NAMES = {
+    "STATUS_CODE_UNSET": STATUS_CODE_UNSET,
+    "STATUS_CODE_OK": STATUS_CODE_OK,
+    "STATUS_CODE_ERROR": STATUS_CODE_ERROR,
+}
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+def decompress_body(body: bytes, content_encoding: str, max_bytes: int) -> bytes:
+    """Decode a gzip or zstd request body.
+
+    Stops after ``max_bytes + 1`` bytes, so callers can reject bodies that
+    inflate past their limit without ever holding the rest in memory. A
+    gzip body that ends before its trailer raises ``ValueError``.
+    """
+    encoding = content_encoding.strip().lower()
+    if encoding in ("", "identity"):
+        return body
+    if encoding in ("gzip", "x-gzip"):
+        # wbits=31: gzip header and trailer
+        d = zlib.decompressobj(wbits=31)
+        out = d.decompress(body, max_bytes + 1)
+        while d.eof and d.unused_data and len(out) <= max_bytes:
+            # Concatenated gzip members
+            rest = d.unused_data
+            d = zlib.decompressobj(wbits=31)
+            out += d.decompress(rest, max_bytes + 1 - len(out))
+        # Short of the limit, a body that ends mid-stream was cut off
+        if not d.eof and len(out) <= max_bytes:
+            raise ValueError("truncated gzip body")
+        return out
+    if encoding == "zstd" and zstandard is not None:
+        chunks = []
+        size = 0
+        with zstandard.ZstdDecompressor().stream_reader(body) as reader:
+            while size <= max_bytes:
+                chunk = reader.read(_DECOMPRESS_CHUNK)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+        return b"".join(chunks)
+    raise UnsupportedEncoding(
+        f"Unsupported Content-Encoding {content_encoding!r}, expected one of: {', '.join(SUPPORTED_ENCODINGS)}"
+    )
+
+
+def _append_span(batch: SpanBatch, service_name: str, trace_id: str, span_id: str,
+                 parent_span_id: str, span_name: str, start_time: int, end_time: int,
+                 span_attrs: Dict[str, str], status_code: int, status_message: str,
+                 resource_attrs: Dict[str, str], indexed_keys: FrozenSet[str],
+                 resource_indexed: Dict[str, str]):
+    if type(status_code) is not int or not STATUS_CODE_UNSET <= status_code <= STATUS_CODE_ERROR:
+        # Unknown codes would not fit the status column; one such span
+        # must not fail the whole request
+        name = status_code if isinstance(status_code, str) else None
+        status_code = _STATUS_CODE_NAMES.get(name, STATUS_CODE_UNSET)
+    indexed = resource_indexed
+    if indexed_keys and span_attrs:
+        own = {k: v for k, v in span_attrs.items() if k in indexed_keys}
+        if own:
+            indexed = {**resource_indexed, **own} if resource_indexed else own
+    batch.append(
+        service_name, trace_id, span_id, parent_span_id, span_name,
+        start_time, end_time, status_code, status_message,
+        orjson.dumps(span_attrs).decode(),
+        span_attrs.get("http.method", ""),
+        span_attrs.get("http.url", ""),
+        span_attrs.get("http.status_code", ""),
+        resource_attrs,
+        indexed,
+    )
+
+
+def _resource_indexed(resource_attrs: Dict[str, str], indexed_keys: FrozenSet[str]) -> Dict[str, str]:
+    indexed = {k: v for k, v in resource_attrs.items() if k in indexed_keys}
+    return indexed or NO_ATTRIBUTES
+
+
+# -- OTLP/JSON ----------------------------------------------------------------
+#
+# OTLP/JSON is the protobuf JSON mapping: every message is an object with
+# camelCase field names, absent fields take their default, 64-bit integers
+# may be strings, and an AnyValue has exactly one of its value fields.
+
+def _json_value(value: Dict[str, Any]) -> Any:
+    """An AnyValue as a native value, for nesting inside arrays and kvlists"""
+    for kind, v in value.items():
+        if kind == "intValue":
+            return int(v)
+        if kind == "doubleValue":
+            return float(v)
+        if kind == "arrayValue":
+            return [_json_value(x) for x in v.get("values", ())]
+        if kind == "kvlistValue":
+            return {kv["key"]: _json_value(kv.get("value") or {}) for kv in v.get("values", ())}
+        return v
+    return None
+
+
+def _json_string(kind: str, v: Any) -> str:
+    """An AnyValue of any kind but string as an attribute string"""
+    if kind == "intValue":
+        return str(int(v))
+    if kind == "boolValue":
+        return str(v)
+    if kind == "doubleValue":
+        return str(float(v))
+    if kind == "bytesValue":
+        # Already base64 in OTLP/JSON
+        return v
+    if kind == "arrayValue":
+        return orjson.dumps([_json_value(x) for x in v.get("values", ())]).decode()
+    if kind == "kvlistValue":
+        return orjson.dumps({kv["key"]: _json_value(kv.get("value") or {}) for kv in v.get("values", ())}).decode()
+    return ""
+
+
+def _json_attributes(attributes: List[Dict[str, Any]]) -> Dict[str, str]:
+    attrs = {}
+    for attr in attributes:
+        value = attr.get("value")
+        if not value:
+            continue
+        # One field per AnyValue; strings are by far the most common
+        for kind, v in value.items():
+            attrs[attr["key"]] = v if kind == "stringValue" else _json_string(kind, v)
+            break
+    return attrs
+
+
+def spans_from_json(data: Dict[str, Any], indexed_keys: FrozenSet[str] = frozenset()) -> SpanBatch:
+    """Decode a parsed OTLP/JSON ExportTraceServiceRequest"""
+    batch = SpanBatch()
+    for resource_span in data.get("resourceSpans", ()):
+        resource = resource_span.get("resource")
+        resource_attrs = _json_attributes(resource.get("attributes", ())) if resource else {}
+        service_name = intern(resource_attrs.get("service.name", "unknown"))
+        resource_indexed = _resource_indexed(resource_attrs, indexed_keys)
+
+        for scope_span in resource_span.get("scopeSpans", ()):
+            for span in scope_span.get("spans", ()):
+                get = span.get
+                attributes = get("attributes")
+                status = get("status")
+                _append_span(
+                    batch,
+                    service_name,
+                    get("traceId", ""),
+                    get("spanId", ""),
+                    get("parentSpanId", ""),
+                    get("name", "unknown"),
+                    int(get("startTimeUnixNano", 0)),
+                    int(get("endTimeUnixNano", 0)),
+                    _json_attributes(attributes) if attributes else {},
+                    status.get("code", 0) if status else 0,
+                    status.get("message", "") if status else "",
+                    resource_attrs,
+                    indexed_keys,
+                    resource_indexed,
+                )
+    return batch
+
+
+# -- OTLP/protobuf ------------------------------------------------------------
+
+def _proto_value(value) -> Any:
+    kind = value.WhichOneof("value")
+    if kind == "array_value":
+        return [_proto_value(x) for x in value.array_value.values]
+    if kind == "kvlist_value":
+        return {kv.key: _proto_value(kv.value) for kv in value.kvlist_value.values}
+    if kind == "bytes_value":
+        return base64.b64encode(value.bytes_value).decode()
+    return getattr(value, kind) if kind else None
+
+
+def _proto_attributes(attributes) -> Dict[str, str]:
+    attrs = {}
+    for attr in attributes:
+        value = attr.value
+        kind = value.WhichOneof("value")
+        if kind == "string_value":
+            attrs[attr.key] = value.string_value
+        elif kind in ("int_value", "bool_value", "double_value"):
+            attrs[attr.key] = str(getattr(value, kind))
+        elif kind == "bytes_value":
+            attrs[attr.key] = base64.b64encode(value.bytes_value).decode()
+        elif kind is not None:
+            attrs[attr.key] = orjson.dumps(_proto_value(value)).decode()
+    return attrs
+
+
+def spans_from_protobuf(body: bytes, indexed_keys: FrozenSet[str] = frozenset()) -> SpanBatch:
+    """Decode a binary OTLP/protobuf ExportTraceServiceRequest"""
+    request = ExportTraceServiceRequest.FromString(body)
+    batch = SpanBatch()
+    for resource_span in request.resource_spans:
+        resource_attrs = _proto_attributes(resource_span.resource.attributes)
+        service_name = intern(resource_attrs.get("service.name", "unknown"))
+        resource_indexed = _resource_indexed(resource_attrs, indexed_keys)
+
+        for scope_span in resource_span.scope_spans:
+            for span in scope_span.spans:
+                _append_span(
+                    batch,
+                    service_name,
+                    # IDs are raw bytes on the wire; hex matches the JSON encoding
+                    span.trace_id.hex(),
+                    span.span_id.hex(),
+                    span.parent_span_id.hex(),
+                    span.name or "unknown",
+                    span.start_time_unix_nano,
+                    span.end_time_unix_nano,
+                    _proto_attributes(span.attributes),
+                    span.status.code,
+                    span.status.message,
+                    resource_attrs,
+                    indexed_keys,
+                    resource_indexed,
+                )
+    return batch
+
+
+def decode_request(body: bytes, content_type: str, indexed_keys: FrozenSet[str] = frozenset()) -> SpanBatch:
+    """Decode an OTLP/HTTP request body based on its Content-Type.
+
+    Span and resource attributes whose keys are in ``indexed_keys`` are
+    also collected into the batch's ``indexed_attributes``.
+    """
+    if content_type.startswith(PROTOBUF_CONTENT_TYPE):
+        return spans_from_protobuf(body, indexed_keys)
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        # Exporters that omit the header send protobuf
+        return spans_from_protobuf(body, indexed_keys)
+    return spans_from_json(data, indexed_keys)
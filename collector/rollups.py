@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from span_batch import STATUS_CODE_ERROR, SpanBatch
+
+logger = logging.getLogger(__name__)
+
+# Rollup resolutions in seconds. Spans are aggregated at the finest one and
+# coarser rows are derived from it at flush time.
+RESOLUTIONS = (10, 60)
+
+# Latency histogram bins are log-spaced with ~5% relative error: a duration
+# d (ns) falls in bin ceil(log(d) / log(LATENCY_GAMMA)). Must match
+# backend/service_metrics.py.
+LATENCY_GAMMA = 1.1
+_INV_LOG_GAMMA = 1 / math.log(LATENCY_GAMMA)
+
+INSERT_ROLLUPS_QUERY = """
+    INSERT INTO service_rollups (
+        resolution, bucket, serviceName, spanName,
+        requests, errors, roots, durationSum, durationMax, latency
+    ) VALUES
+"""
+
+
+class _Rollup:
+    """RED counters and latency histogram of one operation in one bucket"""
+
+    __slots__ = ("requests", "errors", "roots", "duration_sum", "duration_max", "latency")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.roots = 0
+        self.duration_sum = 0
+        self.duration_max = 0
+        self.latency: Dict[int, int] = {}
+
+    def merge(self, other: "_Rollup"):
+        self.requests += other.requests
+        self.errors += other.errors
+        self.roots += other.roots
+        self.duration_sum += other.duration_sum
+        if other.duration_max > self.duration_max:
+            self.duration_max = other.duration_max
+        latency = self.latency
+        for b, c in other.latency.items():
+            latency[b] = latency.get(b, 0) + c
+
+
+# (bucket start in epoch seconds, service, operation)
+RollupKey = Tuple[int, str, str]
+
+
+class ServiceRollups:
+    """Per-service, per-operation RED rollups computed at ingest.
+
+    Every ingested span, sampled or not, is counted into a bucket of the
+    finest resolution. Every ``flush_interval`` seconds the buckets touched
+    since the last flush are written to ``service_rollups``, along with
+    the coarser resolutions derived from them. The table sums partial rows
+    on merge, so buckets that span several flushes or collector processes
+    add up. Failed flushes are retried with the next one, up to
+    ``max_pending`` buckets.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Any],
+        flush_interval: float = 10.0,
+        max_pending: int = 100_000,
+    ):
+        self.client_factory = client_factory
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._rollups: Dict[RollupKey, _Rollup] = {}
+        self._client = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ch-rollups")
+
+        self.spans_observed = 0
+        self.rows_written = 0
+        self.flushes_failed = 0
+        self.buckets_dropped = 0
+        self.last_flush_ms = 0.0
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"📈 Service rollups started (resolutions={RESOLUTIONS}, interval={self.flush_interval}s)")
+
+    async def stop(self):
+        """Flush what has been aggregated so far and stop"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
+
+    def observe(self, batch: SpanBatch):
+        """Count a batch of spans into its buckets"""
+        rollups = self._rollups
+        resolution_ns = RESOLUTIONS[0] * 1_000_000_000
+        inv_log_gamma = _INV_LOG_GAMMA
+        log = math.log
+        ceil = math.ceil
+        last_key = None
+        rollup = None
+        for service, name, start, duration, status_code, parent in zip(
+            batch.service, batch.name, batch.start, batch.duration, batch.status_code, batch.parent_span_id
+        ):
+            key = (start // resolution_ns * RESOLUTIONS[0], service, name)
+            # Spans of one request tend to arrive together
+            if key != last_key:
+                rollup = rollups.get(key)
+                if rollup is None:
+                    rollup = rollups[key] = _Rollup()
+                last_key = key
+            rollup.requests += 1
+            if status_code == STATUS_CODE_ERROR:
+                rollup.errors += 1
+            if not parent:
+                rollup.roots += 1
+            rollup.duration_sum += duration
+            if duration > rollup.duration_max:
+                rollup.duration_max = duration
+            b = ceil(log(duration) * inv_log_gamma) if duration > 1 else 0
+            rollup.latency[b] = rollup.latency.get(b, 0) + 1
+        self.spans_observed += len(batch)
+
+    async def flush(self):
+        """Write all buckets aggregated since the last flush"""
+        rollups, self._rollups = self._rollups, {}
+        if not rollups:
+            return
+        rows = self._rows(rollups)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            await loop.run_in_executor(self._executor, self._insert, rows)
+            self.rows_written += len(rows)
+        except Exception as e:
+            self.flushes_failed += 1
+            logger.error(f"❌ Failed to write {len(rows)} service rollup rows: {e}")
+            self._restore(rollups)
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_buckets": len(self._rollups),
+            "spans_observed": self.spans_observed,
+            "rows_written": self.rows_written,
+            "flushes_failed": self.flushes_failed,
+            "buckets_dropped": self.buckets_dropped,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+    def _rows(self, rollups: Dict[RollupKey, _Rollup]) -> List[tuple]:
+        levels = [(RESOLUTIONS[0], rollups)]
+        for resolution in RESOLUTIONS[1:]:
+            coarse: Dict[RollupKey, _Rollup] = {}
+            for (bucket, service, name), rollup in rollups.items():
+                key = (bucket - bucket % resolution, service, name)
+                target = coarse.get(key)
+                if target is None:
+                    target = coarse[key] = _Rollup()
+                target.merge(rollup)
+            levels.append((resolution, coarse))
+
+        rows = []
+        for resolution, level in levels:
+            for (bucket, service, name), r in level.items():
+                bins = sorted(r.latency)
+                rows.append((
+                    resolution, bucket, service, name,
+                    r.requests, r.errors, r.roots, r.duration_sum, r.duration_max,
+                    (bins, [r.latency[b] for b in bins]),
+                ))
+        return rows
+
+    def _restore(self, rollups: Dict[RollupKey, _Rollup]):
+        """Put unwritten buckets back so the next flush retries them"""
+        current = self._rollups
+        for key, rollup in rollups.items():
+            existing = current.get(key)
+            if existing is None:
+                current[key] = rollup
+            else:
+                existing.merge(rollup)
+        overflow = len(current) - self.max_pending
+        if overflow > 0:
+            # Oldest buckets go first
+            for key in sorted(current)[:overflow]:
+                del current[key]
+            self.buckets_dropped += overflow
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # A flush interrupted by stop() would lose the buckets it took
+            await asyncio.shield(self.flush())
+
+    def _insert(self, rows: List[tuple]):
+        if self._client is None:
+            self._client = self.client_factory()
+        try:
+            self._client.execute(INSERT_ROLLUPS_QUERY, rows)
+        except Exception:
+            self._client = None
+            raise
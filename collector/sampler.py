@@ -0,0 +1,326 @@
+"""Tail-based sampling driven by collector/rules.yaml.
+
+Spans are buffered per traceId for a decision window. Once the window has
+passed, the whole trace is kept or dropped based on the rules:
+
+1. any span with an error status (``tail_sampling.include_errors``)
+2. root span latency over ``tail_sampling.latency_threshold_ms``
+3. otherwise ``head_sample_rate`` scaled by the highest ``priority`` of the
+   services in the trace, applied deterministically on the trace ID
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import yaml
+
+from span_batch import STATUS_CODE_ERROR, SpanBatch
+
+logger = logging.getLogger(__name__)
+
+# Rough per-span footprint of a buffered span, excluding its attributes JSON
+_SPAN_OVERHEAD_BYTES = 400
+# Footprint of a buffered trace's own SpanBatch with its first span
+_TRACE_OVERHEAD_BYTES = 1500
+
+
+class SamplingRules:
+    """Parsed contents of rules.yaml"""
+
+    def __init__(self, head_sample_rate: float = 1.0, latency_threshold_ms: float = 0,
+                 include_errors: bool = True, priorities: Optional[Dict[str, float]] = None):
+        self.head_sample_rate = head_sample_rate
+        self.latency_threshold_ns = int(latency_threshold_ms * 1_000_000)
+        self.include_errors = include_errors
+        self.priorities = priorities or {}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SamplingRules":
+        tail = data.get("tail_sampling") or {}
+        return cls(
+            head_sample_rate=float(data.get("head_sample_rate", 1.0)),
+            latency_threshold_ms=float(tail.get("latency_threshold_ms", 0)),
+            include_errors=bool(tail.get("include_errors", True)),
+            priorities={
+                s["name"]: float(s.get("priority", 1))
+                for s in data.get("services") or []
+                if "name" in s
+            },
+        )
+
+
+class RulesFile:
+    """rules.yaml on disk, re-read whenever its mtime changes"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = None
+        self.data: Dict[str, Any] = {}
+        self.rules = SamplingRules()
+        self.reload()
+
+    def reload(self) -> bool:
+        """Reload the file if it changed; keep the previous rules on errors"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            if self.mtime is None:
+                logger.warning(f"⚠️ Rules file {self.path} not readable ({e}), keeping all traces")
+                self.mtime = 0
+            return False
+        if mtime == self.mtime:
+            return False
+        try:
+            with open(self.path) as f:
+                data = yaml.safe_load(f) or {}
+            rules = SamplingRules.from_dict(data)
+        except Exception as e:
+            logger.error(f"❌ Invalid rules file {self.path}, keeping previous rules: {e}")
+            self.mtime = mtime
+            return False
+        self.mtime = mtime
+        self.data = data
+        self.rules = rules
+        logger.info(
+            f"📜 Loaded sampling rules (head_sample_rate={rules.head_sample_rate}, "
+            f"latency_threshold={rules.latency_threshold_ns // 1_000_000}ms, "
+            f"include_errors={rules.include_errors})"
+        )
+        return True
+
+
+class _TraceBuffer:
+    __slots__ = ("first_seen", "spans", "span_count", "has_error", "root_duration",
+                 "max_duration", "services", "bytes")
+
+    def __init__(self, now: float):
+        self.first_seen = now
+        # Copied out of the ingested batches, so a trace that is still
+        # buffered doesn't keep the rest of them alive
+        self.spans = SpanBatch()
+        self.span_count = 0
+        self.has_error = False
+        self.root_duration = None
+        self.max_duration = 0
+        self.services = set()
+        self.bytes = _TRACE_OVERHEAD_BYTES
+
+
+def trace_id_ratio(trace_id: str) -> float:
+    """Map a trace ID onto [0, 1) using its low 64 bits, like TraceIdRatioBased"""
+    try:
+        return int(trace_id[-16:], 16) / 2 ** 64
+    except ValueError:
+        return (hash(trace_id) & 0xFFFFFFFFFFFFFFFF) / 2 ** 64
+
+
+def decide(trace_id: str, buf: _TraceBuffer, rules: SamplingRules) -> Tuple[bool, str]:
+    """Return (keep, reason) for a buffered trace"""
+    if rules.include_errors and buf.has_error:
+        return True, "error"
+    latency = buf.root_duration if buf.root_duration is not None else buf.max_duration
+    if rules.latency_threshold_ns and latency >= rules.latency_threshold_ns:
+        return True, "latency"
+    priority = max((rules.priorities.get(s, 1.0) for s in buf.services), default=1.0)
+    if trace_id_ratio(trace_id) < rules.head_sample_rate * priority:
+        return True, "probabilistic"
+    return False, "dropped"
+
+
+class TailSampler:
+    """Buffers spans per trace and forwards kept traces to ``sink``"""
+
+    def __init__(
+        self,
+        rules_file: RulesFile,
+        sink: Callable[[SpanBatch], Awaitable[None]],
+        decision_wait: float = 10.0,
+        max_traces: int = 50000,
+        max_spans: int = 500000,
+        decision_cache_size: int = 100000,
+        peers=None,
+    ):
+        self.rules_file = rules_file
+        self.sink = sink
+        self.decision_wait = decision_wait
+        self.max_traces = max_traces
+        self.max_spans = max_spans
+        self.decision_cache_size = decision_cache_size
+        # workers.DecisionPeers when other collector workers share the traffic
+        self.peers = peers
+
+        # Insertion order is arrival order, so the oldest trace is always first
+        self._buffers: "OrderedDict[str, _TraceBuffer]" = OrderedDict()
+        # Recent decisions, so late spans follow their trace
+        self._decided: "OrderedDict[str, bool]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+        self.buffered_spans = 0
+        self.buffered_bytes = 0
+        self.decisions = {"error": 0, "latency": 0, "probabilistic": 0, "dropped": 0}
+        self.evicted_traces = 0
+        self.late_spans = 0
+        # Spans of traces the rules dropped, per service
+        self.dropped_spans: Dict[str, int] = {}
+        self.decisions_per_sec = 0.0
+        self._window_started = time.monotonic()
+        self._window_decisions = 0
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"🎯 Tail sampler started (wait={self.decision_wait}s, "
+                f"max_traces={self.max_traces}, max_spans={self.max_spans})"
+            )
+
+    async def stop(self):
+        """Decide every buffered trace immediately and stop"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._decide_while(lambda buf: True)
+
+    async def add(self, batch: SpanBatch):
+        """Buffer a batch of spans until their traces can be decided"""
+        now = time.monotonic()
+        buffers = self._buffers
+        late: List[int] = []
+        # Indices of this batch's spans per buffered trace
+        buffered: Dict[str, List[int]] = {}
+        # Traces this batch makes keepers, for the other workers
+        errors: List[str] = []
+        slow: List[str] = []
+        latency_threshold = self.rules_file.rules.latency_threshold_ns
+        for i, trace_id in enumerate(batch.trace_id):
+            buf = buffers.get(trace_id)
+            if buf is None:
+                decided = self._decided.get(trace_id)
+                if decided is not None:
+                    self.late_spans += 1
+                    if decided:
+                        late.append(i)
+                    else:
+                        service = batch.service[i]
+                        self.dropped_spans[service] = self.dropped_spans.get(service, 0) + 1
+                    continue
+                buf = buffers[trace_id] = _TraceBuffer(now)
+                self.buffered_bytes += buf.bytes
+
+            indices = buffered.get(trace_id)
+            if indices is None:
+                indices = buffered[trace_id] = []
+            indices.append(i)
+            buf.span_count += 1
+            size = _SPAN_OVERHEAD_BYTES + len(batch.attributes[i])
+            buf.bytes += size
+            self.buffered_bytes += size
+            self.buffered_spans += 1
+            buf.services.add(batch.service[i])
+            if batch.status_code[i] == STATUS_CODE_ERROR:
+                if not buf.has_error:
+                    errors.append(trace_id)
+                buf.has_error = True
+            duration = batch.duration[i]
+            if duration > buf.max_duration:
+                buf.max_duration = duration
+            if not batch.parent_span_id[i]:
+                buf.root_duration = duration
+                if latency_threshold and duration >= latency_threshold:
+                    slow.append(trace_id)
+
+        for trace_id, indices in buffered.items():
+            buffers[trace_id].spans.extend_from(batch, indices)
+
+        if self.peers is not None:
+            if self.rules_file.rules.include_errors:
+                self.peers.publish(errors, "error")
+            self.peers.publish(slow, "latency")
+
+        if late:
+            await self.sink(batch.take(late))
+
+        # Evict the oldest traces early when over the memory bounds
+        if len(buffers) > self.max_traces or self.buffered_spans > self.max_spans:
+            self.evicted_traces += await self._decide_while(
+                lambda buf: len(buffers) > self.max_traces or self.buffered_spans > self.max_spans
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        rules = self.rules_file.rules
+        return {
+            "buffered_traces": len(self._buffers),
+            "buffered_spans": self.buffered_spans,
+            "buffered_bytes": self.buffered_bytes,
+            "decisions": dict(self.decisions),
+            "decisions_per_sec": round(self.decisions_per_sec, 1),
+            "evicted_traces": self.evicted_traces,
+            "late_spans": self.late_spans,
+            "rules": {
+                "head_sample_rate": rules.head_sample_rate,
+                "latency_threshold_ms": rules.latency_threshold_ns / 1_000_000,
+                "include_errors": rules.include_errors,
+            },
+        }
+
+    async def _run(self):
+        tick = min(max(self.decision_wait / 10, 0.1), 1.0)
+        while True:
+            await asyncio.sleep(tick)
+            try:
+                self.rules_file.reload()
+                deadline = time.monotonic() - self.decision_wait
+                await self._decide_while(lambda buf: buf.first_seen <= deadline)
+                self._update_rate()
+            except Exception as e:
+                logger.error(f"❌ Sampler decision pass failed: {e}")
+
+    async def _decide_while(self, predicate: Callable[[_TraceBuffer], bool]) -> int:
+        """Decide traces oldest-first while ``predicate`` holds for the oldest one"""
+        rules = self.rules_file.rules
+        kept = SpanBatch()
+        count = 0
+        while self._buffers:
+            trace_id, buf = next(iter(self._buffers.items()))
+            if not predicate(buf):
+                break
+            del self._buffers[trace_id]
+            self.buffered_spans -= buf.span_count
+            self.buffered_bytes -= buf.bytes
+
+            reason = self.peers.pop(trace_id) if self.peers is not None else None
+            if reason in self.decisions:
+                keep = True
+            else:
+                keep, reason = decide(trace_id, buf, rules)
+            self.decisions[reason] += 1
+            if keep:
+                kept.extend(buf.spans)
+            else:
+                dropped = self.dropped_spans
+                for service in buf.spans.service:
+                    dropped[service] = dropped.get(service, 0) + 1
+            self._decided[trace_id] = keep
+            if len(self._decided) > self.decision_cache_size:
+                self._decided.popitem(last=False)
+            count += 1
+
+        self._window_decisions += count
+        if kept:
+            await self.sink(kept)
+        return count
+
+    def _update_rate(self):
+        now = time.monotonic()
+        elapsed = now - self._window_started
+        if elapsed >= 1.0:
+            self.decisions_per_sec = self._window_decisions / elapsed
+            self._window_started = now
+            self._window_decisions = 0
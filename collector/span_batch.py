@@ -0,0 +1,174 @@
+"""Columnar span batches passed between collector stages.
+
+The OTLP decoders fill a ``SpanBatch`` once; the anomaly detector, sampler
+and batch writer all read its columns in place. Numeric columns are typed
+arrays, and service and span names are interned so repeated names share one
+string object instead of allocating per span.
+"""
+import marshal
+import sys
+from array import array
+from typing import Dict, Iterable, List, Sequence
+
+STATUS_CODE_UNSET = 0
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+# ClickHouse columns written for every span, in insert order
+INSERT_COLUMNS = (
+    "timestamp", "startTimeUnixNano", "traceId", "spanId", "parentSpanId", "serviceName",
+    "spanName", "duration", "hasError", "statusCode", "statusMessage",
+    "attributes", "httpMethod", "httpUrl", "httpStatusCode", "resourceAttributes",
+    "indexedAttributes",
+)
+
+intern = sys.intern
+
+# Shared by every span without resource or indexed attributes; never mutated
+NO_ATTRIBUTES: Dict[str, str] = {}
+
+
+class SpanBatch:
+    """A batch of spans stored column by column"""
+
+    __slots__ = (
+        "trace_id", "span_id", "parent_span_id", "service", "name",
+        "start", "duration", "status_code", "status_message",
+        "attributes", "http_method", "http_url", "http_status_code",
+        "resource_attributes", "indexed_attributes",
+    )
+
+    def __init__(self):
+        self.trace_id: List[str] = []
+        self.span_id: List[str] = []
+        self.parent_span_id: List[str] = []
+        self.service: List[str] = []
+        self.name: List[str] = []
+        self.start = array("Q")
+        self.duration = array("Q")
+        self.status_code = array("B")
+        self.status_message: List[str] = []
+        self.attributes: List[str] = []
+        self.http_method: List[str] = []
+        self.http_url: List[str] = []
+        self.http_status_code: List[str] = []
+        # Spans of one resource share its dict
+        self.resource_attributes: List[Dict[str, str]] = []
+        # Attributes whose keys are configured for indexing, span before resource
+        self.indexed_attributes: List[Dict[str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.trace_id)
+
+    def append(
+        self,
+        service: str,
+        trace_id: str,
+        span_id: str,
+        parent_span_id: str,
+        name: str,
+        start: int,
+        end: int,
+        status_code: int,
+        status_message: str,
+        attributes: str,
+        http_method: str = "",
+        http_url: str = "",
+        http_status_code: str = "",
+        resource_attributes: Dict[str, str] = NO_ATTRIBUTES,
+        indexed_attributes: Dict[str, str] = NO_ATTRIBUTES,
+    ):
+        """Append one span; ``service`` is expected to be interned already"""
+        self.trace_id.append(trace_id)
+        self.span_id.append(span_id)
+        self.parent_span_id.append(parent_span_id)
+        self.service.append(service)
+        self.name.append(intern(name))
+        self.start.append(start)
+        self.duration.append(end - start if end > start else 0)
+        self.status_code.append(status_code)
+        self.status_message.append(status_message)
+        self.attributes.append(attributes)
+        self.http_method.append(http_method)
+        self.http_url.append(http_url)
+        self.http_status_code.append(http_status_code)
+        self.resource_attributes.append(resource_attributes)
+        self.indexed_attributes.append(indexed_attributes)
+
+    def extend(self, other: "SpanBatch"):
+        """Append every span of ``other``"""
+        for column in self.__slots__:
+            getattr(self, column).extend(getattr(other, column))
+
+    def take(self, indices: Sequence[int]) -> "SpanBatch":
+        """Return a new batch with only the spans at ``indices``"""
+        out = SpanBatch()
+        out.extend_from(self, indices)
+        return out
+
+    def extend_from(self, other: "SpanBatch", indices: Sequence[int]):
+        """Append the spans of ``other`` at ``indices``"""
+        for column in self.__slots__:
+            src = getattr(other, column)
+            getattr(self, column).extend([src[i] for i in indices])
+
+    @classmethod
+    def concat(cls, batches: Iterable["SpanBatch"]) -> "SpanBatch":
+        out = cls()
+        for batch in batches:
+            out.extend(batch)
+        return out
+
+    def to_bytes(self) -> bytes:
+        """Serialize the columns; typed arrays are written as raw bytes"""
+        return marshal.dumps(tuple(
+            column.tobytes() if isinstance(column, array) else column
+            for column in (getattr(self, name) for name in self.__slots__)
+        ))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SpanBatch":
+        out = cls()
+        columns = marshal.loads(data)
+        for name, column in zip(cls.__slots__, columns):
+            target = getattr(out, name)
+            if isinstance(target, array):
+                target.frombytes(column)
+            elif name in ("service", "name"):
+                target.extend(map(intern, column))
+            else:
+                setattr(out, name, column)
+        # Batches spooled before a column was added
+        for name in cls.__slots__[len(columns):]:
+            setattr(out, name, [NO_ATTRIBUTES] * len(out))
+        return out
+
+    def has_error(self, i: int) -> bool:
+        return self.status_code[i] == STATUS_CODE_ERROR
+
+    def insert_columns(self) -> list:
+        """Columns in ``INSERT_COLUMNS`` order for a columnar insert.
+
+        clickhouse_driver only accepts list columns, so the typed arrays are
+        converted here, on the writer thread rather than the event loop.
+        """
+        return [
+            # DateTime accepts raw epoch seconds, which skips datetime objects
+            [s // 1_000_000_000 for s in self.start],
+            self.start.tolist(),
+            self.trace_id,
+            self.span_id,
+            self.parent_span_id,
+            self.service,
+            self.name,
+            self.duration.tolist(),
+            [int(c == STATUS_CODE_ERROR) for c in self.status_code],
+            self.status_code.tolist(),
+            self.status_message,
+            self.attributes,
+            self.http_method,
+            self.http_url,
+            self.http_status_code,
+            self.resource_attributes,
+            self.indexed_attributes,
+        ]
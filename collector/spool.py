@@ -0,0 +1,487 @@
+import asyncio
+import fcntl
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from batch_writer import INSERT_SPANS_QUERY, add_counts
+from metrics import SIZE_BUCKETS, Histogram
+from span_batch import SpanBatch
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = b"SPOOL01\n"
+SEGMENT_SUFFIX = ".seg"
+# Record header: payload length, crc32 of the payload, append time (ms)
+RECORD_HEADER = struct.Struct("<IIQ")
+CURSOR_FILE = "cursor"
+LOCK_FILE = "LOCK"
+
+# (segment sequence number, byte offset)
+Position = Tuple[int, int]
+
+
+class Spool:
+    """Append-only on-disk spool of span batches.
+
+    Batches are appended as checksummed records to numbered segment files
+    with buffered writes. When the active segment passes ``segment_bytes`` a
+    new one is started. A reader consumes records from a persisted cursor,
+    and segments behind the cursor are deleted. When the spool grows past
+    ``max_bytes``, the oldest segments are dropped even if they were never
+    read.
+
+    Several collector processes can share ``directory``: each claims the
+    first slot subdirectory that no other live process holds a lock on, so
+    a restarted process picks up the data its predecessor left behind.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 64 * 1024 * 1024,
+        max_bytes: int = 1024 * 1024 * 1024,
+        fsync: bool = False,
+    ):
+        self.root = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+
+        self.directory: Optional[str] = None
+        self._lock_fd: Optional[int] = None
+        self._lock = threading.Lock()
+        # Sequence number -> size of every segment on disk, oldest first
+        self._segments: Dict[int, int] = {}
+        self._active = None
+        self._active_seq = 0
+        self._cursor: Position = (0, 0)
+
+        self.records_appended = 0
+        self.bytes_appended = 0
+        self.segments_dropped = 0
+        self.bytes_dropped = 0
+        self.corrupt_records = 0
+
+    def open(self):
+        """Claim a slot, recover its segments and open one for appending"""
+        os.makedirs(self.root, exist_ok=True)
+        slot = 0
+        while True:
+            directory = os.path.join(self.root, str(slot))
+            os.makedirs(directory, exist_ok=True)
+            fd = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                os.close(fd)
+                slot += 1
+        self.directory = directory
+        self._lock_fd = fd
+
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(SEGMENT_SUFFIX):
+                seq = int(name[:-len(SEGMENT_SUFFIX)])
+                self._segments[seq] = os.path.getsize(self._path(seq))
+        self._cursor = self._load_cursor()
+        if self._segments:
+            # A crash can leave a torn record at the end of the last segment
+            last = max(self._segments)
+            valid = self._valid_length(last)
+            if valid < self._segments[last]:
+                logger.warning(f"⚠️ Truncating torn tail of spool segment {last}")
+                os.truncate(self._path(last), valid)
+                self._segments[last] = valid
+        self._open_segment(max(self._segments, default=0) + 1)
+        logger.info(
+            f"💾 Spool opened at {directory} ({len(self._segments)} segments, "
+            f"{self.size_bytes()} bytes, {self.lag_bytes()} bytes to replay)"
+        )
+
+    def close(self):
+        with self._lock:
+            if self._active is not None:
+                self._active.close()
+                self._active = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def append(self, batch: SpanBatch):
+        """Append one batch as a record; blocking"""
+        payload = batch.to_bytes()
+        header = RECORD_HEADER.pack(len(payload), zlib.crc32(payload), int(time.time() * 1000))
+        with self._lock:
+            if self._segments[self._active_seq] >= self.segment_bytes:
+                self._active.close()
+                self._open_segment(self._active_seq + 1)
+            self._active.write(header)
+            self._active.write(payload)
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+            size = RECORD_HEADER.size + len(payload)
+            self._segments[self._active_seq] += size
+            self.records_appended += 1
+            self.bytes_appended += size
+            self._enforce_cap()
+
+    def read(self, position: Position, max_spans: int) -> Tuple[List[SpanBatch], Position, Optional[int]]:
+        """Read records from ``position`` until ``max_spans`` spans; blocking.
+
+        Returns the batches, the position after them and the append time (ms)
+        of the first one. Reading does not move the cursor; ``commit`` does.
+        """
+        batches: List[SpanBatch] = []
+        spans = 0
+        first_appended = None
+        with self._lock:
+            seq, offset = position
+            if seq not in self._segments:
+                # The segment was consumed or dropped; continue with the next one
+                seq = min((s for s in self._segments if s > seq), default=self._active_seq)
+                offset = 0
+        while spans < max_spans:
+            with self._lock:
+                end = self._segments.get(seq)
+                active = seq == self._active_seq
+                later = [s for s in self._segments if s > seq]
+            if end is None:
+                break
+            if offset < len(SEGMENT_MAGIC):
+                offset = len(SEGMENT_MAGIC)
+            if offset >= end:
+                if active or not later:
+                    break
+                seq, offset = min(later), 0
+                continue
+            with self._lock:
+                # Opened under the lock so _enforce_cap can't unlink it first;
+                # once open, a dropped segment stays readable
+                f = None
+                if seq in self._segments:
+                    try:
+                        f = open(self._path(seq), "rb")
+                    except FileNotFoundError:
+                        self.segments_dropped += 1
+                        logger.error(f"❌ Spool segment {seq} is missing, skipping it")
+                later = [s for s in self._segments if s > seq]
+            if f is None:
+                # Dropped since the sizes were read; continue with the next one
+                if not later:
+                    break
+                seq, offset = min(later), 0
+                continue
+            with f:
+                f.seek(offset)
+                while offset < end and spans < max_spans:
+                    header = f.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        # Truncated underneath us; retry on the next read
+                        return batches, (seq, offset), first_appended
+                    length, crc, appended_at = RECORD_HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        # Nothing after a bad record can be trusted in this segment
+                        self.corrupt_records += 1
+                        logger.error(f"❌ Corrupt record in spool segment {seq} at offset {offset}, skipping segment")
+                        offset = end
+                        break
+                    batch = SpanBatch.from_bytes(payload)
+                    batches.append(batch)
+                    spans += len(batch)
+                    offset += RECORD_HEADER.size + length
+                    if first_appended is None:
+                        first_appended = appended_at
+        return batches, (seq, offset), first_appended
+
+    def commit(self, position: Position):
+        """Persist the cursor and delete the segments before it"""
+        with self._lock:
+            self._cursor = position
+            for seq in [s for s in self._segments if s < position[0]]:
+                self._delete(seq)
+        tmp = os.path.join(self.directory, CURSOR_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            f.write(f"{position[0]} {position[1]}")
+        os.replace(tmp, os.path.join(self.directory, CURSOR_FILE))
+
+    @property
+    def cursor(self) -> Position:
+        return self._cursor
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            return sum(self._segments.values())
+
+    def lag_bytes(self) -> int:
+        """Bytes appended but not yet committed"""
+        seq, offset = self._cursor
+        with self._lock:
+            return sum(
+                size - (max(offset, len(SEGMENT_MAGIC)) if s == seq else len(SEGMENT_MAGIC))
+                for s, size in self._segments.items()
+                if s >= seq
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "segments": len(self._segments),
+            "bytes": self.size_bytes(),
+            "max_bytes": self.max_bytes,
+            "lag_bytes": self.lag_bytes(),
+            "records_appended": self.records_appended,
+            "bytes_appended": self.bytes_appended,
+            "segments_dropped": self.segments_dropped,
+            "bytes_dropped": self.bytes_dropped,
+            "corrupt_records": self.corrupt_records,
+        }
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{seq:016d}{SEGMENT_SUFFIX}")
+
+    def _open_segment(self, seq: int):
+        self._active = open(self._path(seq), "ab", buffering=1024 * 1024)
+        self._active.write(SEGMENT_MAGIC)
+        self._active.flush()
+        self._active_seq = seq
+        self._segments[seq] = len(SEGMENT_MAGIC)
+
+    def _delete(self, seq: int):
+        size = self._segments.pop(seq)
+        try:
+            os.unlink(self._path(seq))
+        except FileNotFoundError:
+            pass
+        return size
+
+    def _enforce_cap(self):
+        """Drop the oldest segments, read or not, while over ``max_bytes``"""
+        total = sum(self._segments.values())
+        while total > self.max_bytes and len(self._segments) > 1:
+            oldest = min(self._segments)
+            size = self._delete(oldest)
+            total -= size
+            self.segments_dropped += 1
+            self.bytes_dropped += size
+            logger.warning(f"⚠️ Spool over {self.max_bytes} bytes, dropped segment {oldest} ({size} bytes)")
+
+    def _valid_length(self, seq: int) -> int:
+        """Length of the prefix of a segment made of complete, valid records"""
+        with open(self._path(seq), "rb") as f:
+            if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                return 0
+            offset = len(SEGMENT_MAGIC)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return offset
+                length, crc, _ = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    return offset
+                offset += RECORD_HEADER.size + length
+
+    def _load_cursor(self) -> Position:
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (FileNotFoundError, ValueError):
+            return min(self._segments, default=0), 0
+
+
+class SpoolReplayer:
+    """Replays spooled spans into ClickHouse.
+
+    Reads up to ``batch_size`` spans at a time from the spool cursor and
+    writes them with one columnar insert. The cursor only advances after
+    the insert succeeds, so a failed insert is retried, with backoff, from
+    the same position. Replay is paced to at most ``max_spans_per_sec``
+    (0 means unlimited), which keeps a large backlog from swamping
+    ClickHouse once it comes back. While caught up, records are collected
+    for up to ``flush_interval`` seconds before inserting.
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        client_factory: Callable[[], Any],
+        batch_size: int = 50_000,
+        flush_interval: float = 1.0,
+        max_spans_per_sec: float = 0,
+        max_backoff: float = 30.0,
+    ):
+        self.spool = spool
+        self.client_factory = client_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_spans_per_sec = max_spans_per_sec
+        self.max_backoff = max_backoff
+
+        self._client = None
+        self._task: Optional[asyncio.Task] = None
+        self._appended = asyncio.Event()
+        self._stopping = False
+        # One thread for spool writes, one for reads and inserts
+        self._append_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool-append")
+        self._replay_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool-replay")
+
+        self.spans_spooled = 0
+        self.spans_replayed = 0
+        self.inserts_failed = 0
+        self.lag_seconds = 0.0
+        self.last_batch_size = 0
+        self.last_insert_ms = 0.0
+        self.spans_written_by_service: Dict[str, int] = {}
+        self.insert_seconds = Histogram("collector_insert_seconds", "Time to insert a batch of spans into ClickHouse")
+        self.insert_batch_spans = Histogram("collector_insert_batch_spans", "Spans per ClickHouse insert", SIZE_BUCKETS)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._append_executor, self.spool.open)
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._replay_done)
+        logger.info(
+            f"🔁 Spool replay started (batch={self.batch_size}, "
+            f"rate={self.max_spans_per_sec or 'unlimited'} spans/s)"
+        )
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Give replay up to ``drain_timeout`` seconds to catch up, then stop.
+
+        Whatever is left stays on disk for the next start.
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._appended.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), drain_timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._append_executor.shutdown(wait=True)
+        self._replay_executor.shutdown(wait=True)
+        self.spool.close()
+
+    def _replay_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"❌ Spool replay stopped, spooled spans are no longer written: {task.exception()!r}")
+
+    async def submit(self, batch: SpanBatch):
+        """Append a batch to the spool; returns once it is on disk"""
+        if not len(batch):
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._append_executor, self.spool.append, batch)
+        self.spans_spooled += len(batch)
+        self._appended.set()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.spool.stats()
+        stats.update({
+            "spans_spooled": self.spans_spooled,
+            "spans_replayed": self.spans_replayed,
+            "inserts_failed": self.inserts_failed,
+            "lag_seconds": round(self.lag_seconds, 3),
+            "last_batch_size": self.last_batch_size,
+            "last_insert_ms": round(self.last_insert_ms, 2),
+        })
+        return stats
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        position = self.spool.cursor
+        backoff = 0.0
+        batches: List[SpanBatch] = []
+        first_appended = None
+        while True:
+            try:
+                more, position, appended_at = await loop.run_in_executor(
+                    self._replay_executor, self.spool.read, position, self.batch_size - sum(map(len, batches))
+                )
+            except Exception as e:
+                backoff = min(max(backoff * 2, 0.5), self.max_backoff)
+                logger.error(f"❌ Reading the spool failed, retrying in {backoff}s: {e}")
+                if self._stopping:
+                    return
+                await asyncio.sleep(backoff)
+                continue
+            batches.extend(more)
+            if first_appended is None:
+                first_appended = appended_at
+            pending = sum(map(len, batches))
+            # Age of the oldest span not yet in ClickHouse
+            self.lag_seconds = 0.0 if first_appended is None else max(time.time() - first_appended / 1000, 0.0)
+
+            # Wait for more unless the batch is full, old enough, or we're stopping
+            if pending < self.batch_size and not self._stopping:
+                age = 0.0 if first_appended is None else time.time() - first_appended / 1000
+                if not pending or age < self.flush_interval:
+                    self._appended.clear()
+                    timeout = self.flush_interval if not pending else self.flush_interval - age
+                    try:
+                        await asyncio.wait_for(self._appended.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    if not pending or (time.time() - first_appended / 1000) < self.flush_interval:
+                        continue
+            if not pending:
+                if self._stopping:
+                    return
+                continue
+
+            batch = batches[0] if len(batches) == 1 else SpanBatch.concat(batches)
+            started = time.perf_counter()
+            try:
+                by_service = await loop.run_in_executor(self._replay_executor, self._insert, batch)
+            except Exception as e:
+                self.inserts_failed += 1
+                backoff = min(max(backoff * 2, 0.5), self.max_backoff)
+                logger.error(f"❌ Spool replay of {len(batch)} spans failed, retrying in {backoff}s: {e}")
+                if self._stopping:
+                    return
+                await asyncio.sleep(backoff)
+                # Keep what was read; it is retried from memory
+                batches = [batch]
+                continue
+            backoff = 0.0
+            elapsed = time.perf_counter() - started
+            self.last_insert_ms = elapsed * 1000
+            self.last_batch_size = len(batch)
+            self.spans_replayed += len(batch)
+            add_counts(self.spans_written_by_service, by_service)
+            self.insert_seconds.observe(elapsed)
+            self.insert_batch_spans.observe(len(batch))
+            await loop.run_in_executor(self._replay_executor, self.spool.commit, position)
+            batches, first_appended = [], None
+            if self.max_spans_per_sec:
+                pause = len(batch) / self.max_spans_per_sec - elapsed
+                if pause > 0 and not self._stopping:
+                    await asyncio.sleep(pause)
+
+    def _insert(self, batch: SpanBatch) -> Counter:
+        """Insert the batch; returns its spans per service"""
+        if self._client is None:
+            self._client = self.client_factory()
+        try:
+            self._client.execute(INSERT_SPANS_QUERY, batch.insert_columns(), columnar=True)
+        except Exception:
+            self._client = None
+            raise
+        return Counter(batch.service)
@@ -0,0 +1,440 @@
+"""Multi-worker collector.
+
+``python workers.py`` runs a supervisor that forks COLLECTOR_WORKERS ingest
+workers. Each worker is a full collector process with its own pipeline,
+ClickHouse connections and spool slot, serving OTLP/HTTP on OTLP_PORT and
+OTLP/gRPC on GRPC_PORT. Workers bind the ports with SO_REUSEPORT, so the
+kernel spreads connections across them; without SO_REUSEPORT they accept
+OTLP/HTTP on one socket inherited from the supervisor.
+
+The supervisor itself serves a small admin API on ADMIN_PORT:
+
+- ``/`` and ``/health``: liveness of the workers
+- ``/stats``: every worker's /stats plus their sum
+- ``/anomalies``: anomalies detected by any worker, newest first
+- ``/metrics``: every worker's Prometheus metrics, labelled with ``worker``
+
+Workers publish their state to WORKER_RUN_DIR once a second for it. On
+SIGTERM or SIGINT the supervisor stops every worker gracefully: they stop
+accepting connections, finish in-flight requests and flush their pipelines.
+Workers still running after DRAIN_TIMEOUT_SECONDS are killed. Workers that
+die on their own are restarted.
+
+Tail sampling still works per trace: a worker that sees an error or slow
+root span tells its peers, and they keep their spans of that trace too
+(see ``DecisionPeers``). Likewise, spans whose parent span reached another
+worker are resolved there for the service dependency graph (see
+``DependencyPeers``).
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from admission import SharedTokenBuckets
+from metrics import add_label, render
+
+logger = logging.getLogger(__name__)
+
+COLLECTOR_WORKERS = int(os.getenv("COLLECTOR_WORKERS", str(os.cpu_count() or 1)))
+OTLP_PORT = int(os.getenv("OTLP_PORT", "4318"))
+ADMIN_PORT = int(os.getenv("ADMIN_PORT", "8001"))
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "30"))
+
+# Set by the supervisor in every worker's environment
+WORKER_ID = os.getenv("WORKER_ID")
+WORKER_RUN_DIR = os.getenv("WORKER_RUN_DIR")
+# admission.SharedTokenBuckets, handed to every worker so quotas are global
+SHARED_BUCKETS = None
+
+STATE_SUFFIX = ".json"
+PEER_SUFFIX = ".sock"
+DEPENDENCY_PEER_SUFFIX = ".deps"
+
+# Same in every worker, so the total keeps the worker's value
+_CONFIG_KEYS = {
+    "queue_size", "max_batch_size", "flush_interval", "max_bytes", "max_request_bytes",
+    "max_inflight_bytes", "max_inflight_spans", "rate_limit", "burst", "head_sample_rate",
+    "latency_threshold_ms", "include_errors", "port", "max_concurrent_rpcs", "window", "capacity",
+    "hash_functions",
+}
+# Point-in-time gauges where the worst worker matters
+_MAX_KEYS = {"lag_seconds", "last_flush_ms", "last_insert_ms", "last_batch_size", "estimated_fp_rate"}
+
+
+def merge_stats(total: Any, stats: Any, key: Optional[str] = None) -> Any:
+    """Fold one worker's /stats into ``total``: counters add up, config is kept"""
+    if isinstance(stats, dict):
+        total = total if isinstance(total, dict) else {}
+        for k, v in stats.items():
+            total[k] = merge_stats(total.get(k), v, k)
+        return total
+    if isinstance(stats, bool) or not isinstance(stats, (int, float)):
+        return stats if total is None else total
+    if total is None or key in _CONFIG_KEYS:
+        return stats if total is None else total
+    if key in _MAX_KEYS:
+        return max(total, stats)
+    return total + stats
+
+
+# -- Worker side ------------------------------------------------------------
+
+async def publish_state(get_state: Callable[[], Any], interval: float = 1.0):
+    """Write this worker's state where the supervisor's admin server reads it"""
+    path = os.path.join(WORKER_RUN_DIR, f"worker-{WORKER_ID}{STATE_SUFFIX}")
+    tmp = path + ".tmp"
+    while True:
+        try:
+            state = await get_state()
+            state["pid"] = os.getpid()
+            state["published_at"] = time.time()
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.error(f"❌ Failed to publish worker state: {e}")
+        await asyncio.sleep(interval)
+
+
+class _PeerSocket:
+    """Best-effort messages to every other worker over Unix datagram sockets.
+
+    Each worker binds ``worker-<id><suffix>`` in the run directory; peers
+    are found by listing it. Subclasses handle what they receive in
+    ``_handle``.
+    """
+
+    suffix = PEER_SUFFIX
+
+    def __init__(self, run_dir: str, worker_id: str):
+        self.run_dir = run_dir
+        self.path = os.path.join(run_dir, f"worker-{worker_id}{self.suffix}")
+        self._sock: Optional[socket.socket] = None
+        self._peers: List[str] = []
+        self._peers_listed = 0.0
+        self.sent = 0
+        self.received = 0
+        self.send_errors = 0
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        self._sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(self._sock.fileno(), self._receive)
+
+    def stop(self):
+        if self._sock is None:
+            return
+        asyncio.get_running_loop().remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "peers": len(self._peers),
+            "sent": self.sent,
+            "received": self.received,
+            "send_errors": self.send_errors,
+        }
+
+    def _send(self, message: bytes):
+        now = time.monotonic()
+        if now - self._peers_listed > 1.0:
+            self._peers = [
+                os.path.join(self.run_dir, name) for name in os.listdir(self.run_dir)
+                if name.endswith(self.suffix) and os.path.join(self.run_dir, name) != self.path
+            ]
+            self._peers_listed = now
+        for peer in self._peers:
+            try:
+                self._sock.sendto(message, peer)
+                self.sent += 1
+            except OSError:
+                self.send_errors += 1
+
+    def _receive(self):
+        while True:
+            try:
+                data = self._sock.recv(65536)
+            except (BlockingIOError, OSError):
+                return
+            self.received += 1
+            try:
+                self._handle(data)
+            except Exception as e:
+                logger.warning(f"⚠️ Dropped malformed message from a peer worker: {e}")
+
+    def _handle(self, data: bytes):
+        raise NotImplementedError
+
+
+class DecisionPeers(_PeerSocket):
+    """Shares tail-sampling keep decisions between workers.
+
+    Spans of one trace reach different workers, and each worker only sees
+    its share. When a worker sees a span that will keep its trace (an error
+    or a slow root span), it sends the trace ID and reason to every other
+    worker over a Unix datagram socket. Peers remember the trace and keep
+    their own spans of it when it is decided, so the whole trace is kept.
+    Delivery is best effort, which is fine since decisions wait seconds.
+    """
+
+    def __init__(self, run_dir: str, worker_id: str, max_remembered: int = 100_000):
+        super().__init__(run_dir, worker_id)
+        self.max_remembered = max_remembered
+        # trace ID -> reason, for traces kept by another worker
+        self.kept: "OrderedDict[str, str]" = OrderedDict()
+
+    def publish(self, trace_ids: List[str], reason: str):
+        """Tell every other worker that these traces will be kept"""
+        if self._sock is None or not trace_ids:
+            return
+        # Well under the default datagram size limit
+        for i in range(0, len(trace_ids), 100):
+            self._send((reason + " " + " ".join(trace_ids[i:i + 100])).encode())
+
+    def pop(self, trace_id: str) -> Optional[str]:
+        """The reason another worker kept ``trace_id``, if any"""
+        return self.kept.pop(trace_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "remembered": len(self.kept)}
+
+    def _handle(self, data: bytes):
+        reason, *trace_ids = data.decode().split(" ")
+        for trace_id in trace_ids:
+            self.kept[trace_id] = reason
+        while len(self.kept) > self.max_remembered:
+            self.kept.popitem(last=False)
+
+
+class DependencyPeers(_PeerSocket):
+    """Hands spans whose parent a worker never saw to the other workers.
+
+    A caller's span and its callee's span are usually exported by different
+    processes and can reach different workers. Spans still unresolved when
+    they expire from ``dependencies.ServiceDependencies`` are sent to every
+    peer, which resolves them against its own span index.
+    """
+
+    suffix = DEPENDENCY_PEER_SUFFIX
+
+    def __init__(self, run_dir: str, worker_id: str):
+        super().__init__(run_dir, worker_id)
+        self.on_orphans: Optional[Callable[[List[list]], None]] = None
+
+    def publish(self, orphans: List[tuple]):
+        if self._sock is None or not orphans:
+            return
+        for i in range(0, len(orphans), 200):
+            self._send(json.dumps(orphans[i:i + 200], separators=(",", ":")).encode())
+
+    def _handle(self, data: bytes):
+        if self.on_orphans is not None:
+            self.on_orphans(json.loads(data))
+
+
+# -- Supervisor side --------------------------------------------------------
+
+def _bind(port: int, reuse_port: bool) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("0.0.0.0", port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(worker_id: int, run_dir: str, port: int, shared: Optional[socket.socket], buckets):
+    os.environ["WORKER_ID"] = str(worker_id)
+    os.environ["WORKER_RUN_DIR"] = run_dir
+    # Keep terminal signals to the supervisor, which stops workers in order
+    os.setpgrp()
+    import uvicorn
+    # The supervisor may be running as __main__; the collector reads this module
+    import workers
+    # Already imported before the fork when the supervisor ran as collector.py
+    workers.WORKER_ID = str(worker_id)
+    workers.WORKER_RUN_DIR = run_dir
+    workers.SHARED_BUCKETS = buckets
+    import collector
+
+    sock = shared if shared is not None else _bind(port, reuse_port=True)
+    server = uvicorn.Server(uvicorn.Config(collector.app, log_level="info"))
+    # uvicorn exits gracefully on SIGTERM: stops accepting, drains, runs shutdown hooks
+    server.run(sockets=[sock])
+
+
+class Supervisor:
+    def __init__(self, workers: int, port: int, admin_port: int, drain_timeout: float, run_dir: Optional[str] = None):
+        self.n_workers = workers
+        self.port = port
+        self.admin_port = admin_port
+        self.drain_timeout = drain_timeout
+        self.run_dir = run_dir or tempfile.mkdtemp(prefix="collector-")
+        self.reuse_port = hasattr(socket, "SO_REUSEPORT")
+        # Only used without SO_REUSEPORT
+        self._shared: Optional[socket.socket] = None
+        self._ctx = multiprocessing.get_context("fork")
+        self.buckets = SharedTokenBuckets()
+        self.workers: Dict[int, multiprocessing.Process] = {}
+        self.restarts = 0
+        self.started_at = time.time()
+        self._stopping = threading.Event()
+
+    def run(self):
+        for name in os.listdir(self.run_dir):
+            if name.endswith((STATE_SUFFIX, PEER_SUFFIX, DEPENDENCY_PEER_SUFFIX)):
+                os.unlink(os.path.join(self.run_dir, name))
+        if not self.reuse_port:
+            self._shared = _bind(self.port, reuse_port=False)
+        for worker_id in range(self.n_workers):
+            self._spawn(worker_id)
+        logger.info(
+            f"👷 Started {self.n_workers} collector workers on :{self.port} "
+            f"({'SO_REUSEPORT' if self.reuse_port else 'shared socket'}), admin on :{self.admin_port}"
+        )
+
+        admin = ThreadingHTTPServer(("0.0.0.0", self.admin_port), _admin_handler(self))
+        threading.Thread(target=admin.serve_forever, name="admin", daemon=True).start()
+
+        signal.signal(signal.SIGTERM, lambda *_: self._stopping.set())
+        signal.signal(signal.SIGINT, lambda *_: self._stopping.set())
+        while not self._stopping.wait(0.5):
+            for worker_id, process in list(self.workers.items()):
+                if not process.is_alive():
+                    logger.warning(f"⚠️ Worker {worker_id} exited with {process.exitcode}, restarting")
+                    self.restarts += 1
+                    self._spawn(worker_id)
+
+        self._drain()
+        admin.shutdown()
+
+    def _spawn(self, worker_id: int):
+        process = self._ctx.Process(
+            target=_run_worker,
+            args=(worker_id, self.run_dir, self.port, self._shared, self.buckets),
+            name=f"collector-worker-{worker_id}",
+        )
+        process.start()
+        self.workers[worker_id] = process
+
+    def _drain(self):
+        logger.info(f"🛑 Draining {len(self.workers)} workers (timeout {self.drain_timeout}s)")
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.drain_timeout
+        for worker_id, process in self.workers.items():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.error(f"❌ Worker {worker_id} did not drain in time, killing it")
+                process.kill()
+                process.join()
+
+    def worker_states(self) -> Dict[str, Any]:
+        states = {}
+        for worker_id, process in self.workers.items():
+            path = os.path.join(self.run_dir, f"worker-{worker_id}{STATE_SUFFIX}")
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+            state["alive"] = process.is_alive()
+            states[str(worker_id)] = state
+        return states
+
+
+def _admin_handler(supervisor: Supervisor):
+    class AdminHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            states = supervisor.worker_states()
+            alive = sum(s["alive"] for s in states.values())
+            if url.path in ("/", "/health"):
+                status = 200 if alive == len(states) else 503
+                self._send(status, {
+                    "status": "healthy" if status == 200 else "degraded",
+                    "service": "collector",
+                    "workers": len(states),
+                    "alive": alive,
+                    "restarts": supervisor.restarts,
+                    "uptime": round(time.time() - supervisor.started_at, 1),
+                })
+            elif url.path == "/stats":
+                total = None
+                for state in states.values():
+                    total = merge_stats(total, state.get("stats") or {})
+                self._send(200, {
+                    "total": total or {},
+                    "workers": {
+                        worker_id: {
+                            "alive": state["alive"],
+                            "pid": state.get("pid"),
+                            "published_at": state.get("published_at"),
+                            "stats": state.get("stats"),
+                        }
+                        for worker_id, state in states.items()
+                    },
+                })
+            elif url.path == "/anomalies":
+                query = parse_qs(url.query)
+                since = float(query.get("since", ["0"])[0])
+                service = query.get("service", [None])[0]
+                anomalies = [
+                    a for state in states.values() for a in state.get("anomalies") or []
+                    if a["timestamp"] >= since and (service is None or a["service"] == service)
+                ]
+                anomalies.sort(key=lambda a: a["timestamp"], reverse=True)
+                self._send(200, {"anomalies": anomalies})
+            elif url.path == "/metrics":
+                families = []
+                for worker_id, state in states.items():
+                    families.extend(add_label(state.get("metrics") or [], "worker", worker_id))
+                self._send_body(200, render(families).encode(), "text/plain; version=0.0.4")
+            else:
+                self._send(404, {"detail": "Not Found"})
+
+        def _send(self, status: int, payload: Dict[str, Any]):
+            self._send_body(status, json.dumps(payload).encode(), "application/json")
+
+        def _send_body(self, status: int, body: bytes, content_type: str):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return AdminHandler
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    Supervisor(COLLECTOR_WORKERS, OTLP_PORT, ADMIN_PORT, DRAIN_TIMEOUT_SECONDS, os.getenv("WORKER_RUN_DIR")).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Prometheus metrics, cheap enough to leave on.
+
+Counters and histograms are plain Python objects updated without locks:
+an update is a single attribute or list-slot add, and every metric is
+written from one thread (the event loop, or the single writer thread that
+owns it), so nothing is lost to races. Histogram buckets are allocated
+once, and an observation is a bisect and an increment.
+
+Values are only formatted when scraped: ``Registry.collect`` returns
+JSON-serializable families, which ``render`` turns into the text
+exposition format. Families from several processes can be combined with
+``add_label`` before rendering.
+
+Shared by the collector and the backend: collector/metrics.py and
+backend/metrics.py are symlinks to this file, and their images copy it to
+/common next to /app.
+"""
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10_000, 50_000, 100_000)
+
+# {"name", "type", "help", "samples": [[sample name, {label: value}, value]]}
+Family = Dict[str, Any]
+
+
+def family(name: str, kind: str, documentation: str, samples: Iterable[Tuple[str, Dict[str, str], float]]) -> Family:
+    return {"name": name, "type": kind, "help": documentation, "samples": [list(s) for s in samples]}
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values: str):
+        """The child for these label values, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def collect(self) -> Family:
+        samples = []
+        for values, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            samples.extend(child.samples(self.name, labels))
+        return family(self.name, self.kind, self.documentation, samples)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self, name: str, labels: Dict[str, str]):
+        return [(name, labels, self.value)]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1):
+        self._default.value += amount
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float):
+        self._default.value = value
+
+    def _new_child(self):
+        return _Value()
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One slot per bucket plus +Inf, non-cumulative
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str, labels: Dict[str, str]):
+        samples = []
+        total = 0
+        for bound, count in zip(self.bounds + (float("inf"),), list(self.counts)):
+            total += count
+            samples.append((f"{name}_bucket", {**labels, "le": _format_bound(bound)}, total))
+        samples.append((f"{name}_sum", labels, self.sum))
+        samples.append((f"{name}_count", labels, total))
+        return samples
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                 labelnames: Sequence[str] = ()):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+
+class Registry:
+    """Metrics and callbacks that produce families at scrape time.
+
+    Callbacks expose counters components already keep for /stats without
+    touching their hot paths.
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._callbacks: List[Callable[[], Iterable[Family]]] = []
+
+    def register(self, *metrics: _Metric):
+        self._metrics.extend(metrics)
+
+    def register_callback(self, callback: Callable[[], Iterable[Family]]):
+        self._callbacks.append(callback)
+
+    def collect(self) -> List[Family]:
+        families = [m.collect() for m in self._metrics]
+        for callback in self._callbacks:
+            families.extend(callback())
+        return families
+
+
+def add_label(families: List[Family], name: str, value: str) -> List[Family]:
+    """Copies of ``families`` with one more label on every sample"""
+    return [
+        {**f, "samples": [[s[0], {**s[1], name: value}, s[2]] for s in f["samples"]]}
+        for f in families
+    ]
+
+
+def _format_bound(bound: float) -> str:
+    if bound == float("inf"):
+        return "+Inf"
+    return repr(float(bound))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(families: Iterable[Family]) -> str:
+    """Prometheus text exposition format; families of the same name are merged"""
+    merged: Dict[str, Family] = {}
+    for f in families:
+        existing = merged.get(f["name"])
+        if existing is None:
+            merged[f["name"]] = {**f, "samples": list(f["samples"])}
+        else:
+            existing["samples"].extend(f["samples"])
+    lines = []
+    for f in merged.values():
+        lines.append(f"# HELP {f['name']} {f['help']}")
+        lines.append(f"# TYPE {f['name']} {f['type']}")
+        for name, labels, value in f["samples"]:
+            if labels:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+async def monitor_event_loop(histogram: Histogram, interval: float = 0.5):
+    """Observe how late the event loop wakes up from a sleep of ``interval``"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        histogram.observe(max(loop.time() - started - interval, 0.0))
+
+
+class RequestMetrics:
+    """ASGI middleware timing every HTTP request by route template and status"""
+
+    def __init__(self, app, histogram: Histogram):
+        self.app = app
+        self.histogram = histogram
+        self._routes: Optional[Dict[Any, str]] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router sets the endpoint it matched on the scope
+            self.histogram.labels(self._route(scope), scope["method"], str(status[0])).observe(
+                time.perf_counter() - started
+            )
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._routes is None or endpoint not in self._routes:
+            self._routes = {
+                getattr(r, "endpoint", None): r.path for r in scope["app"].router.routes if hasattr(r, "path")
+            }
+        return self._routes.get(endpoint, "unmatched")
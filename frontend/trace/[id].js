@@ -12,7 +12,16 @@ interface Span {
   startTime: number
   duration: number
   statusCode: string
-  attributes: Record<string, any>
+  depth: number
+  childCount: number
+  // Children left out of the window; loaded on demand
+  hiddenChildren: number
+}
+
+interface SpanAttributes {
+  attributes: string
+  resourceAttributes: Record<string, string>
+  statusMessage: string
 }
 
 interface TraceData {
@@ -23,6 +32,10 @@ interface TraceData {
   total_spans: number
 }
 
+const API = 'http://localhost:8002'
+// Levels of the span tree loaded up front; deeper spans are expanded on demand
+const INITIAL_DEPTH = 3
+
 export default function TraceDetail() {
   const params = useParams()
   const router = useRouter()
@@ -30,6 +43,9 @@ export default function TraceDetail() {
   const [trace, setTrace] = useState<TraceData | null>(null)
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState<string | null>(null)
+  const [selected, setSelected] = useState<string | null>(null)
+  const [attributes, setAttributes] = useState<Record<string, SpanAttributes>>({})
+  const [nextOffsets, setNextOffsets] = useState<Record<string, number>>({})
 
   useEffect(() => {
     if (traceId) {
@@ -39,7 +55,7 @@ export default function TraceDetail() {
 
   const fetchTrace = async () => {
     try {
-      const res = await fetch(`http://localhost:8002/traces/${traceId}`)
+      const res = await fetch(`${API}/traces/${traceId}?depth=${INITIAL_DEPTH}`)
       
       if (!res.ok) {
         throw new Error(`HTTP error! status: ${res.status}`)
@@ -60,6 +76,58 @@ export default function TraceDetail() {
     }
   }
 
+  // Expanding a span loads its children a page at a time; the next page's
+  // offset is kept until they are all loaded
+  const expandSpan = async (spanId: string) => {
+    try {
+      const offset = nextOffsets[spanId] ?? 0
+      const res = await fetch(`${API}/traces/${traceId}/spans/${spanId}/children?offset=${offset}`)
+      if (!res.ok) {
+        throw new Error(`HTTP error! status: ${res.status}`)
+      }
+      const data = await res.json()
+      setNextOffsets(prev => {
+        const next = { ...prev }
+        if (data.nextOffset != null) {
+          next[spanId] = data.nextOffset
+        } else {
+          delete next[spanId]
+        }
+        return next
+      })
+      setTrace(prev => {
+        if (!prev) return prev
+        const known = new Set(prev.spans.map(s => s.spanId))
+        const added = data.spans.filter((s: Span) => !known.has(s.spanId))
+        const direct = added.filter((s: Span) => s.parentSpanId === spanId).length
+        const spans = [...prev.spans]
+        const at = spans.findIndex(s => s.spanId === spanId)
+        spans[at] = { ...spans[at], hiddenChildren: Math.max(spans[at].hiddenChildren - direct, 0) }
+        // After the children loaded by earlier pages
+        let end = at + 1
+        while (end < spans.length && spans[end].depth > spans[at].depth) end++
+        spans.splice(end, 0, ...added)
+        return { ...prev, spans }
+      })
+    } catch (err) {
+      console.error('Failed to expand span:', err)
+    }
+  }
+
+  const selectSpan = async (spanId: string) => {
+    setSelected(spanId)
+    if (attributes[spanId]) return
+    try {
+      const res = await fetch(`${API}/traces/${traceId}/spans/${spanId}/attributes`)
+      if (res.ok) {
+        const data = await res.json()
+        setAttributes(prev => ({ ...prev, [spanId]: data }))
+      }
+    } catch (err) {
+      console.error('Failed to fetch span attributes:', err)
+    }
+  }
+
   if (loading) {
     return (
       <div className="min-h-screen bg-gray-50 flex items-center justify-center">
@@ -92,6 +160,8 @@ export default function TraceDetail() {
   const spans: Span[] = trace.spans || []
   const services = Array.from(new Set(spans.map(s => s.serviceName)))
   const errorSpans = spans.filter(s => s.statusCode !== 'OK')
+  const collapsed = spans.filter(s => s.hiddenChildren > 0)
+  const selectedSpan = spans.find(s => s.spanId === selected)
 
   return (
     <div className="min-h-screen bg-gray-50 p-8">
@@ -126,7 +196,9 @@ export default function TraceDetail() {
             </div>
             <div>
               <div className="text-gray-500">Spans</div>
-              <div className="font-medium">{spans.length}</div>
+              <div className="font-medium">
+                {spans.length < trace.total_spans ? `${spans.length} of ${trace.total_spans}` : trace.total_spans}
+              </div>
             </div>
           </div>
         </div>
@@ -165,6 +237,47 @@ export default function TraceDetail() {
               </div>
             </div>
 
+            {/* Collapsed subtrees */}
+            {collapsed.length > 0 && (
+              <div className="bg-white shadow rounded-lg p-6">
+                <h2 className="text-xl font-semibold mb-4">Collapsed ({collapsed.length})</h2>
+                <div className="space-y-2 max-h-96 overflow-y-auto">
+                  {collapsed.map(span => (
+                    <div key={span.spanId} className="flex items-center justify-between text-sm">
+                      <span
+                        onClick={() => selectSpan(span.spanId)}
+                        className="truncate cursor-pointer"
+                        style={{paddingLeft: `${span.depth * 8}px`}}
+                      >
+                        {span.name}
+                      </span>
+                      <button
+                        onClick={() => expandSpan(span.spanId)}
+                        className="ml-2 text-blue-600 hover:text-blue-800 whitespace-nowrap"
+                      >
+                        {span.spanId in nextOffsets ? `load more (${span.hiddenChildren})` : `+${span.hiddenChildren}`}
+                      </button>
+                    </div>
+                  ))}
+                </div>
+              </div>
+            )}
+
+            {/* Selected span, with its attributes fetched on demand */}
+            {selectedSpan && (
+              <div className="bg-white shadow rounded-lg p-6">
+                <h2 className="text-xl font-semibold mb-4">{selectedSpan.name}</h2>
+                <div className="text-sm text-gray-500 mb-2">{selectedSpan.serviceName}</div>
+                {attributes[selectedSpan.spanId] ? (
+                  <pre className="text-xs bg-gray-50 p-2 rounded overflow-x-auto">
+                    {JSON.stringify(attributes[selectedSpan.spanId], null, 2)}
+                  </pre>
+                ) : (
+                  <p className="text-gray-500 text-sm">Loading attributes...</p>
+                )}
+              </div>
+            )}
+
             {/* Errors */}
             <div className="bg-white shadow rounded-lg p-6">
               <h2 className="text-xl font-semibold mb-4">
@@ -173,7 +286,11 @@ export default function TraceDetail() {
               {errorSpans.length > 0 ? (
                 <div className="space-y-2">
                   {errorSpans.map(span => (
-                    <div key={span.spanId} className="p-3 bg-red-50 border border-red-200 rounded text-sm">
+                    <div
+                      key={span.spanId}
+                      onClick={() => selectSpan(span.spanId)}
+                      className="p-3 bg-red-50 border border-red-200 rounded text-sm cursor-pointer"
+                    >
                       <div className="font-medium text-red-900">{span.name}</div>
                       <div className="text-red-700">{span.serviceName}</div>
                       <div className="text-xs text-red-600 mt-1">
@@ -5,8 +5,8 @@ from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+import asyncio
 import os
-import time
 import random
 
 # OpenTelemetry Setup
@@ -38,7 +38,7 @@ async def login(user_id: str):
         span.set_attribute("user.id", user_id)
         
         # Simulate authentication delay
-        time.sleep(random.uniform(0.05, 0.3))
+        await asyncio.sleep(random.uniform(0.05, 0.3))
         
         # Random auth failures
         if random.random() < 0.1:
@@ -5,8 +5,8 @@ from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+import asyncio
 import os
-import time
 import random
 
 resource = Resource(attributes={
@@ -37,7 +37,7 @@ async def check_inventory(order_id: str):
         span.set_attribute("order.id", order_id)
         
         # Simulate inventory check
-        time.sleep(random.uniform(0.05, 0.2))
+        await asyncio.sleep(random.uniform(0.05, 0.2))
         
         # Random inventory issues
         if random.random() < 0.15:
@@ -0,0 +1,332 @@
+"""Load driver for the tracing pipeline.
+
+Two modes:
+
+- ``synthetic`` (default): traces are built in-process with the
+  OpenTelemetry SDK, one TracerProvider per simulated service, and exported
+  to the collector like the demo services do. Span times are set
+  explicitly, so nothing sleeps; ``--processes`` spreads the rate over
+  several cores.
+- ``http``: requests go to a service endpoint (e.g. order-service's
+  /orders) at the target rate, and the demo services produce the traces.
+
+The rate is open-loop: traces are started on schedule whether or not
+earlier ones have finished. When the driver can't keep up, the missed
+traces are reported instead of silently lowering the rate. Every
+``--report-interval`` seconds it prints the achieved traces (or requests)
+per second and the spans exported per second. With ``--collector`` it also
+reads how many spans the collector accepted.
+
+Usage:
+    python loadgen.py --rate 2000 --duration 60 --fanout 3 --depth 3 --processes 4
+    python loadgen.py --mode http --target http://localhost:8004/orders --rate 200
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import time
+from typing import List, Optional
+
+import httpx
+
+SERVICES = ["order-service", "auth-service", "inventory-service", "payment-service"]
+OPERATIONS = {
+    "order-service": "order.create",
+    "auth-service": "user.login",
+    "inventory-service": "inventory.check",
+    "payment-service": "payment.process",
+}
+
+# Driver ticks per second; due traces are started in bursts at each tick
+TICKS_PER_SECOND = 100
+# Traces more than this many seconds behind schedule are counted as missed
+MAX_BACKLOG_SECONDS = 1.0
+
+
+class Counters:
+    """Totals shared by every driver process"""
+
+    FIELDS = ("traces", "spans", "exported", "export_failed", "request_errors", "missed", "latency_us")
+
+    def __init__(self, ctx):
+        for name in self.FIELDS:
+            setattr(self, name, ctx.Value("q", 0))
+
+    def add(self, **amounts: int):
+        for name, amount in amounts.items():
+            if amount:
+                value = getattr(self, name)
+                with value.get_lock():
+                    value.value += amount
+
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name).value for name in self.FIELDS}
+
+
+def service_names(n: int) -> List[str]:
+    return [SERVICES[i] if i < len(SERVICES) else f"service-{i}" for i in range(n)]
+
+
+def paced(rate: float, duration: float, counters: Counters):
+    """Yield (traces due now, perf_counter() time of the next tick) until ``duration`` ends"""
+    started = time.perf_counter()
+    tick = 1 / TICKS_PER_SECOND
+    scheduled = 0
+    while True:
+        elapsed = time.perf_counter() - started
+        if elapsed >= duration:
+            return
+        due = int(elapsed * rate) - scheduled
+        if due > rate * MAX_BACKLOG_SECONDS:
+            missed = due - int(rate * MAX_BACKLOG_SECONDS)
+            counters.add(missed=missed)
+            scheduled += missed
+            due -= missed
+        scheduled += due
+        yield due, started + (int(elapsed / tick) + 1) * tick
+
+
+# -- Synthetic traces ---------------------------------------------------------
+
+def run_synthetic(args, rate: float, seed: int, counters: Counters):
+    from opentelemetry import trace
+    from opentelemetry.exporter.otlp.proto.http import Compression
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+
+    class CountingExporter(SpanExporter):
+        """Counts the spans the wrapped exporter delivered or failed to"""
+
+        def __init__(self, exporter):
+            self.exporter = exporter
+
+        def export(self, spans):
+            result = self.exporter.export(spans)
+            if result == SpanExportResult.SUCCESS:
+                counters.add(exported=len(spans))
+            else:
+                counters.add(export_failed=len(spans))
+            return result
+
+        def shutdown(self):
+            self.exporter.shutdown()
+
+        def force_flush(self, timeout_millis: int = 30000) -> bool:
+            return True
+
+    rng = random.Random(seed)
+    providers = []
+    tracers = []
+    for name in service_names(args.services):
+        provider = TracerProvider(resource=Resource(attributes={
+            "service.name": name,
+            "service.version": "1.0.0",
+            "deployment.environment": "loadtest",
+        }))
+        exporter = OTLPSpanExporter(
+            endpoint=f"{args.endpoint}/v1/traces",
+            compression=Compression.Gzip if args.gzip else Compression.NoCompression,
+        )
+        provider.add_span_processor(BatchSpanProcessor(
+            CountingExporter(exporter),
+            max_queue_size=args.queue_size,
+            max_export_batch_size=args.export_batch_size,
+            schedule_delay_millis=200,
+        ))
+        providers.append(provider)
+        tracers.append((name, provider.get_tracer("loadgen")))
+
+    n_services = len(tracers)
+    error = Status(StatusCode.ERROR)
+
+    def span(service: int, parent, level: int, start: int, end: int, attributes: dict) -> int:
+        name, tracer = tracers[service]
+        context = trace.set_span_in_context(parent) if parent is not None else None
+        s = tracer.start_span(
+            OPERATIONS.get(name, f"{name}.handle"), context=context, kind=SpanKind.SERVER,
+            attributes=attributes, start_time=start,
+        )
+        if rng.random() < args.error_rate:
+            s.set_status(error)
+        count = 1
+        if level + 1 < args.depth:
+            # Children call the next services one after another inside the parent
+            slot = (end - start) // args.fanout
+            for i in range(args.fanout):
+                child_start = start + i * slot + rng.randint(0, slot // 10)
+                count += span((service + 1 + i) % n_services, s, level + 1,
+                              child_start, child_start + slot * 8 // 10, attributes)
+        s.end(end_time=end)
+        return count
+
+    for due, next_tick in paced(rate, args.duration, counters):
+        spans = 0
+        now = time.time_ns()
+        for _ in range(due):
+            attributes = {"user.id": str(rng.randint(0, 10_000)), "order.id": str(rng.getrandbits(40))}
+            for k in range(2, args.attributes):
+                attributes[f"attr.{k}"] = f"value-{rng.randint(0, 1000)}"
+            duration = rng.randint(args.min_duration_ms, args.max_duration_ms) * 1_000_000
+            spans += span(0, None, 0, now - duration, now, attributes)
+        counters.add(traces=due, spans=spans)
+        time.sleep(max(next_tick - time.perf_counter(), 0))
+
+    for provider in providers:
+        # Exports what is still queued
+        provider.shutdown()
+
+
+# -- HTTP requests ------------------------------------------------------------
+
+async def run_http(args, rate: float, counters: Counters):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    in_flight = set()
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+
+        async def request(i: int):
+            started = time.perf_counter()
+            try:
+                response = await client.post(args.target, params={"order_id": f"load-{os.getpid()}-{i}"})
+                failed = response.status_code >= 500
+            except httpx.HTTPError:
+                failed = True
+            counters.add(
+                traces=1, request_errors=int(failed),
+                latency_us=int((time.perf_counter() - started) * 1_000_000),
+            )
+
+        i = 0
+        for due, next_tick in paced(rate, args.duration, counters):
+            for _ in range(due):
+                if len(in_flight) >= args.concurrency:
+                    counters.add(missed=1)
+                    continue
+                task = asyncio.create_task(request(i))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                i += 1
+            await asyncio.sleep(max(next_tick - time.perf_counter(), 0))
+        if in_flight:
+            await asyncio.wait(in_flight, timeout=args.timeout)
+
+
+# -- Driver -------------------------------------------------------------------
+
+def _worker(args, rate: float, seed: int, counters: Counters):
+    if args.mode == "synthetic":
+        run_synthetic(args, rate, seed, counters)
+    else:
+        asyncio.run(run_http(args, rate, counters))
+
+
+def collector_accepted_spans(url: Optional[str]) -> Optional[int]:
+    """Spans the collector admitted so far, from its (or its supervisor's) /stats"""
+    if not url:
+        return None
+    try:
+        stats = httpx.get(f"{url}/stats", timeout=2.0).json()
+    except (httpx.HTTPError, ValueError):
+        return None
+    stats = stats.get("total", stats)
+    services = (stats.get("admission") or {}).get("services") or {}
+    return sum(s.get("accepted_spans", 0) for s in services.values())
+
+
+def report(label: str, elapsed: float, current: dict, previous: dict, collector: Optional[int],
+           collector_previous: Optional[int], mode: str):
+    rates = {k: (current[k] - previous[k]) / elapsed for k in current}
+    line = f"[{label:>6}] {'traces' if mode == 'synthetic' else 'requests'}/s {rates['traces']:8.1f}"
+    if mode == "synthetic":
+        line += f"  spans/s {rates['spans']:9.1f}  exported/s {rates['exported']:9.1f}"
+        if current["export_failed"]:
+            line += f"  export failures {current['export_failed']}"
+    else:
+        requests = current["traces"] - previous["traces"]
+        latency = (current["latency_us"] - previous["latency_us"]) / requests / 1000 if requests else 0.0
+        line += f"  errors {current['request_errors'] - previous['request_errors']}  avg latency {latency:.1f}ms"
+    if collector is not None and collector_previous is not None:
+        line += f"  collector accepted/s {(collector - collector_previous) / elapsed:9.1f}"
+    if current["missed"]:
+        line += f"  missed {current['missed']}"
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("synthetic", "http"), default="synthetic")
+    parser.add_argument("--rate", type=float, default=1000, help="traces (synthetic) or requests (http) per second")
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--processes", type=int, default=1, help="driver processes sharing the rate")
+    parser.add_argument("--report-interval", type=float, default=5)
+    parser.add_argument("--collector", help="collector admin URL to read accepted spans from, e.g. http://localhost:8001")
+    synthetic = parser.add_argument_group("synthetic mode")
+    synthetic.add_argument("--endpoint", default=os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318"))
+    synthetic.add_argument("--services", type=int, default=len(SERVICES))
+    synthetic.add_argument("--fanout", type=int, default=3, help="calls made by every span above the last level")
+    synthetic.add_argument("--depth", type=int, default=3, help="levels of calls per trace")
+    synthetic.add_argument("--attributes", type=int, default=5, help="attributes per span")
+    synthetic.add_argument("--error-rate", type=float, default=0.05)
+    synthetic.add_argument("--min-duration-ms", type=int, default=10)
+    synthetic.add_argument("--max-duration-ms", type=int, default=500)
+    synthetic.add_argument("--gzip", action="store_true", help="gzip export requests")
+    synthetic.add_argument("--queue-size", type=int, default=100_000, help="spans buffered per service before dropping")
+    synthetic.add_argument("--export-batch-size", type=int, default=2048)
+    http = parser.add_argument_group("http mode")
+    http.add_argument("--target", default="http://localhost:8004/orders")
+    http.add_argument("--concurrency", type=int, default=500, help="requests in flight per process")
+    http.add_argument("--timeout", type=float, default=10)
+    args = parser.parse_args()
+
+    if args.mode == "synthetic":
+        per_trace = sum(args.fanout ** level for level in range(args.depth))
+        print(f"🚀 {args.rate:.0f} traces/s of {per_trace} spans over {args.services} services "
+              f"to {args.endpoint} for {args.duration:.0f}s ({args.processes} processes)")
+    else:
+        print(f"🚀 {args.rate:.0f} requests/s to {args.target} for {args.duration:.0f}s ({args.processes} processes)")
+
+    ctx = multiprocessing.get_context("fork")
+    counters = Counters(ctx)
+    rate = args.rate / args.processes
+    workers = [
+        ctx.Process(target=_worker, args=(args, rate, i, counters), daemon=True)
+        for i in range(args.processes)
+    ]
+    for worker in workers:
+        worker.start()
+
+    started = last = time.perf_counter()
+    previous = first = counters.snapshot()
+    collector_first = collector_previous = collector_accepted_spans(args.collector)
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=max(last + args.report_interval - time.perf_counter(), 0) / len(workers))
+            now = time.perf_counter()
+            if now - last >= args.report_interval:
+                current = counters.snapshot()
+                collector = collector_accepted_spans(args.collector)
+                report(f"{now - started:.0f}s", now - last, current, previous, collector, collector_previous, args.mode)
+                previous, collector_previous, last = current, collector, now
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+    elapsed = time.perf_counter() - started
+    total = counters.snapshot()
+    print("\n📊 Summary")
+    report("total", elapsed, total, first, collector_accepted_spans(args.collector), collector_first, args.mode)
+    if args.mode == "synthetic":
+        dropped = total["spans"] - total["exported"] - total["export_failed"]
+        print(f"spans generated {total['spans']}, exported {total['exported']}, "
+              f"failed {total['export_failed']}, dropped by the SDK queue {dropped}")
+    else:
+        print(f"requests {total['traces']}, errors {total['request_errors']}, missed {total['missed']}")
+
+
+if __name__ == "__main__":
+    main()
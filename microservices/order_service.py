@@ -6,9 +6,9 @@ from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+import asyncio
 import httpx
 import os
-import time
 import random
 
 # OpenTelemetry Setup
@@ -27,10 +27,34 @@ span_processor = BatchSpanProcessor(
 )
 trace.get_tracer_provider().add_span_processor(span_processor)
 
+AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8003")
+INVENTORY_SERVICE_URL = os.getenv("INVENTORY_SERVICE_URL", "http://inventory-service:8006")
+# Connections kept open to each downstream service
+DOWNSTREAM_MAX_CONNECTIONS = int(os.getenv("DOWNSTREAM_MAX_CONNECTIONS", "200"))
+
 app = FastAPI()
 FastAPIInstrumentor.instrument_app(app)
 HTTPXClientInstrumentor().instrument()
 
+# One long-lived client for every downstream call, created after
+# instrument() so its requests are traced
+http_client = None
+
+@app.on_event("startup")
+async def startup():
+    global http_client
+    http_client = httpx.AsyncClient(
+        timeout=5.0,
+        limits=httpx.Limits(
+            max_connections=DOWNSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=DOWNSTREAM_MAX_CONNECTIONS,
+        ),
+    )
+
+@app.on_event("shutdown")
+async def shutdown():
+    await http_client.aclose()
+
 @app.get("/")
 async def health():
     return {"status": "ok", "service": "order-service"}
@@ -43,26 +67,24 @@ async def create_order(order_id: str):
         try:
             # Call auth service
             with tracer.start_as_current_span("call.auth-service"):
-                async with httpx.AsyncClient(timeout=5.0) as client:
-                    auth_resp = await client.post(
-                        "http://auth-service:8003/login",
-                        params={"user_id": "user123"}
-                    )
-                    if auth_resp.status_code != 200:
-                        raise HTTPException(500, "Auth service failed")
+                auth_resp = await http_client.post(
+                    f"{AUTH_SERVICE_URL}/login",
+                    params={"user_id": "user123"}
+                )
+                if auth_resp.status_code != 200:
+                    raise HTTPException(500, "Auth service failed")
             
             # Call inventory
             with tracer.start_as_current_span("call.inventory-service"):
-                async with httpx.AsyncClient(timeout=5.0) as client:
-                    inv_resp = await client.post(
-                        "http://inventory-service:8006/check",
-                        params={"order_id": order_id}
-                    )
-                    if inv_resp.status_code != 200:
-                        raise HTTPException(409, "Inventory check failed")
+                inv_resp = await http_client.post(
+                    f"{INVENTORY_SERVICE_URL}/check",
+                    params={"order_id": order_id}
+                )
+                if inv_resp.status_code != 200:
+                    raise HTTPException(409, "Inventory check failed")
             
             # Simulate order processing
-            time.sleep(random.uniform(0.1, 0.5))
+            await asyncio.sleep(random.uniform(0.1, 0.5))
             
             # Random errors
             if random.random() < 0.05:
@@ -5,8 +5,8 @@ from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+import asyncio
 import os
-import time
 import random
 
 resource = Resource(attributes={
@@ -38,7 +38,7 @@ async def make_payment(order_id: str):
         span.set_attribute("payment.method", "credit_card")
         
         # Simulate payment processing
-        time.sleep(random.uniform(0.1, 0.4))
+        await asyncio.sleep(random.uniform(0.1, 0.4))
         
         # Random payment errors
         if random.random() < 0.1:
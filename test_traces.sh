@@ -97,7 +97,7 @@ echo ""
 
 # Test 6: ClickHouse verification
 echo -e "${YELLOW}6️⃣ Verifying ClickHouse data...${NC}"
-span_count=$(docker exec clickhouse clickhouse-client --query "SELECT count() FROM spans" 2>/dev/null)
+span_count=$(docker exec clickhouse clickhouse-client --query "SELECT count() FROM traces.spans" 2>/dev/null)
 if [ ! -z "$span_count" ]; then
     echo -e "${GREEN}✅ ClickHouse has $span_count spans stored${NC}"
 else